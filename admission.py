@@ -0,0 +1,175 @@
+# admission.py
+# Keeps job submissions within what the workers can serve:
+# * a token bucket per user and job type limits how fast one user can submit jobs;
+#   buckets live in Redis so every web process shares them (RATE_LIMIT_URL=memory://
+#   keeps them in-process, for tests and single-process setups). A batch larger than
+#   the burst is admitted once the bucket is full and leaves it in debt, so it is paid
+#   for at the type's rate before the user can submit again
+# * admission control rejects new jobs of a type while its estimated queue wait is above
+#   ADMISSION_MAX_QUEUE_WAIT, so queued jobs keep a bounded latency under overload
+# Rejections carry a Retry-After estimate in seconds.
+import math
+import os
+import threading
+import time
+
+from prometheus_client import Counter
+
+import job_store
+
+RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL', os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# job type -> (jobs per minute, burst size), overridable as RATE_LIMITS="image=20:10,3d_model=4:2"
+RATE_LIMITS = {
+    'image': (20, 10),
+    '3d_model': (4, 4),
+    'disney': (10, 10),
+    'sketch': (10, 10),
+}
+for _limit in os.environ.get('RATE_LIMITS', '').split(','):
+    if _limit.strip():
+        _job_type, _, _values = _limit.partition('=')
+        _per_minute, _, _burst = _values.partition(':')
+        RATE_LIMITS[_job_type.strip()] = (float(_per_minute), float(_burst or _per_minute))
+
+# Reject new jobs of a type once its queued jobs are estimated to wait longer than this (seconds, 0 = off)
+ADMISSION_MAX_QUEUE_WAIT = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', '600'))
+# Seconds a queue wait estimate is reused before the job database is asked again
+ADMISSION_ESTIMATE_TTL = float(os.environ.get('ADMISSION_ESTIMATE_TTL', '2'))
+# Processing time assumed for a job type that has no finished jobs yet
+DEFAULT_JOB_SECONDS = {'image': 30, '3d_model': 60, 'disney': 20, 'sketch': 20}
+
+REJECTIONS = Counter('job_admission_rejections_total', 'Job submissions rejected with 429, by job type and reason',
+                     ['type', 'reason'])
+
+# Refill the bucket for the time since the last call, then take cost tokens (unless take is 0)
+# if there are enough (all of the burst, for a cost above it; the bucket may go negative).
+# Returns {allowed, seconds until enough tokens are available}
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now, cost, take = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local needed = math.min(cost, burst)
+local allowed = 0
+local wait = 0
+if tokens >= needed then
+    if take == 1 then
+        tokens = tokens - cost
+    end
+    allowed = 1
+else
+    wait = (needed - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class Rejected(Exception):
+    """A submission that must be answered with 429 and a Retry-After of retry_after seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+_redis = None
+_script = None
+# (user_id, job_type) -> (tokens, updated_at), when not using Redis
+_buckets = {}
+_lock = threading.Lock()
+# job type -> (expires_at, estimated wait)
+_estimates = {}
+
+
+def _use_redis():
+    return RATE_LIMIT_URL.startswith(('redis://', 'rediss://', 'unix://'))
+
+
+def _take_tokens_redis(key, rate, burst, cost, take):
+    global _redis, _script
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(RATE_LIMIT_URL)
+        _script = _redis.register_script(TOKEN_BUCKET_SCRIPT)
+    allowed, wait = _script(keys=[key], args=[rate, burst, time.time(), cost, int(take)])
+    return bool(allowed), float(wait)
+
+
+def _take_tokens_memory(key, rate, burst, cost, take):
+    now = time.monotonic()
+    with _lock:
+        tokens, updated_at = _buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        needed = min(cost, burst)
+        if tokens >= needed:
+            _buckets[key] = (tokens - cost if take else tokens, now)
+            return True, 0.0
+        _buckets[key] = (tokens, now)
+        return False, (needed - tokens) / rate
+
+
+def check_rate_limit(user_id, job_type, cost=1, take=True):
+    """Take cost tokens from the user's bucket for job_type, raising Rejected if there aren't enough
+
+    A cost above the burst size is allowed once the bucket is full; the bucket is left
+    in debt for the rest, which delays the user's next jobs by cost / rate. With take
+    False the tokens are only checked for, e.g. before reading uploads whose jobs may not
+    be queued in the end.
+    """
+    if not RATE_LIMIT_ENABLED or job_type not in RATE_LIMITS:
+        return
+    per_minute, burst = RATE_LIMITS[job_type]
+
+    rate = per_minute / 60
+    key = f"rate_limit:{user_id}:{job_type}"
+    try:
+        if _use_redis():
+            allowed, wait = _take_tokens_redis(key, rate, burst, cost, take)
+        else:
+            allowed, wait = _take_tokens_memory(key, rate, burst, cost, take)
+    except Exception as e:
+        # An unreachable Redis must not take job submission down with it
+        print(f"Rate limiter unavailable, allowing request: {str(e)}")
+        return
+    if not allowed:
+        REJECTIONS.labels(job_type, 'rate_limit').inc()
+        raise Rejected(f"Rate limit exceeded: at most {per_minute:g} {job_type} jobs per minute", wait)
+
+
+def estimated_queue_wait(job_type):
+    """Seconds a job of job_type queued now is expected to wait before it starts
+
+    Queued jobs times the recent average processing time, divided by the number of jobs
+    of the type processing at once (the workers' observed concurrency).
+    """
+    now = time.monotonic()
+    cached = _estimates.get(job_type)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    queued = processing = 0
+    for active_type, status, count in job_store.count_active_jobs():
+        if active_type == job_type:
+            if status == 'queued':
+                queued = count
+            else:
+                processing = count
+    job_seconds = job_store.average_processing_seconds(job_type) or DEFAULT_JOB_SECONDS.get(job_type, 30)
+    wait = queued * job_seconds / max(1, processing)
+    _estimates[job_type] = (now + ADMISSION_ESTIMATE_TTL, wait)
+    return wait
+
+
+def check_admission(job_type):
+    """Raise Rejected while the queue of job_type is too long to admit another job"""
+    if ADMISSION_MAX_QUEUE_WAIT <= 0:
+        return
+    wait = estimated_queue_wait(job_type)
+    if wait > ADMISSION_MAX_QUEUE_WAIT:
+        REJECTIONS.labels(job_type, 'overload').inc()
+        raise Rejected(f"Too many {job_type} jobs are queued, estimated wait is {wait:.0f}s",
+                       wait - ADMISSION_MAX_QUEUE_WAIT)
@@ -1,21 +1,45 @@
 # app.py
-from flask import Flask, request, jsonify, send_file, send_from_directory
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from celery import Celery
-from celery.result import AsyncResult
-from celery.signals import worker_shutdown, task_revoked, task_failure
-import prometheus_client
-from prometheus_client import Counter, Gauge, Histogram
-import time
 import os
+import json
+import shutil
 import uuid
-import sqlite3
-from datetime import datetime, timedelta
-import subprocess
-import sys
+from datetime import timedelta
 from flask_cors import CORS
+import admission
+import config
+import generation_profiles
+import image_previews
+import job_events
+import job_metrics
+import job_store
+import job_tracing
+import mesh_packaging
+import result_cache
+import result_delivery
+import single_flight
+import thumbnails
+import triposr_client
+import upload_ingest
+import user_cache
+# The API only sends tasks by name; their code (tasks.py) is loaded by the workers
+from celery_app import send_job_task, send_job_tasks, task_spec
+
+# Page size limits for job listings
+JOBS_PAGE_SIZE = 50
+JOBS_MAX_PAGE_SIZE = 200
+# Most jobs one batch request may submit
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '50'))
+# Largest /api/upload/batch request: room for a full batch of files of the largest accepted size
+BATCH_UPLOAD_MAX_BYTES = int(os.environ.get('BATCH_UPLOAD_MAX_BYTES',
+                                            str(BATCH_MAX_JOBS * upload_ingest.UPLOAD_MAX_BYTES + 1024 * 1024)))
+
+# Job types created from an uploaded image, and how responses name them
+UPLOAD_JOB_NAMES = {'3d_model': '3D model generation', 'disney': 'disney transformation', 'sketch': 'sketch transformation'}
 
 # Allowed extensions for image upload
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
@@ -23,8 +47,49 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-OUTPUT_DIR_3D = '../TripoSR/uploads'
-COMFY_UI_DIR = '../ComfyUI'
+def caller_is_admin():
+    """Whether the caller is an admin, answered from the token's claims and the user cache"""
+    claims = get_jwt()
+    user = user_cache.get_user(get_jwt_identity())
+    if not user:
+        return False
+    # The role claim is only trusted while the user's role hasn't changed since login
+    if claims.get('role_version') == user['role_version']:
+        return bool(claims.get('is_admin'))
+    return bool(user['is_admin'])
+
+def thumbnail_urls(job_id, job_type, status):
+    """URLs of a finished image job's thumbnails, by size"""
+    if status != 'completed' or job_type == '3d_model':
+        return None
+    return {str(size): f"/api/result/{job_id}?size={size}" for size in thumbnails.THUMBNAIL_SIZES}
+
+def send_image(job_id, image_path, public=False):
+    """Send a finished image, or its thumbnail when ?size= is given"""
+    size = request.args.get('size', None, type=int)
+    if size is None:
+        return result_delivery.send_result(job_id, image_path, 'image/png', public=public)
+    if size not in thumbnails.THUMBNAIL_SIZES:
+        return jsonify({'error': f"size must be one of: {', '.join(map(str, thumbnails.THUMBNAIL_SIZES))}"}), 400
+    return result_delivery.send_result(job_id, thumbnails.get_thumbnail(image_path, size), thumbnails.mimetype(), public=public)
+
+def mark_result_used(job):
+    """Keep a finished job's output from age eviction while it is being fetched"""
+    if job['type'] == '3d_model':
+        # The mesh is {output_dir}/0/mesh.obj; eviction removes the whole output_dir
+        result_cache.mark_used(job['cache_key'], job['image_path'], os.path.dirname(os.path.dirname(job['image_path'])))
+    else:
+        result_cache.mark_used(job['cache_key'], job['image_path'])
+
+def get_page_args():
+    """Read the limit and before cursor of a paginated listing, raising ValueError if invalid"""
+    limit = request.args.get('limit', JOBS_PAGE_SIZE, type=int)
+    if limit < 1 or limit > JOBS_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {JOBS_MAX_PAGE_SIZE}")
+    before = request.args.get('before', None)
+    if before:
+        job_store.decode_cursor(before)
+    return limit, before
 
 app = Flask(__name__, static_folder="dist", static_url_path="/")
 
@@ -39,323 +104,146 @@ CORS(app, resources={
 
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'dev-secret-key')  # Change in production
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+# Only the Authorization header; status streams also accept ?jwt=, see stream_status
+app.config['JWT_TOKEN_LOCATION'] = ['headers']
+# Let Apache (mod_xsendfile) or lighttpd send result files instead of the app
+app.config['USE_X_SENDFILE'] = os.environ.get('RESULT_X_SENDFILE', '0') == '1'
+# Refuse request bodies that can't hold a valid upload (plus room for the multipart framing)
+# before they are read; upload_ingest enforces UPLOAD_MAX_BYTES on the file itself
+app.config['MAX_CONTENT_LENGTH'] = upload_ingest.UPLOAD_MAX_BYTES + 1024 * 1024
+
+# Seconds between keep-alives on status streams; the job row is re-checked on each one
+STATUS_STREAM_KEEPALIVE = 15
 
-# Configure Celery
-app.config['broker_url'] = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
-app.config['result_backend'] = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
-app.config['broker_connection_retry_on_startup'] = True
+class TracedJWTManager(JWTManager):
+    """Times decoding and verifying access tokens as the 'jwt_decode' stage of requests"""
+
+    def _decode_jwt_from_config(self, *args, **kwargs):
+        with job_tracing.span('jwt_decode'):
+            return super()._decode_jwt_from_config(*args, **kwargs)
 
 # Initialize JWT
-jwt = JWTManager(app)
+jwt = TracedJWTManager(app)
+
+# Time the stages of every request, see job_tracing.py
+@app.before_request
+def start_request_trace():
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    job_id = (request.view_args or {}).get('job_id')
+    g.trace = job_tracing.start_trace(
+        'http', endpoint, job_tracing.job_trace_id(job_id) if job_id else None,
+        method=request.method, job_id=job_id)
 
-# Initialize Celery
-celery = Celery(
-    app.name,
-    broker=app.config['broker_url'],
-    backend=app.config['result_backend']
-)
-celery.conf.update(app.config)
+@app.teardown_request
+def end_request_trace(exc=None):
+    handle = g.pop('trace', None)
+    if handle:
+        job_tracing.end_trace(handle)
 
 # Create output directory if it doesn't exist
 if not os.path.exists('output'):
     os.makedirs('output')
 
-# Set up prometheus metrics
-REQUESTS = Counter('image_generation_requests_total', 'Total number of image generation requests')
-QUEUE_SIZE = Gauge('image_generation_queue_size', 'Size of the image generation queue')
-QUEUE_SIZE.set(0)
-PROCESSING_TIME = Histogram('image_generation_processing_seconds', 'Time spent processing image generation')
-
 # Database initialization
-def init_db():
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    
-    # Create jobs table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS jobs (
-        id TEXT PRIMARY KEY,
-        type TEXT NOT NULL DEFAULT 'image',
-        prompt TEXT NOT NULL,
-        status TEXT NOT NULL,
-        created_at TIMESTAMP NOT NULL,
-        completed_at TIMESTAMP,
-        image_path TEXT,
-        user_id TEXT NOT NULL
-    )
-    ''')
-    
-    # Create users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        is_admin BOOLEAN NOT NULL DEFAULT 0
-    )
-    ''')
-    
-    # Create an admin user if it doesn't exist
-    cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-    if not cursor.fetchone():
-        admin_id = str(uuid.uuid4())
-        admin_password_hash = generate_password_hash('admin_password')  # Change in production
-        cursor.execute(
-            "INSERT INTO users (id, username, password_hash, is_admin) VALUES (?, ?, ?, ?)",
-            (admin_id, 'admin', admin_password_hash, True)
-        )
-    
-    conn.commit()
-    conn.close()
-
-init_db()
-
-@worker_shutdown.connect
-def worker_shutdown_handler(**kwargs):
-    print("Worker shutting down...")
-    
-@task_revoked.connect
-def task_revoked_handler(request=None, terminated=False, signum=None, **kwargs):
-    if terminated and request:
-        job_id = request.args[0] if request.args else None
-        if job_id:
-            try:
-                # Update the job status in the database
-                conn = sqlite3.connect('image_jobs.db')
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE jobs SET status = ?, completed_at = ? WHERE id = ?", 
-                    ("failed", datetime.now(), job_id)
-                )
-                conn.commit()
-                conn.close()
-                print(f"Updated job {job_id} as failed due to task termination")
-            except Exception as e:
-                print(f"Failed to update database for job {job_id}: {str(e)}")
-
-def get_queue_size():
-    inspector = celery.control.inspect()
-    active_tasks = inspector.active()
-    queued_tasks = inspector.reserved()
-    
-    length = 0
-    for tasks in active_tasks.values():
-        length += len(tasks)
-    for tasks in queued_tasks.values():
-        length += len(tasks)
-        
-    return length
+job_store.init_db()
 
-# Celery task for prompt-to-image generation
-@celery.task(bind=True, max_retries=3, soft_time_limit=600)
-def generate_image_task(self, job_id, prompt, user_id):
-    try:
-        # Update job status to processing
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ? WHERE id = ?", 
-            ("processing", job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        # Start monitoring processing time
-        start_time = time.time()
-        
-        # Import here to avoid loading model in the web process
-        from diffusers import DiffusionPipeline
-        import torch
-        import platform
-        
-        # Initialize the model
-        pipe = DiffusionPipeline.from_pretrained(
-            "stabilityai/stable-diffusion-xl-base-1.0", 
-            torch_dtype=torch.float16, 
-            use_safetensors=True, 
-            variant="fp16"
-        )
-        
-        if platform.system() != "Darwin":
-            pipe.to("cuda")
-        else:
-            pipe.to("mps")
-            
-        
-        # Generate image
-        image = pipe(prompt=prompt).images[0]
-        
-        # Save image
-        image_path = f"output/{job_id}.png"
-        image.save(image_path)
-        
-        # Record processing time
-        processing_time = time.time() - start_time
-        PROCESSING_TIME.observe(processing_time)
-        
-        # Update job as completed
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ?, image_path = ? WHERE id = ?", 
-            ("completed", datetime.now(), image_path, job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        return {"status": "completed", "image_path": image_path}
-    
-    except Exception as e:
-        # Update job as failed
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ? WHERE id = ?", 
-            ("failed", datetime.now(), job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        return {"status": "failed", "error": str(e)}
-    finally:
-        # Update gauge with current queue size
-        print("Decrementing queue size")
-        QUEUE_SIZE.dec(1)
-        
-# Celery task for 2D-to-3D model generation
-@celery.task(bind=True, max_retries=3, soft_time_limit=600)
-def generate_3d_model_task(self, job_id, file_path, user_id):
-    try:
-        # Update job status to processing
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ? WHERE id = ?", 
-            ("processing", job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        # Start monitoring processing time
-        start_time = time.time()
-        
-        # Run the script for 2D-3D model
-        print("Running 2D-to-3D script")
-        script = "../TripoSR/run.py"
-        
-        output_dir = f"{OUTPUT_DIR_3D}/{job_id}"
-        with app.app_context():
-            process = subprocess.Popen(
-                ["../TripoSR/.venv/bin/python", script, file_path, "--output-dir", output_dir],
-                cwd="../TripoSR",
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True  # Ensure the output is in text mode
-            )
-            
-            # Read stdout in real time
-            for line in process.stdout:
-                print(line, end='')  # Print the output in real time
-            
-            process.stdout.close()
-            process.wait()
-            
-            print("2D-to-3D Process completed")
-            
-            if process.returncode != 0:
-                stderr = process.stderr.read()
-                process.stderr.close()
-                return {"status": "failed", "error": f"Failed to generate image: {stderr.strip()}"}
-        
-        # Record processing time
-        processing_time = time.time() - start_time
-        PROCESSING_TIME.observe(processing_time)
-        
-        # Update job as completed
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ?, image_path = ? WHERE id = ?", 
-            ("completed", datetime.now(), output_dir + "/0/mesh.obj", job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        return {"status": "completed", "output_dir": output_dir}
-    
-    except Exception as e:
-        # Update job as failed
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ? WHERE id = ?", 
-            ("failed", datetime.now(), job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        return {"status": "failed", "error": str(e)}
-    finally:
-        # Update gauge with current queue size
-        print("Decrementing queue size")
-        QUEUE_SIZE.dec(1)
-        
-# Celery task for ComfyUI
-@celery.task(bind=True, max_retries=3, soft_time_limit=600)
-def runComfyUI(self, job_id, file_name, user_id, type):
-    try:
-        # Update job status to processing
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ? WHERE id = ?", 
-            ("processing", job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        # Run the script for 2D-3D model
-        print("Running 2D-to-2D script")
-        script = f"{COMFY_UI_DIR}/{type}.py"
-        
-        output_dir = f"{COMFY_UI_DIR}/output/{type}_{job_id}_00001.png"
-        with app.app_context():
-            process = subprocess.Popen(
-                [f"{COMFY_UI_DIR}/.venv/bin/python", script, file_name, job_id],
-                cwd=f"{COMFY_UI_DIR}",
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True  # Ensure the output is in text mode
-            )
-            
-            # Read stdout in real time
-            for line in process.stdout:
-                print(line, end='')  # Print the output in real time
-            
-            process.stdout.close()
-            process.wait()
-            
-            print("{type} job sent to ComfyUI")
-            
-            if process.returncode != 0:
-                stderr = process.stderr.read()
-                process.stderr.close()
-                return {"status": "failed", "error": f"Failed to generate image: {stderr.strip()}"}
-        
-        return {"status": "sent", "output_dir": output_dir}
-    
-    except Exception as e:
-        # Update job as failed
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ? WHERE id = ?", 
-            ("failed", datetime.now(), job_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        return {"status": "failed", "error": str(e)}
+def image_cache_key(prompt, params):
+    """Result cache key of a text-to-image job: the same prompt with the same model, parameters and seed"""
+    model_id = generation_profiles.PROFILES[params['profile']]['model_id']
+    settings = {name: value for name, value in params.items() if name not in ('profile', 'seed')}
+    return result_cache.cache_key("image", model_id, result_cache.normalize_prompt(prompt), settings, params['seed'])
+
+def ingest_upload(file, job_type, job_id):
+    """Store an uploaded image as the input of a new job; returns (input path, result cache key)"""
+    if job_type == '3d_model':
+        # Always a PNG after ingestion, whatever the upload's extension
+        file_path = os.path.join(config.OUTPUT_DIR_3D, job_id, os.path.splitext(secure_filename(file.filename))[0] + '.png')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            digest = upload_ingest.ingest(file, file_path, job_type)
+        except upload_ingest.UploadRejected:
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+            raise
+        return file_path, result_cache.cache_key(job_type, triposr_client.TRIPOSR_MODEL_ID, digest)
+    
+    # store the image into ComfyUI's input folder
+    file_path = os.path.join(config.COMFY_UI_DIR, "input", f"{job_id}.png")
+    digest = upload_ingest.ingest(file, file_path, job_type)
+    return file_path, result_cache.cache_key(job_type, "comfyui", digest)
+
+def discard_upload(job_type, file_path):
+    """Remove the input of a job that won't run (cached result or rejected)"""
+    if job_type == '3d_model':
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+    else:
+        os.remove(file_path)
+
+def upload_job_task(job_type, job_id, file_path, user_id, cache_key):
+    """(task spec, image path) of a new job on an uploaded image"""
+    if job_type == '3d_model':
+        return task_spec(config.TASK_3D_MODEL, (job_id, file_path, user_id), {'cache_key': cache_key}), file_path
+    output_path = f"{config.COMFY_UI_DIR}/output/{job_type}_{job_id}_00001_.png"
+    return task_spec(config.TASK_COMFYUI, (job_id, f"{job_id}.png", user_id, job_type), {'cache_key': cache_key}), output_path
+
+def queued_job_count(rows):
+    """How many of a batch's create_job rows will get a Celery task
+
+    Rows without a task are answered from the result cache, and rows whose result an
+    identical in-flight job (or an earlier row) computes follow it.
+    """
+    cache_keys = [row['cache_key'] for row in rows if 'task' in row]
+    if not single_flight.SINGLE_FLIGHT_ENABLED:
+        return len(cache_keys)
+    return sum(1 for cache_key in set(cache_keys) if not single_flight.find_leader(cache_key))
+
+def admit_jobs(user_id, job_type, count):
+    """Admission control and the caller's rate limit for count new jobs that will be queued"""
+    if count:
+        admission.check_admission(job_type)
+        # Only queued work is charged: rejected requests, cache hits and jobs that share
+        # an identical job's result take no rate limit tokens
+        if not caller_is_admin():
+            admission.check_rate_limit(user_id, job_type, cost=count)
+
+def create_batch(user_id, rows):
+    """Create a batch's jobs in one transaction, then queue the tasks of those that have to run as one group
+
+    rows are create_job arguments; rows without a task are already completed. Returns the id
+    and status of each job.
+    """
+    leaders = single_flight.create_jobs(rows)
+    specs = [row['task'] for row, leader in zip(rows, leaders) if 'task' in row and not leader]
+    if specs:
+        send_job_tasks(specs, user_id)
+    return [{'job_id': row['job_id'], 'status': leader['status'] if leader else row.get('status', 'queued')}
+            for row, leader in zip(rows, leaders)]
+
+def job_status(job):
+    return {
+        'job_id': job['id'],
+        'type': job['type'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'completed_at': job['completed_at'],
+        'progress': job['progress'],
+        'attempts': job['attempts'],
+        'error': job['error']
+    }
+
+@app.errorhandler(admission.Rejected)
+def handle_rejected(e):
+    # Rate limited or overloaded: tell the client when to try again
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.errorhandler(upload_ingest.UploadRejected)
+def handle_upload_rejected(e):
+    return jsonify({'error': str(e)}), e.status_code
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    return jsonify({'error': f'Request is larger than {request.max_content_length} bytes'}), 413
 
 @app.route("/")
 def serve_react():
@@ -365,19 +253,11 @@ def serve_react():
 @app.route('/api/metrics')
 @jwt_required()
 def metrics():
-    user_id = get_jwt_identity()
-    
     # Check if user is admin
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if not result or not result[0]:
+    if not caller_is_admin():
         return jsonify({"error": "Unauthorized"}), 403
     
-    return prometheus_client.generate_latest()
+    return job_metrics.generate_latest()
 
 # Authentication routes
 @app.route('/api/register', methods=['POST'])
@@ -391,22 +271,14 @@ def register():
     password = data['password']
     
     # Check if user already exists
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    if cursor.fetchone():
-        conn.close()
+    if job_store.get_user_by_username(username):
         return jsonify({"error": "Username already exists"}), 409
     
     # Create new user
     user_id = str(uuid.uuid4())
-    password_hash = generate_password_hash(password)
-    cursor.execute(
-        "INSERT INTO users (id, username, password_hash, is_admin) VALUES (?, ?, ?, ?)",
-        (user_id, username, password_hash, False)
-    )
-    conn.commit()
-    conn.close()
+    with job_tracing.span('password_hash'):
+        password_hash = generate_password_hash(password)
+    job_store.create_user(user_id, username, password_hash)
     
     return jsonify({"message": "User registered successfully"}), 201
 
@@ -421,17 +293,19 @@ def login():
     password = data['password']
     
     # Check credentials
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
-    result = cursor.fetchone()
-    conn.close()
+    user = job_store.get_user_by_username(username)
+    with job_tracing.span('password_hash'):
+        valid = bool(user) and check_password_hash(user['password_hash'], password)
     
-    if not result or not check_password_hash(result[1], password):
+    if not valid:
         return jsonify({"error": "Invalid credentials"}), 401
     
-    # Create access token
-    access_token = create_access_token(identity=result[0])
+    # Create access token. The role travels in the token so read endpoints can
+    # authorize without looking the user up
+    access_token = create_access_token(identity=user['id'], additional_claims={
+        'is_admin': bool(user['is_admin']),
+        'role_version': user['role_version']
+    })
     
     return jsonify({"access_token": access_token})
 
@@ -446,26 +320,43 @@ def generate_image():
         return jsonify({'error': 'Prompt is required'}), 400
     
     prompt = data['prompt']
+    try:
+        params = generation_profiles.parse_params(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     job_id = str(uuid.uuid4())
     
     # Increment request counter
-    REQUESTS.inc()
+    job_metrics.REQUESTS.labels("image").inc()
+    
+    # The same prompt with the same model, parameters and seed is answered from the result cache
+    cache_key = image_cache_key(prompt, params)
+    cached_path = result_cache.lookup(cache_key, "image")
+    if cached_path:
+        job_store.create_job(job_id, "image", prompt, user_id, image_path=cached_path, status="completed",
+                             cache_key=cache_key, params=params)
+        return jsonify({
+            'job_id': job_id,
+            'status': 'completed',
+            'message': 'Image was served from the result cache'
+        })
     
-    # Increment queue size
-    QUEUE_SIZE.inc()
+    # Only queue more work while the queue can serve it in reasonable time. Joining an
+    # identical job that is already queued or running adds no work
+    admit_jobs(user_id, "image", 0 if single_flight.find_leader(cache_key) else 1)
     
     # Save job to database
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO jobs (id, prompt, status, created_at, user_id) VALUES (?, ?, ?, ?, ?)",
-        (job_id, prompt, "queued", datetime.now(), user_id)
-    )
-    conn.commit()
-    conn.close()
+    job_task = task_spec(config.TASK_IMAGE, (job_id, prompt, user_id), {'cache_key': cache_key, 'params': params})
+    leader = single_flight.create_job(job_id, "image", prompt, user_id, cache_key, params=params, task=job_task)
+    if leader:
+        return jsonify({
+            'job_id': job_id,
+            'status': leader['status'],
+            'message': 'An identical image generation job is in progress, this job shares its result'
+        })
     
     # Queue the Celery task
-    task = generate_image_task.delay(job_id, prompt, user_id)
+    task = send_job_task(job_task, user_id)
     
     return jsonify({
         'job_id': job_id,
@@ -473,6 +364,45 @@ def generate_image():
         'message': 'Image generation job has been queued'
     })
     
+# Endpoint for submitting several prompts at once
+@app.route('/api/generate/batch', methods=['POST'])
+@jwt_required()
+def generate_images_batch():
+    user_id = get_jwt_identity()
+    data = request.json
+    
+    if not data or not isinstance(data.get('jobs'), list) or not 1 <= len(data['jobs']) <= BATCH_MAX_JOBS:
+        return jsonify({'error': f'jobs must be a list of 1 to {BATCH_MAX_JOBS} generation requests'}), 400
+    
+    # Validate every job first: one invalid job rejects the batch
+    jobs = []
+    for index, job in enumerate(data['jobs']):
+        if not isinstance(job, dict) or not job.get('prompt'):
+            return jsonify({'error': f'jobs[{index}]: Prompt is required'}), 400
+        try:
+            jobs.append((job['prompt'], generation_profiles.parse_params(job)))
+        except ValueError as e:
+            return jsonify({'error': f'jobs[{index}]: {str(e)}'}), 400
+    
+    job_metrics.REQUESTS.labels("image").inc(len(jobs))
+    
+    rows = []
+    for prompt, params in jobs:
+        job_id = str(uuid.uuid4())
+        cache_key = image_cache_key(prompt, params)
+        cached_path = result_cache.lookup(cache_key, "image")
+        if cached_path:
+            rows.append({'job_id': job_id, 'job_type': 'image', 'prompt': prompt, 'user_id': user_id,
+                         'image_path': cached_path, 'status': 'completed', 'cache_key': cache_key, 'params': params})
+        else:
+            job_task = task_spec(config.TASK_IMAGE, (job_id, prompt, user_id), {'cache_key': cache_key, 'params': params})
+            rows.append({'job_id': job_id, 'job_type': 'image', 'prompt': prompt, 'user_id': user_id,
+                         'cache_key': cache_key, 'params': params, 'task': job_task})
+    
+    admit_jobs(user_id, "image", queued_job_count(rows))
+    
+    return jsonify({'jobs': create_batch(user_id, rows)})
+    
 # Endpoint for uploading images
 @app.route('/api/upload', methods=['POST'])
 @jwt_required()
@@ -494,99 +424,228 @@ def upload_image():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):        
+        if not caller_is_admin():
+            # Refuse before reading the upload if the caller is out of tokens; they are
+            # taken only once the job is queued
+            admission.check_rate_limit(user_id, job_type, take=False)
         filename = secure_filename(file.filename)
         job_id = str(uuid.uuid4())
         
-        # 3D model: Save job to database
-        if job_type == '3d_model':
-            file_path = os.path.join(OUTPUT_DIR_3D, job_id, filename)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            file.save(file_path)
-            
-            # Increment request counter
-            REQUESTS.inc()
-            
-            conn = sqlite3.connect('image_jobs.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO jobs (id, type, prompt, status, created_at, image_path, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (job_id, "3d_model", filename, "queued", datetime.now(), file_path, user_id)
-            )
-            conn.commit()
-            conn.close()
-            
-            # Queue the Celery task
-            task = generate_3d_model_task.delay(job_id, file_path, user_id)
-            
+        # Increment request counter
+        job_metrics.REQUESTS.labels(job_type).inc()
+        
+        file_path, cache_key = ingest_upload(file, job_type, job_id)
+        
+        # The same image was processed the same way before: reuse its output
+        cached_path = result_cache.lookup(cache_key, job_type)
+        if cached_path:
+            discard_upload(job_type, file_path)
+            job_store.create_job(job_id, job_type, filename, user_id, image_path=cached_path, status="completed", cache_key=cache_key)
             return jsonify({
                 'job_id': job_id,
-                'task_id': task.id,
-                'status': 'queued',
-                'message': '3D model generation job has been queued'
+                'status': 'completed',
+                'message': f'{UPLOAD_JOB_NAMES[job_type]} was served from the result cache'
             })
-        else:
-            # store the image into ComfyUI's input folder
-            file_path = os.path.join(COMFY_UI_DIR, "input", f"{job_id}.png")
-            file.save(file_path)
-                        
-            output_path = f"{COMFY_UI_DIR}/output/{job_type}_{job_id}_00001_.png"
-            print(f"Output path: {output_path}")
-            
-            conn = sqlite3.connect('image_jobs.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO jobs (id, type, prompt, status, created_at, image_path, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (job_id, job_type, filename, "queued", datetime.now(), output_path, user_id)
-            )
-            conn.commit()
-            conn.close()
-            
-            # Queue the Celery task
-            task = runComfyUI.delay(job_id, f"{job_id}.png", user_id, job_type)
-            
+        
+        try:
+            admit_jobs(user_id, job_type, 0 if single_flight.find_leader(cache_key) else 1)
+        except admission.Rejected:
+            discard_upload(job_type, file_path)
+            raise
+        
+        # The upload is kept even when an identical job computes the result, so the job can be retried on its own
+        job_task, image_path = upload_job_task(job_type, job_id, file_path, user_id, cache_key)
+        leader = single_flight.create_job(job_id, job_type, filename, user_id, cache_key, image_path=image_path, task=job_task)
+        if leader:
             return jsonify({
                 'job_id': job_id,
-                'task_id': task.id,
-                'status': 'queued',
-                'message': f'{job_type} transformation job has been queued'
+                'status': leader['status'],
+                'message': f'An identical {UPLOAD_JOB_NAMES[job_type]} job is in progress, this job shares its result'
             })
+        
+        # Queue the Celery task
+        task = send_job_task(job_task, user_id)
+        
+        return jsonify({
+            'job_id': job_id,
+            'task_id': task.id,
+            'status': 'queued',
+            'message': f'{UPLOAD_JOB_NAMES[job_type]} job has been queued'
+        })
     else:
         return jsonify({'error': 'Invalid file type'}), 400
 
+# Endpoint for uploading several images for the same job type at once
+@app.route('/api/upload/batch', methods=['POST'])
+@jwt_required()
+def upload_images_batch():
+    # Before the form is parsed: the app-wide limit only fits one file
+    request.max_content_length = BATCH_UPLOAD_MAX_BYTES
+    user_id = get_jwt_identity()
+    files = request.files.getlist('files')
+    job_type = request.form.get('job_type')
+    
+    if job_type not in UPLOAD_JOB_NAMES:
+        return jsonify({'error': 'Supported job type is required'}), 400
+    if not files or len(files) > BATCH_MAX_JOBS:
+        return jsonify({'error': f'Between 1 and {BATCH_MAX_JOBS} files are required'}), 400
+    for file in files:
+        if not allowed_file(file.filename):
+            return jsonify({'error': f'Invalid file type: {file.filename}'}), 400
+    
+    if not caller_is_admin():
+        # Refuse before reading the uploads if the caller is out of tokens; only the
+        # jobs that are queued take them
+        admission.check_rate_limit(user_id, job_type, cost=len(files), take=False)
+    job_metrics.REQUESTS.labels(job_type).inc(len(files))
+    
+    # Ingest every file first: one rejected file rejects the batch
+    uploads = []
+    try:
+        for file in files:
+            job_id = str(uuid.uuid4())
+            try:
+                file_path, cache_key = ingest_upload(file, job_type, job_id)
+            except upload_ingest.UploadRejected as e:
+                raise upload_ingest.UploadRejected(f'{file.filename}: {str(e)}', e.status_code, e.reason)
+            uploads.append((job_id, secure_filename(file.filename), file_path, cache_key))
+        
+        rows = []
+        for job_id, filename, file_path, cache_key in uploads:
+            cached_path = result_cache.lookup(cache_key, job_type)
+            if cached_path:
+                discard_upload(job_type, file_path)
+                rows.append({'job_id': job_id, 'job_type': job_type, 'prompt': filename, 'user_id': user_id,
+                             'image_path': cached_path, 'status': 'completed', 'cache_key': cache_key})
+            else:
+                job_task, image_path = upload_job_task(job_type, job_id, file_path, user_id, cache_key)
+                rows.append({'job_id': job_id, 'job_type': job_type, 'prompt': filename, 'user_id': user_id,
+                             'image_path': image_path, 'cache_key': cache_key, 'task': job_task})
+        
+        admit_jobs(user_id, job_type, queued_job_count(rows))
+    except (upload_ingest.UploadRejected, admission.Rejected):
+        for _, _, file_path, _ in uploads:
+            if os.path.exists(file_path):
+                discard_upload(job_type, file_path)
+        raise
+    
+    return jsonify({'jobs': create_batch(user_id, rows)})
+
 @app.route('/api/status/<job_id>', methods=['GET'])
 @jwt_required()
 def get_status(job_id):
     user_id = get_jwt_identity()
     
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, status, created_at, completed_at, user_id FROM jobs WHERE id = ?", (job_id,))
-    result = cursor.fetchone()
-    conn.close()
+    job = job_store.get_job(job_id)
     
-    if not result:
+    if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    type, status, created_at, completed_at, job_user_id = result
+    # Check if user owns this job or is admin
+    if job['user_id'] != user_id and not caller_is_admin():
+        return jsonify({'error': 'Unauthorized access to this job'}), 403
     
-    # Check if user owns this job
-    if job_user_id != user_id:
-        # Check if user is admin
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-        admin_result = cursor.fetchone()
-        conn.close()
-        
-        if not admin_result or not admin_result[0]:
-            return jsonify({'error': 'Unauthorized access to this job'}), 403
+    return jsonify(job_status(job))
+
+@app.route('/api/status', methods=['GET'])
+@jwt_required()
+def get_statuses():
+    """Status of several jobs at once, ?ids=<id>,<id>,..."""
+    user_id = get_jwt_identity()
+    job_ids = [job_id for job_id in request.args.get('ids', '').split(',') if job_id]
     
-    return jsonify({
-        'job_id': job_id,
-        'type': type,
-        'status': status,
-        'created_at': created_at,
-        'completed_at': completed_at
+    if not job_ids or len(job_ids) > JOBS_MAX_PAGE_SIZE:
+        return jsonify({'error': f'Between 1 and {JOBS_MAX_PAGE_SIZE} job ids are required'}), 400
+    
+    jobs = {job['id']: job for job in job_store.get_jobs(job_ids)}
+    is_admin = any(job['user_id'] != user_id for job in jobs.values()) and caller_is_admin()
+    
+    statuses = []
+    for job_id in job_ids:
+        job = jobs.get(job_id)
+        # Other users' jobs are reported like missing ones
+        if not job or (job['user_id'] != user_id and not is_admin):
+            statuses.append({'job_id': job_id, 'error': 'Job not found'})
+        else:
+            statuses.append(job_status(job))
+    
+    return jsonify({'jobs': statuses})
+
+@app.route('/api/preview/<job_id>', methods=['GET'])
+@jwt_required()
+def get_preview(job_id):
+    """Latest intermediate preview of a running text-to-image job"""
+    user_id = get_jwt_identity()
+    
+    job = job_store.get_job(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Check if user owns this job or is admin
+    if job['user_id'] != user_id and not caller_is_admin():
+        return jsonify({'error': 'Unauthorized access to this job'}), 403
+    
+    # A follower shows the preview of the job computing its result
+    preview_path = image_previews.preview_path(job['leader_id'] or job_id)
+    if job['status'] != 'processing' or not os.path.exists(preview_path):
+        return jsonify({'error': 'No preview available', 'status': job['status'], 'progress': job['progress']}), 404
+    
+    # The preview changes as the job runs: clients must revalidate (ETag) on every fetch
+    return send_file(os.path.abspath(preview_path), mimetype='image/webp', max_age=0)
+
+# Browsers' EventSource can't set headers, so this endpoint alone also takes the token
+# as ?jwt= (query strings end up in access logs and Referer headers)
+@app.route('/api/status/<job_id>/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_status(job_id):
+    """Server-Sent Events stream of the job's status until it completes or fails"""
+    user_id = get_jwt_identity()
+    
+    # Subscribe before reading the row so no transition is missed in between
+    subscription = job_events.subscribe(job_id)
+    job = job_store.get_job(job_id)
+    
+    if not job:
+        subscription.close()
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Check if user owns this job or is admin
+    if job['user_id'] != user_id and not caller_is_admin():
+        subscription.close()
+        return jsonify({'error': 'Unauthorized access to this job'}), 403
+    
+    def status_event(job):
+        return {'job_id': job_id, 'type': job['type'], 'status': job['status'],
+                'created_at': job['created_at'], 'completed_at': job['completed_at'],
+                'progress': job['progress']}
+    
+    def events(event):
+        try:
+            last_status = None
+            while True:
+                if event is not None and event['status'] != last_status:
+                    last_status = event['status']
+                    yield f"event: status\ndata: {json.dumps(event)}\n\n"
+                    if last_status in job_events.TERMINAL_STATUSES:
+                        return
+                elif event is not None and 'preview' in event:
+                    # Progress report of the running job; preview is true when /api/preview has a new image
+                    yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+                
+                event = subscription.get(timeout=STATUS_STREAM_KEEPALIVE)
+                if event is None:
+                    # Nothing published for a while: keep the connection open and
+                    # re-check the row in case an event was lost
+                    yield ": keep-alive\n\n"
+                    job = job_store.get_job(job_id)
+                    event = status_event(job) if job else None
+        finally:
+            subscription.close()
+    
+    return Response(events(status_event(job)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let a reverse proxy buffer the stream
     })
 
 @app.route('/api/result/<job_id>', methods=['GET'])
@@ -594,28 +653,16 @@ def get_status(job_id):
 def get_result(job_id):
     user_id = get_jwt_identity()
     
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, status, image_path, user_id FROM jobs WHERE id = ?", (job_id,))
-    result = cursor.fetchone()
-    conn.close()
+    job = job_store.get_job(job_id)
     
-    if not result:
+    if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    type, status, image_path, job_user_id = result
+    type, status, image_path = job['type'], job['status'], job['image_path']
     
-    # Check if user owns this job
-    if job_user_id != user_id:
-        # Check if user is admin
-        conn = sqlite3.connect('image_jobs.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-        admin_result = cursor.fetchone()
-        conn.close()
-        
-        if not admin_result or not admin_result[0]:
-            return jsonify({'error': 'Unauthorized access to this job'}), 403
+    # Check if user owns this job or is admin
+    if job['user_id'] != user_id and not caller_is_admin():
+        return jsonify({'error': 'Unauthorized access to this job'}), 403
     
     if status != 'completed':
         return jsonify({
@@ -625,27 +672,31 @@ def get_result(job_id):
         })
     
     if os.path.exists(image_path):
+        mark_result_used(job)
         if type == '3d_model':
-            # Zip the output directory
-            # Directly send the .obj file back
-            return send_file(image_path, mimetype='application/octet-stream', as_attachment=True, download_name=f'{job_id}.obj')
+            # Send the mesh in the requested format, packaged after reconstruction
+            mesh_format = request.args.get('format', mesh_packaging.DEFAULT_MESH_FORMAT)
+            if mesh_format not in mesh_packaging.MESH_FORMATS:
+                return jsonify({'error': f"format must be one of: {', '.join(mesh_packaging.MESH_FORMATS)}"}), 400
+            try:
+                artifact_path = mesh_packaging.get_artifact(image_path, mesh_format)
+            except Exception as e:
+                return jsonify({'error': f'Failed to package 3D model: {str(e)}'}), 500
+            mimetype, _ = mesh_packaging.MESH_FORMATS[mesh_format]
+            return result_delivery.send_result(job_id, artifact_path, mimetype, as_attachment=True, download_name=f'{job_id}.{mesh_format}')
         else:
-            return send_file(image_path, mimetype='image/png')
+            return send_image(job_id, image_path)
     else:
         return jsonify({'error': 'Image file not found'}), 404
     
 @app.route('/api/share/<job_id>', methods=['GET'])
 def share_result(job_id):
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, status, image_path FROM jobs WHERE id = ?", (job_id,))
-    result = cursor.fetchone()
-    conn.close()
+    job = job_store.get_job(job_id)
     
-    if not result:
+    if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    type, status, image_path = result
+    type, status, image_path = job['type'], job['status'], job['image_path']
     
     if status != 'completed':
         return jsonify({
@@ -655,15 +706,16 @@ def share_result(job_id):
         })
     
     if os.path.exists(image_path):
+        mark_result_used(job)
         if type == '3d_model':
             # send back the input image
             input_image_path = os.path.join(os.path.dirname(image_path), "input.png")
             if os.path.exists(input_image_path):
-                return send_file(input_image_path, mimetype='image/png', as_attachment=True, download_name=f'{job_id}_input.png')
+                return result_delivery.send_result(job_id, input_image_path, 'image/png', as_attachment=True, download_name=f'{job_id}_input.png', public=True)
             else:
                 return jsonify({'error': 'Input image file not found'}), 404
         elif type == 'image':
-            return send_file(image_path, mimetype='image/png')
+            return send_image(job_id, image_path, public=True)
     else:
         return jsonify({'error': 'Image file not found'}), 404
     
@@ -672,40 +724,32 @@ def share_result(job_id):
 def retry_job(job_id):
     user_id = get_jwt_identity()
     
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT prompt, status, user_id FROM jobs WHERE id = ?", (job_id,))
-    result = cursor.fetchone()
+    job = job_store.get_job(job_id)
     
-    if not result:
-        conn.close()
+    if not job:
         return jsonify({'error': 'Job not found'}), 404
     
-    prompt, status, job_user_id = result
+    prompt, status = job['prompt'], job['status']
     
     # Check ownership or admin privileges
-    if job_user_id != user_id:
-        cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-        admin_result = cursor.fetchone()
-        if not admin_result or not admin_result[0]:
-            conn.close()
-            return jsonify({'error': 'Unauthorized access to this job'}), 403
+    if job['user_id'] != user_id and not caller_is_admin():
+        return jsonify({'error': 'Unauthorized access to this job'}), 403
     
     # Can only retry failed jobs
     if status != 'failed':
-        conn.close()
         return jsonify({'error': f'Cannot retry job with status: {status}'}), 400
     
+    admission.check_admission(job['type'])
+    
     # Update job status back to queued
-    cursor.execute(
-        "UPDATE jobs SET status = ?, completed_at = NULL, image_path = NULL WHERE id = ?",
-        ("queued", job_id)
-    )
-    conn.commit()
-    conn.close()
+    job_store.requeue_job(job_id)
     
-    # Queue the task again
-    task = generate_image_task.delay(job_id, prompt, user_id)
+    # Queue the task again. Jobs from before tasks were stored with the job are text-to-image jobs
+    if job['task']:
+        job_task = json.loads(job['task'])
+    else:
+        job_task = task_spec(config.TASK_IMAGE, (job_id, prompt, job['user_id']), {'cache_key': job['cache_key']})
+    task = send_job_task(job_task, job['user_id'])
     
     return jsonify({
         'job_id': job_id,
@@ -720,30 +764,15 @@ def get_user_jobs():
     user_id = get_jwt_identity()
     job_type = request.args.get('type', None)  # Optional query parameter for filtering by type
 
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-
-    if job_type:
-        if job_type == "pic_transform":
-            cursor.execute(
-                "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? AND type IN ('disney', 'sketch') ORDER BY created_at DESC",
-                (user_id,)
-            )
-        else:
-            cursor.execute(
-                "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? AND type = ? ORDER BY created_at DESC",
-                (user_id, job_type)
-            )
-    else:
-        cursor.execute(
-            "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,)
-        )
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    jobs = cursor.fetchall()
-    conn.close()
+    jobs, next_cursor = job_store.list_user_jobs(user_id, job_type, limit, before)
 
     return jsonify({
+        'next_cursor': next_cursor,
         'jobs': [
             {
                 'job_id': job[0],
@@ -751,7 +780,8 @@ def get_user_jobs():
                 'prompt': job[2],
                 'status': job[3],
                 'created_at': job[4],
-                'completed_at': job[5]
+                'completed_at': job[5],
+                'thumbnails': thumbnail_urls(job[0], job[1], job[3])
             }
             for job in jobs
         ]
@@ -761,24 +791,20 @@ def get_user_jobs():
 @app.route('/api/admin/jobs', methods=['GET'])
 @jwt_required()
 def admin_get_all_jobs():
-    user_id = get_jwt_identity()
-    
     # Check if user is admin
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-    result = cursor.fetchone()
-    
-    if not result or not result[0]:
-        conn.close()
+    if not caller_is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    # Get all jobs
-    cursor.execute("SELECT id, prompt, status, created_at, completed_at, user_id FROM jobs ORDER BY created_at DESC")
-    jobs = cursor.fetchall()
-    conn.close()
+    try:
+        limit, before = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Get one page of all jobs
+    jobs, next_cursor = job_store.list_all_jobs(limit, before)
     
     return jsonify({
+        'next_cursor': next_cursor,
         'jobs': [
             {
                 'job_id': job[0],
@@ -792,7 +818,46 @@ def admin_get_all_jobs():
         ]
     })
 
+# Admin endpoint to move a user to another priority lane
+@app.route('/api/admin/users/<target_user_id>/lane', methods=['PUT'])
+@jwt_required()
+def admin_set_user_lane(target_user_id):
+    # Check if user is admin
+    if not caller_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.json
+    if not data or data.get('lane') not in config.LANE_PRIORITIES:
+        return jsonify({'error': f'lane must be one of: {", ".join(config.LANE_PRIORITIES)}'}), 400
+    
+    if not job_store.set_user_lane(target_user_id, data['lane']):
+        return jsonify({'error': 'User not found'}), 404
+    user_cache.invalidate(target_user_id)
+    
+    return jsonify({'user_id': target_user_id, 'lane': data['lane']})
+
+# Admin endpoint to grant or revoke admin rights
+@app.route('/api/admin/users/<target_user_id>/role', methods=['PUT'])
+@jwt_required()
+def admin_set_user_role(target_user_id):
+    # Check if user is admin
+    if not caller_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.json
+    if not data or not isinstance(data.get('is_admin'), bool):
+        return jsonify({'error': 'is_admin (true or false) is required'}), 400
+    
+    if not job_store.set_user_admin(target_user_id, data['is_admin']):
+        return jsonify({'error': 'User not found'}), 404
+    
+    # Tokens issued before this change now fall back to the refreshed cache entry
+    user_cache.invalidate(target_user_id)
+    
+    return jsonify({'user_id': target_user_id, 'is_admin': data['is_admin']})
+
+# Development server, one process. In production serve the app with gunicorn, see gunicorn.conf.py
 if __name__ == '__main__':
     # Start prometheus on port 8000 (separate from Flask)
-    prometheus_client.start_http_server(8000)
+    job_metrics.start_http_server(8000)
     app.run(debug=False, port=5001)
\ No newline at end of file
@@ -0,0 +1,21 @@
+# atomic_files.py
+# Writes generated files (thumbnails, previews, mesh downloads, uploaded inputs) so that
+# readers, e.g. a download served by another process, never see a half written file:
+# the content goes to a temporary file next to the destination, which is renamed over
+# it once complete. A write that fails leaves neither a partial file nor the temporary
+# file behind.
+import os
+import uuid
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path to write to; it replaces path when the block exits without an error"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
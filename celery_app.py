@@ -0,0 +1,59 @@
+# celery_app.py
+# The Celery app, configured without importing a single task. The API server and the
+# job monitor only send tasks by name (config.TASK_*); workers load the task bodies
+# and the model code behind them from tasks.py.
+import os
+
+from celery import Celery, group
+
+import config
+import job_tracing
+import user_cache
+
+celery = Celery('app', broker=config.CELERY_BROKER_URL, backend=config.CELERY_RESULT_BACKEND, include=['tasks'])
+celery.conf.update(
+    broker_connection_retry_on_startup=True,
+    task_routes={
+        '*.generate_image_task': {'queue': config.QUEUE_IMAGE},
+        '*.generate_3d_model_task': {'queue': config.QUEUE_3D_MODEL},
+        '*.runComfyUI': {'queue': config.QUEUE_COMFYUI},
+        '*.package_3d_model_task': {'queue': config.QUEUE_POSTPROCESS},
+    },
+    task_default_priority=config.LANE_PRIORITIES['standard'],
+    broker_transport_options={
+        'queue_order_strategy': 'priority',
+        'priority_steps': list(range(10)),
+        'sep': ':',
+    },
+    # Only hold the task being run, so a high priority job isn't stuck behind prefetched ones
+    worker_prefetch_multiplier=int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', '1')),
+    task_acks_late=True,
+    # Workers report task failures (e.g. a killed pool process) to the job monitor
+    worker_send_task_events=True,
+)
+
+
+def job_priority(user_id):
+    """Celery priority for a new job of this user, from the user's lane"""
+    user = user_cache.get_user(user_id)
+    return config.LANE_PRIORITIES.get(user['lane'] if user else None, config.LANE_PRIORITIES['standard'])
+
+
+def task_spec(name, args, kwargs):
+    """What send_job_task needs to send (and later resend) a job's Celery task"""
+    return {'name': name, 'args': list(args), 'kwargs': kwargs}
+
+
+def send_job_task(spec, user_id):
+    """Queue a job's task with the priority of the user's lane; routed by task name"""
+    priority = job_priority(user_id)
+    with job_tracing.span('broker_publish'):
+        return celery.send_task(spec['name'], spec['args'], spec['kwargs'], priority=priority)
+
+
+def send_job_tasks(specs, user_id):
+    """Queue several jobs' tasks as one Celery group, published over a single broker connection"""
+    priority = job_priority(user_id)
+    with job_tracing.span('broker_publish', jobs=len(specs)):
+        return group(celery.signature(spec['name'], args=spec['args'], kwargs=spec['kwargs'], priority=priority)
+                     for spec in specs).apply_async()
@@ -1,5 +1,44 @@
-from app import celery
+import argparse
+import os
 
-# 1 worker on test environment
+# Only Celery and the config: the worker imports the task bodies (tasks.py) when it starts,
+# and never the Flask app
+from celery_app import celery
+from config import QUEUE_IMAGE, QUEUE_3D_MODEL, QUEUE_COMFYUI, QUEUE_POSTPROCESS
+
+# Pool and concurrency that suit each queue when a worker is dedicated to it:
+# text-to-image runs several jobs on threads so they can be batched on one GPU,
+# TripoSR keeps one model (and GPU) busy per process, and ComfyUI jobs only wait
+# on the ComfyUI server so a few threads can keep its queue full. Packaging 3D models
+# is CPU bound, so it gets its own processes.
+QUEUE_DEFAULTS = {
+    QUEUE_IMAGE: {'pool': 'threads', 'concurrency': int(os.environ.get('IMAGE_BATCH_SIZE', '1'))},
+    QUEUE_3D_MODEL: {'pool': 'prefork', 'concurrency': 1},
+    QUEUE_COMFYUI: {'pool': 'threads', 'concurrency': 4},
+    QUEUE_POSTPROCESS: {'pool': 'prefork', 'concurrency': 2},
+}
+
+# 1 worker for all queues on test environment. In production start one worker per queue, e.g.
+#   python celery_worker.py --queues image
+#   python celery_worker.py --queues 3d_model
+#   python celery_worker.py --queues comfyui --concurrency 8
+#   python celery_worker.py --queues postprocess
 if __name__ == '__main__':
-    celery.worker_main(['worker', '--loglevel=info', '--concurrency=1'])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Start a Celery worker')
+    parser.add_argument('--queues', default=','.join(QUEUE_DEFAULTS),
+                        help='Comma separated queues to consume (default: all job queues)')
+    parser.add_argument('--pool', default=os.environ.get('CELERY_POOL'))
+    parser.add_argument('--concurrency', type=int, default=os.environ.get('CELERY_CONCURRENCY'))
+    parser.add_argument('--prefetch-multiplier', type=int, default=None)
+    args = parser.parse_args()
+
+    queues = [q for q in args.queues.split(',') if q]
+    defaults = QUEUE_DEFAULTS.get(queues[0], {}) if len(queues) == 1 else {'pool': 'prefork', 'concurrency': 1}
+    pool = args.pool or defaults.get('pool', 'prefork')
+    concurrency = args.concurrency or defaults.get('concurrency', 1)
+
+    argv = ['worker', '--loglevel=info', f'--queues={",".join(queues)}', f'--pool={pool}',
+            f'--concurrency={concurrency}', f'--hostname={"-".join(queues)}@%h']
+    if args.prefetch_multiplier:
+        argv.append(f'--prefetch-multiplier={args.prefetch_multiplier}')
+    celery.worker_main(argv)
\ No newline at end of file
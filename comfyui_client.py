@@ -0,0 +1,195 @@
+# comfyui_client.py
+# Runs disney/sketch transformations on one long-running ComfyUI instance through its
+# HTTP prompt queue, instead of starting a ComfyUI script per job.
+#
+# Workflows are ComfyUI "API format" exports stored as {COMFYUI_WORKFLOW_DIR}/{type}.json.
+# Before submitting, the LoadImage node is pointed at the uploaded image and the
+# SaveImage node's filename prefix is set to {type}_{job_id}. A job type without an
+# exported workflow still runs its ComfyUI script ({comfyui_dir}/{type}.py) per job, as
+# before the HTTP API was used. Workers check at startup that every job type has one of
+# the two, so a deploy missing both fails at once instead of on every job.
+import copy
+import json
+import os
+import subprocess
+import time
+import uuid
+
+COMFYUI_URL = os.environ.get('COMFYUI_URL', 'http://127.0.0.1:8188')
+COMFYUI_WORKFLOW_DIR = os.environ.get('COMFYUI_WORKFLOW_DIR', 'workflows')
+# Seconds a workflow may take from submission until its outputs are written
+COMFYUI_TIMEOUT = float(os.environ.get('COMFYUI_TIMEOUT', '540'))
+# Seconds between /history checks when the websocket is not available
+COMFYUI_POLL_INTERVAL = float(os.environ.get('COMFYUI_POLL_INTERVAL', '0.5'))
+# Seconds without a websocket message after which /history is checked anyway, in case
+# the completion event was missed
+COMFYUI_WS_CHECK_INTERVAL = float(os.environ.get('COMFYUI_WS_CHECK_INTERVAL', '5'))
+
+
+# Job types run on ComfyUI
+JOB_TYPES = ('disney', 'sketch')
+
+
+class ComfyUIError(Exception):
+    pass
+
+
+class ComfyUIClient:
+    def __init__(self, base_url=COMFYUI_URL, comfyui_dir='../ComfyUI', workflow_dir=COMFYUI_WORKFLOW_DIR):
+        self.base_url = base_url.rstrip('/')
+        self.comfyui_dir = comfyui_dir
+        self.workflow_dir = workflow_dir
+        # Imported here so workers that never run ComfyUI jobs start without it
+        import requests
+        self.session = requests.Session()
+        self._workflows = {}
+
+    def workflow_path(self, job_type):
+        return os.path.join(self.workflow_dir, f"{job_type}.json")
+
+    def script_path(self, job_type):
+        return os.path.join(self.comfyui_dir, f"{job_type}.py")
+
+    def check_setup(self, job_types=JOB_TYPES):
+        """Raise ComfyUIError if a job type has neither a workflow file nor a ComfyUI script"""
+        missing = []
+        for job_type in job_types:
+            if os.path.exists(self.workflow_path(job_type)):
+                print(f"ComfyUI {job_type} jobs run {self.workflow_path(job_type)}")
+            elif os.path.exists(self.script_path(job_type)):
+                print(f"ComfyUI {job_type} jobs run {self.script_path(job_type)} (no workflow file)")
+            else:
+                missing.append(f"{self.workflow_path(job_type)} or {self.script_path(job_type)}")
+        if missing:
+            raise ComfyUIError(f"ComfyUI workflows not found: {', '.join(missing)}")
+
+    def load_workflow(self, job_type, image_name, output_prefix):
+        """Return a copy of the job type's workflow with its input image and output prefix filled in"""
+        if job_type not in self._workflows:
+            path = self.workflow_path(job_type)
+            if not os.path.exists(path):
+                raise ComfyUIError(f"Workflow file not found: {path}")
+            with open(path) as f:
+                self._workflows[job_type] = json.load(f)
+
+        workflow = copy.deepcopy(self._workflows[job_type])
+        for node in workflow.values():
+            if node.get('class_type') == 'LoadImage':
+                node['inputs']['image'] = image_name
+            elif node.get('class_type') == 'SaveImage':
+                node['inputs']['filename_prefix'] = output_prefix
+        return workflow
+
+    def submit(self, workflow, client_id):
+        response = self.session.post(f"{self.base_url}/prompt",
+                                     json={'prompt': workflow, 'client_id': client_id}, timeout=10)
+        if response.status_code != 200:
+            raise ComfyUIError(f"ComfyUI rejected the workflow: {response.text}")
+        return response.json()['prompt_id']
+
+    def get_history(self, prompt_id):
+        response = self.session.get(f"{self.base_url}/history/{prompt_id}", timeout=10)
+        response.raise_for_status()
+        return response.json().get(prompt_id)
+
+    def _wait_for_websocket(self, websocket, prompt_id, deadline):
+        # ComfyUI reports "executing" with node=None once the whole prompt has run
+        while time.time() < deadline:
+            try:
+                message = websocket.recv(timeout=max(0.1, min(COMFYUI_WS_CHECK_INTERVAL, deadline - time.time())))
+            except TimeoutError:
+                if self.get_history(prompt_id):
+                    return
+                continue
+            if not isinstance(message, str):
+                continue  # binary preview frames
+            event = json.loads(message)
+            data = event.get('data', {})
+            if data.get('prompt_id') != prompt_id:
+                continue
+            if event['type'] == 'execution_error':
+                raise ComfyUIError(f"ComfyUI execution failed: {data.get('exception_message')}")
+            if event['type'] == 'executing' and data.get('node') is None:
+                return
+
+    def wait(self, prompt_id, timeout=COMFYUI_TIMEOUT, websocket=None):
+        """Wait for the prompt to finish and return its history entry"""
+        deadline = time.time() + timeout
+        if websocket is not None:
+            try:
+                self._wait_for_websocket(websocket, prompt_id, deadline)
+            except ComfyUIError:
+                raise
+            except Exception as e:
+                print(f"ComfyUI websocket failed, polling history instead: {str(e)}")
+
+        while time.time() < deadline:
+            history = self.get_history(prompt_id)
+            if history:
+                status = history.get('status', {})
+                if status.get('status_str') == 'error':
+                    raise ComfyUIError(f"ComfyUI execution failed for prompt {prompt_id}")
+                if status.get('completed', True):
+                    return history
+            time.sleep(COMFYUI_POLL_INTERVAL)
+        raise ComfyUIError(f"ComfyUI prompt {prompt_id} did not finish within {timeout}s")
+
+    def _connect_websocket(self, client_id):
+        try:
+            from websockets.sync.client import connect
+            ws_url = self.base_url.replace('http', 'ws', 1)
+            return connect(f"{ws_url}/ws?clientId={client_id}", open_timeout=5)
+        except Exception as e:
+            print(f"ComfyUI websocket unavailable, polling history instead: {str(e)}")
+            return None
+
+    def run_script(self, job_type, image_name, output_prefix, timeout=COMFYUI_TIMEOUT):
+        """Run the job type's ComfyUI script on image_name in ComfyUI's own virtualenv"""
+        # The scripts take the input image and the job id, and save {type}_{job_id}_00001_.png
+        job_id = output_prefix[len(job_type) + 1:]
+        try:
+            result = subprocess.run([os.path.join('.venv', 'bin', 'python'), f"{job_type}.py", image_name, job_id],
+                                    cwd=self.comfyui_dir, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise ComfyUIError(f"ComfyUI {job_type} script did not finish within {timeout}s")
+        print(result.stdout, end='')
+        if result.returncode != 0:
+            raise ComfyUIError(f"ComfyUI {job_type} script failed: {result.stderr.strip()}")
+        image_path = os.path.join(self.comfyui_dir, 'output', f"{output_prefix}_00001_.png")
+        if not os.path.exists(image_path):
+            raise ComfyUIError(f"ComfyUI {job_type} script finished without writing {image_path}")
+        return image_path
+
+    def run(self, job_type, image_name, output_prefix, timeout=COMFYUI_TIMEOUT):
+        """Run the job type's workflow on image_name (in ComfyUI's input folder) and return the output image path"""
+        if not os.path.exists(self.workflow_path(job_type)) and os.path.exists(self.script_path(job_type)):
+            return self.run_script(job_type, image_name, output_prefix, timeout)
+        workflow = self.load_workflow(job_type, image_name, output_prefix)
+
+        # ComfyUI keeps one websocket per client id and sends events only to the newest,
+        # so concurrent runs on this shared client each connect under their own id.
+        # Connect before submitting so the completion event can't be missed
+        client_id = str(uuid.uuid4())
+        websocket = self._connect_websocket(client_id)
+        try:
+            prompt_id = self.submit(workflow, client_id)
+            history = self.wait(prompt_id, timeout, websocket)
+        finally:
+            if websocket is not None:
+                websocket.close()
+
+        for output in history.get('outputs', {}).values():
+            for image in output.get('images', []):
+                if image.get('type', 'output') == 'output':
+                    return os.path.join(self.comfyui_dir, 'output', image.get('subfolder', ''), image['filename'])
+        raise ComfyUIError(f"ComfyUI prompt {prompt_id} finished without an output image")
+
+
+_client = None
+
+
+def get_client(comfyui_dir='../ComfyUI'):
+    global _client
+    if _client is None:
+        _client = ComfyUIClient(comfyui_dir=comfyui_dir)
+    return _client
@@ -0,0 +1,29 @@
+# config.py
+# Settings shared by the API server, the Celery workers and the job monitor: where job
+# inputs and outputs live, and how jobs are queued. Kept free of Flask, Celery and model
+# code, so every process can import it without paying for the others' dependencies.
+import os
+
+# TripoSR reads uploaded images from and writes meshes to per-job directories here
+OUTPUT_DIR_3D = '../TripoSR/uploads'
+# ComfyUI's installation; its input/ and output/ directories hold the transformations
+COMFY_UI_DIR = '../ComfyUI'
+
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+
+# One queue per job type, so quick transformations don't wait behind long 3D jobs
+QUEUE_IMAGE = os.environ.get('CELERY_QUEUE_IMAGE', 'image')
+QUEUE_3D_MODEL = os.environ.get('CELERY_QUEUE_3D_MODEL', '3d_model')
+QUEUE_COMFYUI = os.environ.get('CELERY_QUEUE_COMFYUI', 'comfyui')
+QUEUE_POSTPROCESS = os.environ.get('CELERY_QUEUE_POSTPROCESS', 'postprocess')
+
+# Message priorities within each queue, 0 is served first (Redis emulates them with one list per step)
+LANE_PRIORITIES = {'high': 0, 'standard': 5, 'low': 9}
+
+# Names the tasks in tasks.py are registered and sent under. They predate the split of
+# app.py, and jobs store them to be resent, so they must not change
+TASK_IMAGE = 'app.generate_image_task'
+TASK_3D_MODEL = 'app.generate_3d_model_task'
+TASK_PACKAGE_3D_MODEL = 'app.package_3d_model_task'
+TASK_COMFYUI = 'app.runComfyUI'
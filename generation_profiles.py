@@ -0,0 +1,121 @@
+# generation_profiles.py
+# Text-to-image generation settings. A profile is a server side preset (model, device,
+# step count, resolution, scheduler and pipeline optimizations); requests pick a profile
+# and may override its generation parameters within validated limits.
+#
+# The "fast" profile targets CPU-only nodes: a distilled model (SDXL-Turbo) that needs
+# very few steps and no classifier-free guidance, at 512x512, with attention slicing and
+# channels-last memory layout, and optionally torch.compile.
+import math
+import os
+
+import model_registry
+
+MAX_STEPS = int(os.environ.get('IMAGE_MAX_STEPS', '100'))
+MIN_SIZE = 256
+MAX_SIZE = int(os.environ.get('IMAGE_MAX_SIZE', '1536'))
+MAX_SEED = 2 ** 32 - 1
+
+# Scheduler names accepted in requests -> (diffusers class, extra from_config arguments)
+SCHEDULERS = {
+    'euler': ('EulerDiscreteScheduler', {}),
+    'euler_a': ('EulerAncestralDiscreteScheduler', {}),
+    'dpmpp_2m': ('DPMSolverMultistepScheduler', {}),
+    'dpmpp_2m_karras': ('DPMSolverMultistepScheduler', {'use_karras_sigmas': True}),
+    'ddim': ('DDIMScheduler', {}),
+    'lcm': ('LCMScheduler', {}),
+}
+
+PROFILES = {
+    'quality': {
+        'model_id': model_registry.DEFAULT_MODEL_ID,
+        'device': None,
+        # None leaves the pipeline's own default (SDXL: 50 steps, guidance 5.0, 1024x1024)
+        'params': {'steps': None, 'guidance': None, 'width': None, 'height': None, 'scheduler': None},
+        'optimizations': (),
+    },
+    'fast': {
+        'model_id': os.environ.get('FAST_MODEL_ID', 'stabilityai/sdxl-turbo'),
+        'device': os.environ.get('FAST_MODEL_DEVICE') or None,
+        'params': {'steps': int(os.environ.get('FAST_STEPS', '2')), 'guidance': 0.0,
+                   'width': 512, 'height': 512, 'scheduler': 'euler_a'},
+        'optimizations': tuple(
+            ['attention_slicing', 'channels_last'] + (['compile'] if os.environ.get('FAST_COMPILE', '0') == '1' else [])
+        ),
+    },
+}
+DEFAULT_PROFILE = os.environ.get('IMAGE_PROFILE', 'quality')
+# Comma separated profiles whose pipelines are loaded when a worker process starts
+PRELOAD_PROFILES = [p.strip() for p in os.environ.get('PRELOAD_PROFILES', '').split(',') if p.strip()]
+
+
+def _number(data, name, kind, low, high):
+    value = data.get(name)
+    if value is None:
+        return None
+    # bool is an int subclass, but true/false is never a valid step count or size; JSON
+    # bodies may also carry Infinity and NaN, which int() can't convert
+    if (isinstance(value, bool) or not isinstance(value, (int, float))
+            or (isinstance(value, float) and not math.isfinite(value)) or (kind is int and value != int(value))):
+        raise ValueError(f"{name} must be {'an integer' if kind is int else 'a number'}")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return kind(value)
+
+
+def parse_params(data):
+    """Validate the generation parameters of a request body
+
+    Returns the profile's parameters with the request's overrides applied, plus the
+    profile name and seed. Raises ValueError with a message for the client.
+    """
+    profile = data.get('profile', DEFAULT_PROFILE)
+    if profile not in PROFILES:
+        raise ValueError(f"profile must be one of: {', '.join(PROFILES)}")
+
+    params = dict(PROFILES[profile]['params'])
+    overrides = {
+        'steps': _number(data, 'steps', int, 1, MAX_STEPS),
+        'guidance': _number(data, 'guidance', float, 0, 30),
+        'width': _number(data, 'width', int, MIN_SIZE, MAX_SIZE),
+        'height': _number(data, 'height', int, MIN_SIZE, MAX_SIZE),
+    }
+    for name in ('width', 'height'):
+        if overrides[name] is not None and overrides[name] % 8:
+            raise ValueError(f"{name} must be a multiple of 8")
+
+    scheduler = data.get('scheduler')
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise ValueError(f"scheduler must be one of: {', '.join(SCHEDULERS)}")
+    overrides['scheduler'] = scheduler
+
+    params.update({name: value for name, value in overrides.items() if value is not None})
+    params['profile'] = profile
+    params['seed'] = _number(data, 'seed', int, 0, MAX_SEED)
+    return params
+
+
+def batch_key(params):
+    """Jobs with equal batch keys can share one pipeline call (everything but the prompt and seed)"""
+    return (params['profile'], PROFILES[params['profile']]['model_id'], params['width'], params['height'],
+            params['steps'], params['guidance'], params['scheduler'])
+
+
+def get_profile_pipeline(name):
+    profile = PROFILES[name]
+    return model_registry.get_pipeline(profile['model_id'], profile['device'], profile['optimizations'])
+
+
+def pipeline_for(params):
+    """The resident pipeline of the params' profile, with the requested scheduler"""
+    pipe = get_profile_pipeline(params['profile'])
+    if params['scheduler'] is None:
+        return pipe
+    class_name, options = SCHEDULERS[params['scheduler']]
+    return model_registry.with_scheduler(pipe, class_name, options)
+
+
+def preload(names=None):
+    """Load the pipelines of the given (or configured) profiles, e.g. from worker_process_init"""
+    for name in (names if names is not None else PRELOAD_PROFILES):
+        get_profile_pipeline(name)
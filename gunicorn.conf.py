@@ -0,0 +1,55 @@
+# gunicorn.conf.py
+# Production serving of the Flask app, instead of `python app.py` (Werkzeug's
+# development server, one process):
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Several worker processes serve requests, each with a pool of threads: status streams
+# (Server-Sent Events) hold a thread for as long as their job runs, and result downloads
+# and SQLite reads release the GIL, so threads keep a worker busy while others wait.
+# Metrics are kept in prometheus_client's multiprocess mode; the master process serves
+# the merged metrics of all workers on METRICS_PORT, like `python app.py` does.
+import os
+import sys
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('GUNICORN_WORKERS', str(min(2 * (os.cpu_count() or 1) + 1, 8))))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# A worker that misses heartbeats for this long is restarted. gthread workers send them
+# from their main loop, so long requests and open status streams don't count against it
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+# Restart workers now and then, so slow leaks in third party code can't build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+# Serve the merged metrics of all workers on this port from the master (0 disables it;
+# /api/metrics serves the same from the workers)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '8000'))
+
+# Workers can't share in-process metrics, so multiprocess mode is required. Without a
+# configured directory the workers get a private one, which leaves out the Celery
+# workers' metrics; see "Prometheus stats" in the README
+if not (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='ai-studio-prometheus-')
+    print(f"PROMETHEUS_MULTIPROC_DIR is not set, using {os.environ['PROMETHEUS_MULTIPROC_DIR']}")
+
+# The hooks import the app's modules from the master process
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def when_ready(server):
+    if METRICS_PORT:
+        import job_metrics
+        job_metrics.start_http_server(METRICS_PORT)
+        server.log.info(f"Serving metrics on port {METRICS_PORT}")
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the merged metrics
+    import job_metrics
+    job_metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,102 @@
+# image_batcher.py
+# Coalesces concurrent text-to-image jobs in a worker process into batched
+# pipeline calls. Jobs are only batched with compatible jobs (same batch key,
+# e.g. model and resolution).
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Gauge, Histogram
+
+import job_tracing
+
+# Maximum number of prompts in one pipeline call
+IMAGE_BATCH_SIZE = int(os.environ.get('IMAGE_BATCH_SIZE', '1'))
+# Maximum time (seconds) the oldest prompt waits for the batch to fill up
+IMAGE_BATCH_MAX_WAIT = float(os.environ.get('IMAGE_BATCH_MAX_WAIT', '0.5'))
+
+BATCH_SIZE = Histogram('image_batch_size', 'Number of prompts per batched pipeline call',
+                       buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+BATCH_WAIT_TIME = Histogram('image_batch_wait_seconds', 'Time a prompt waited for its batch to be dispatched')
+BATCH_PROCESSING_TIME = Histogram('image_batch_processing_seconds', 'Time spent running one batched pipeline call')
+BATCH_IMAGES = Counter('image_batch_images_total', 'Images produced by batched pipeline calls')
+BATCH_THROUGHPUT = Gauge('image_batch_throughput_images_per_second', 'Images per second of the last batched call',
+                         multiprocess_mode='liveall')
+
+
+class ImageBatcher:
+    """Collects submitted items per batch key and runs them through run_batch(key, items)
+
+    run_batch must return one result per item, in order. submit() returns a
+    Future that resolves to the item's own result; its stages attribute then holds
+    the item's batch wait and the stages timed while its batch ran.
+    """
+
+    def __init__(self, run_batch, max_batch_size=IMAGE_BATCH_SIZE, max_wait=IMAGE_BATCH_MAX_WAIT):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        # batch key -> list of (item, future, submitted_at), oldest key first
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key, item):
+        future = Future()
+        with self._cond:
+            self._pending.setdefault(key, []).append((item, future, time.monotonic()))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='image-batcher', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+
+                key, entries = next(iter(self._pending.items()))
+                remaining = entries[0][2] + self.max_wait - time.monotonic()
+                if len(entries) >= self.max_batch_size or remaining <= 0:
+                    batch = entries[:self.max_batch_size]
+                    if len(entries) > self.max_batch_size:
+                        self._pending[key] = entries[self.max_batch_size:]
+                    else:
+                        del self._pending[key]
+                    return key, batch
+
+                self._cond.wait(remaining)
+
+    def _run(self):
+        while True:
+            key, batch = self._next_batch()
+            dispatched_at = time.monotonic()
+            for _, _, submitted_at in batch:
+                BATCH_WAIT_TIME.observe(dispatched_at - submitted_at)
+
+            try:
+                # Stages timed inside run_batch belong to the jobs of the batch, see job_tracing.py
+                with job_tracing.collect(batch_size=len(batch)) as stages:
+                    results = self.run_batch(key, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            duration = time.monotonic() - dispatched_at
+            BATCH_SIZE.observe(len(batch))
+            BATCH_PROCESSING_TIME.observe(duration)
+            BATCH_IMAGES.inc(len(batch))
+            if duration > 0:
+                BATCH_THROUGHPUT.set(len(batch) / duration)
+            print(f"Ran batch of {len(batch)} for {key} in {duration:.1f}s")
+
+            for (_, future, submitted_at), result in zip(batch, results):
+                # Read by the submitter once the result is set
+                future.stages = dict(stages, batch_wait=dispatched_at - submitted_at)
+                future.set_result(result)
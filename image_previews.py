@@ -0,0 +1,116 @@
+# image_previews.py
+# Progress and intermediate previews of running text-to-image jobs. The pipeline's
+# step callback reports progress every PREVIEW_EVERY_STEPS steps and writes a small
+# preview of the partially denoised image, made with a linear latent -> RGB projection
+# instead of a VAE decode. Preview time is capped at PREVIEW_BUDGET of the run time.
+import os
+import time
+
+from PIL import Image
+from prometheus_client import Counter, Histogram
+
+import atomic_files
+import job_store
+
+PREVIEW_DIR = os.environ.get('PREVIEW_DIR', 'output/previews')
+# Report progress and write a preview every this many denoising steps (0 = off)
+PREVIEW_EVERY_STEPS = int(os.environ.get('PREVIEW_EVERY_STEPS', '5'))
+# Largest share of the pipeline's run time that may go into previews; later previews are skipped beyond it
+PREVIEW_BUDGET = float(os.environ.get('PREVIEW_BUDGET', '0.05'))
+PREVIEW_QUALITY = int(os.environ.get('PREVIEW_QUALITY', '70'))
+
+# Linear latent -> RGB approximations (from ComfyUI's latent formats), keyed by the
+# scaling factor of the VAE the latents belong to: (factors per latent channel, bias)
+LATENT_RGB_FACTORS = {
+    # SDXL
+    0.13025: ([[0.3651, 0.4232, 0.4341],
+               [-0.2533, -0.0042, 0.1068],
+               [0.1076, 0.1111, -0.0362],
+               [-0.3165, -0.2492, -0.2188]],
+              [0.1084, -0.0175, -0.0011]),
+    # SD 1.x / 2.x
+    0.18215: ([[0.3512, 0.2297, 0.3227],
+               [0.3250, 0.4974, 0.2350],
+               [-0.2829, 0.1762, 0.2721],
+               [-0.2120, -0.2616, -0.7177]],
+              None),
+}
+
+PREVIEW_TIME = Histogram('image_preview_seconds', 'Time spent making the step previews of one batched pipeline call',
+                         buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+PREVIEWS_SKIPPED = Counter('image_previews_skipped_total', 'Step previews skipped to stay within PREVIEW_BUDGET')
+
+
+def preview_path(job_id):
+    return os.path.join(PREVIEW_DIR, f"{job_id}.webp")
+
+
+def discard(job_id):
+    """Remove the job's preview once the final image exists (or the job failed)"""
+    try:
+        os.remove(preview_path(job_id))
+    except FileNotFoundError:
+        pass
+
+
+def latents_to_images(latents, factors, bias=None):
+    """Approximate RGB images of a batch of latents, at latent resolution (1/8 of the output)"""
+    import torch
+
+    latents = latents.float()
+    rgb = torch.einsum('bchw,cr->bhwr', latents, torch.tensor(factors, device=latents.device))
+    if bias is not None:
+        rgb = rgb + torch.tensor(bias, device=latents.device)
+    rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+    return [Image.fromarray(image) for image in rgb]
+
+
+def _write(job_id, image):
+    with atomic_files.atomic_path(preview_path(job_id)) as tmp_path:
+        image.save(tmp_path, format='WEBP', quality=PREVIEW_QUALITY)
+
+
+class StepPreviewer:
+    """Step callback (callback_on_step_end) of one pipeline call; job_ids[i] is the job of the i-th image"""
+
+    def __init__(self, job_ids, every_steps=PREVIEW_EVERY_STEPS, budget=PREVIEW_BUDGET):
+        self.job_ids = job_ids
+        self.every_steps = every_steps
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.preview_seconds = 0.0
+
+    def _previews(self, pipe, latents):
+        factors = LATENT_RGB_FACTORS.get(round(pipe.vae.config.scaling_factor, 5))
+        if factors is None:
+            return False
+        elapsed = time.monotonic() - self.started_at
+        if self.preview_seconds > self.budget * elapsed:
+            PREVIEWS_SKIPPED.inc()
+            return False
+
+        start_time = time.monotonic()
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+        for job_id, image in zip(self.job_ids, latents_to_images(latents, *factors)):
+            _write(job_id, image)
+        duration = time.monotonic() - start_time
+        self.preview_seconds += duration
+        PREVIEW_TIME.observe(duration)
+        return True
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        done = step + 1
+        num_steps = pipe.num_timesteps
+        # The last step is followed by the real decode, a preview of it would be wasted
+        if done % self.every_steps != 0 or done >= num_steps:
+            return callback_kwargs
+
+        try:
+            preview = self._previews(pipe, callback_kwargs['latents'])
+            progress = done * 100 // num_steps
+            for job_id in self.job_ids:
+                job_store.set_job_progress(job_id, progress, preview)
+        except Exception as e:
+            # Previews are a nicety, never a reason to fail the image
+            print(f"Failed to make step previews: {str(e)}")
+        return callback_kwargs
@@ -0,0 +1,106 @@
+# job_events.py
+# Pub/sub channel for job status transitions (queued -> processing -> completed/failed).
+# Writers publish through Redis pub/sub so that the Flask process sees transitions made
+# by Celery workers and the job monitor; inside each process one listener thread fans
+# the events out to the subscribed clients. Setting JOB_EVENTS_URL=memory:// keeps
+# everything in-process, which is enough when the tasks run in the same process.
+import json
+import os
+import queue
+import threading
+import time
+
+JOB_EVENTS_URL = os.environ.get('JOB_EVENTS_URL', os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+CHANNEL_PREFIX = 'job_events:'
+
+TERMINAL_STATUSES = {'completed', 'failed'}
+
+# job_id -> set of subscriber queues in this process
+_subscribers = {}
+_lock = threading.Lock()
+_redis = None
+_listener = None
+
+
+def _use_redis():
+    return JOB_EVENTS_URL.startswith(('redis://', 'rediss://', 'unix://'))
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(JOB_EVENTS_URL)
+    return _redis
+
+
+def _fan_out(event):
+    with _lock:
+        subscribers = list(_subscribers.get(event['job_id'], ()))
+    for subscriber in subscribers:
+        subscriber.put(event)
+
+
+def _listen():
+    # Reconnect forever; subscribers only miss events while Redis is unreachable
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(CHANNEL_PREFIX + '*')
+            for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    _fan_out(json.loads(message['data']))
+        except Exception as e:
+            print(f"Job event listener error: {str(e)}")
+            time.sleep(1)
+
+
+def _ensure_listener():
+    global _listener
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen, name='job-events', daemon=True)
+            _listener.start()
+
+
+def publish(job_id, status, **fields):
+    """Announce a status transition. Never raises: events are best effort, the database is the source of truth"""
+    event = dict(fields, job_id=job_id, status=status, timestamp=time.time())
+    try:
+        if _use_redis():
+            _get_redis().publish(CHANNEL_PREFIX + job_id, json.dumps(event))
+        else:
+            _fan_out(event)
+    except Exception as e:
+        print(f"Failed to publish event for job {job_id}: {str(e)}")
+
+
+class Subscription:
+    """Receives the status events of one job until closed"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._queue = queue.Queue()
+        with _lock:
+            _subscribers.setdefault(job_id, set()).add(self._queue)
+        if _use_redis():
+            _ensure_listener()
+
+    def get(self, timeout=None):
+        """Return the next event, or None if nothing arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with _lock:
+            subscribers = _subscribers.get(self.job_id)
+            if subscribers is not None:
+                subscribers.discard(self._queue)
+                if not subscribers:
+                    del _subscribers[self.job_id]
+
+
+def subscribe(job_id):
+    return Subscription(job_id)
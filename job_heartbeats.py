@@ -0,0 +1,49 @@
+# job_heartbeats.py
+# Running tasks prove they are alive by refreshing their job's heartbeat_at. One thread
+# per worker process refreshes every job running in that process with a single UPDATE
+# every JOB_HEARTBEAT_INTERVAL seconds; the job monitor treats a job whose heartbeat is
+# older than JOB_HEARTBEAT_TIMEOUT as lost (crashed process, killed worker, dead host).
+import os
+import threading
+import time
+
+import job_store
+
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '5'))
+# Should be a few intervals, so one slow database write doesn't look like a stall
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get('JOB_HEARTBEAT_TIMEOUT', '20'))
+
+_running = set()
+_lock = threading.Lock()
+_thread = None
+_thread_pid = None
+
+
+def _beat():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        with _lock:
+            job_ids = list(_running)
+        if not job_ids:
+            continue
+        try:
+            job_store.heartbeat_jobs(job_ids)
+        except Exception as e:
+            print(f"Failed to record job heartbeats: {str(e)}")
+
+
+def start(job_id):
+    """Send heartbeats for job_id until stop() is called"""
+    global _thread, _thread_pid
+    with _lock:
+        _running.add(job_id)
+        # Threads don't survive a fork, so prefork children start their own
+        if _thread is None or _thread_pid != os.getpid() or not _thread.is_alive():
+            _thread = threading.Thread(target=_beat, name='job-heartbeats', daemon=True)
+            _thread_pid = os.getpid()
+            _thread.start()
+
+
+def stop(job_id):
+    with _lock:
+        _running.discard(job_id)
@@ -0,0 +1,99 @@
+# job_metrics.py
+# Job metrics shared by the Flask app and the Celery workers.
+#
+# The web server and every worker process are separate processes, so metrics are kept
+# in prometheus_client's multiprocess mode: start every process with
+# PROMETHEUS_MULTIPROC_DIR pointing at the same (emptied) directory and the exporter
+# aggregates the per-process files. Queue depth isn't counted by anyone; it is read
+# from the job database at scrape time, so it is correct whichever process asks.
+import os
+import time
+from datetime import datetime
+
+import prometheus_client
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+import job_store
+import job_tracing
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+# Buckets from a fast cache-sized job to a long 3D reconstruction
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 3600)
+
+REQUESTS = Counter('image_generation_requests_total', 'Total number of job requests', ['type'])
+QUEUE_WAIT_TIME = Histogram('job_queue_wait_seconds', 'Time jobs spent queued before processing started',
+                            ['type'], buckets=LATENCY_BUCKETS)
+PROCESSING_TIME = Histogram('image_generation_processing_seconds', 'Time spent processing jobs',
+                            ['type', 'outcome'], buckets=LATENCY_BUCKETS)
+PROFILE_TIME = Histogram('image_generation_profile_seconds', 'Time to generate one image, per generation profile',
+                         ['profile'], buckets=LATENCY_BUCKETS)
+END_TO_END_TIME = Histogram('job_end_to_end_seconds', 'Time from job creation until it completed or failed',
+                            ['type', 'outcome'], buckets=LATENCY_BUCKETS)
+
+
+class JobQueueCollector:
+    """Queue depth and in-progress jobs per type, read from the job database on every scrape"""
+
+    def collect(self):
+        queued = GaugeMetricFamily('image_generation_queue_size', 'Jobs waiting in the queue', labels=['type'])
+        processing = GaugeMetricFamily('image_generation_jobs_in_progress', 'Jobs being processed', labels=['type'])
+        for job_type, status, count in job_store.count_active_jobs():
+            (queued if status == 'queued' else processing).add_metric([job_type], count)
+        yield queued
+        yield processing
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def observe_job_started(job):
+    """Record the queue wait of a job row returned by job_store.start_job"""
+    wait = max(0, time.time() - _parse_timestamp(job['created_at']))
+    QUEUE_WAIT_TIME.labels(job['type']).observe(wait)
+    job_tracing.record('queue_wait', wait)
+
+
+def observe_job_finished(job, outcome):
+    """Record processing and end-to-end time of a started job that completed or failed"""
+    now = time.time()
+    PROCESSING_TIME.labels(job['type'], outcome).observe(max(0, now - _parse_timestamp(job['started_at'])))
+    END_TO_END_TIME.labels(job['type'], outcome).observe(max(0, now - _parse_timestamp(job['created_at'])))
+
+
+def observe_profile_latency(profile, seconds):
+    """Record how long generating one image took with the given generation profile"""
+    PROFILE_TIME.labels(profile).observe(seconds)
+
+
+_registry = None
+
+
+def get_registry():
+    """Registry to expose: every process's metrics in multiprocess mode, plus queue depth"""
+    global _registry
+    if _registry is None:
+        if MULTIPROC_DIR:
+            _registry = CollectorRegistry()
+            MultiProcessCollector(_registry)
+        else:
+            _registry = prometheus_client.REGISTRY
+        _registry.register(JobQueueCollector())
+    return _registry
+
+
+def generate_latest():
+    return prometheus_client.generate_latest(get_registry())
+
+
+def start_http_server(port):
+    prometheus_client.start_http_server(port, registry=get_registry())
+
+
+def mark_process_dead(pid):
+    """Drop a finished worker process's live gauges"""
+    if MULTIPROC_DIR:
+        prometheus_client.multiprocess.mark_process_dead(pid)
@@ -1,44 +1,131 @@
-import sqlite3
+import json
+import os
+import threading
 import time
 from datetime import datetime, timedelta
-import os
+
+from prometheus_client import Counter, Histogram
+
+import config
+import image_previews
+import job_heartbeats
+import job_store
+import result_cache
+import thumbnails
+from celery_app import celery, send_job_task
+
+# Directories holding job outputs, cleaned up by the result cache eviction
+OUTPUT_DIRS = ['output', thumbnails.THUMBNAIL_DIR, image_previews.PREVIEW_DIR, config.OUTPUT_DIR_3D,
+               os.path.join(config.COMFY_UI_DIR, 'output')]
+# Seconds between result cache eviction runs
+RESULT_CACHE_EVICT_INTERVAL = float(os.environ.get('RESULT_CACHE_EVICT_INTERVAL', '3600'))
+# Seconds between checks for jobs whose heartbeats stopped
+MONITOR_INTERVAL = float(os.environ.get('JOB_MONITOR_INTERVAL', '2'))
+# Jobs running longer than this are stuck even if their worker is alive (tasks have a 600s soft time limit)
+JOB_MAX_RUNTIME = float(os.environ.get('JOB_MAX_RUNTIME', '900'))
+# Attempts a job gets before a stall fails it instead of requeueing it
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '2'))
+
+STALLS = Counter('job_stalls_total', 'Stalled jobs by type, reason and action taken', ['type', 'reason', 'action'])
+STALL_DETECTION_TIME = Histogram('job_stall_detection_seconds',
+                                 'Time from a stalled job\'s last sign of life until the monitor acted on it', ['reason'],
+                                 buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200))
+
+# Stall reasons
+HEARTBEAT_LOST = 'heartbeat_lost'
+WORKER_LOST = 'worker_lost'
+TIMEOUT = 'timeout'
+
+_lock = threading.Lock()
+
+
+def handle_stalled_job(job, reason):
+    """Revoke a stalled job's task, then requeue the job or fail it once it is out of attempts"""
+    last_seen = job['heartbeat_at'] or job['started_at'] or job['created_at']
+    STALL_DETECTION_TIME.labels(reason).observe(max(0, time.time() - datetime.fromisoformat(last_seen).timestamp()))
+
+    if job['task_id']:
+        # Kill the task if it is still running somewhere so it can't hold the GPU
+        celery.control.revoke(job['task_id'], terminate=True, signal='SIGKILL')
+
+    message = f"Stalled ({reason}) on attempt {job['attempts']}"
+    with _lock:
+        # Conditional on the stalled attempt, so a job that finished or was requeued meanwhile is left alone
+        if job['task'] and job['attempts'] < JOB_MAX_ATTEMPTS and job_store.requeue_job(job['id'], message, job['task_id']):
+            send_job_task(json.loads(job['task']), job['user_id'])
+            action = 'requeued'
+        elif job_store.fail_job(job['id'], message, job['task_id']):
+            action = 'failed'
+        else:
+            return None
+
+    STALLS.labels(job['type'], reason, action).inc()
+    print(f"{message}: job {job['id']} {action}")
+    return action
+
 
 def update_stalled_jobs():
-    """Check for jobs that have been processing too long and mark them as failed"""
-    conn = sqlite3.connect('image_jobs.db')
-    cursor = conn.cursor()
-    
-    # Find jobs that have been processing for more than 5 minutes
-    five_mins_ago = datetime.now() - timedelta(minutes=5)
-    
-    cursor.execute(
-        "SELECT id FROM jobs WHERE status = 'processing' AND created_at < ?", 
-        (five_mins_ago,)
-    )
-    
-    stalled_jobs = cursor.fetchall()
-    
+    """Requeue or fail jobs whose heartbeats stopped or that have been processing too long"""
+    now = datetime.now()
+    stalled_jobs = job_store.find_stalled_jobs(now - timedelta(seconds=job_heartbeats.JOB_HEARTBEAT_TIMEOUT),
+                                               now - timedelta(seconds=JOB_MAX_RUNTIME))
+    count = 0
     for job in stalled_jobs:
-        job_id = job[0]
-        cursor.execute(
-            "UPDATE jobs SET status = ?, completed_at = ? WHERE id = ?", 
-            ("failed", datetime.now(), job_id)
-        )
-        print(f"Marked stalled job {job_id} as failed")
-    
-    conn.commit()
-    conn.close()
-    
-    return len(stalled_jobs)
+        started_at = job['started_at'] and datetime.fromisoformat(job['started_at'])
+        reason = TIMEOUT if started_at and started_at < now - timedelta(seconds=JOB_MAX_RUNTIME) else HEARTBEAT_LOST
+        if handle_stalled_job(job, reason):
+            count += 1
+    return count
+
+
+def on_task_failed(event):
+    # A pool process that died (OOM killer, segfault) fails its task with WorkerLostError
+    if 'WorkerLostError' not in event.get('exception', ''):
+        return
+    for job in job_store.find_processing_jobs(task_id=event['uuid']):
+        handle_stalled_job(job, WORKER_LOST)
+
+
+def on_worker_offline(event):
+    for job in job_store.find_processing_jobs(worker=event['hostname']):
+        handle_stalled_job(job, WORKER_LOST)
+
+
+def listen_for_worker_events():
+    """React to lost workers as soon as Celery reports them, instead of waiting for heartbeats to time out"""
+    while True:
+        try:
+            with celery.connection_for_read() as connection:
+                receiver = celery.events.Receiver(connection, handlers={
+                    'task-failed': on_task_failed,
+                    'worker-offline': on_worker_offline,
+                })
+                receiver.capture(limit=None, timeout=None, wakeup=False)
+        except Exception as e:
+            print(f"Error receiving worker events: {str(e)}")
+            time.sleep(5)
+
 
 if __name__ == "__main__":
+    job_store.init_db()
+    threading.Thread(target=listen_for_worker_events, name='worker-events', daemon=True).start()
+
+    last_eviction = 0
     while True:
         try:
             count = update_stalled_jobs()
             if count:
-                print(f"Updated {count} stalled jobs")
+                print(f"Handled {count} stalled jobs")
         except Exception as e:
             print(f"Error in job monitor: {str(e)}")
-        
-        # Sleep for a minute
-        time.sleep(60)
\ No newline at end of file
+
+        if time.time() - last_eviction >= RESULT_CACHE_EVICT_INTERVAL:
+            last_eviction = time.time()
+            try:
+                count = result_cache.evict(OUTPUT_DIRS)
+                if count:
+                    print(f"Evicted {count} cached results")
+            except Exception as e:
+                print(f"Error evicting cached results: {str(e)}")
+
+        time.sleep(MONITOR_INTERVAL)
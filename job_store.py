@@ -0,0 +1,558 @@
+# job_store.py
+# Shared SQLite job store used by the Flask app, the Celery workers and the job monitor.
+# Each thread keeps one connection open (re-opened after a fork), the database runs in
+# WAL mode so readers never block the writer, and every query is a constant SQL string
+# so sqlite3's per-connection statement cache reuses the prepared statements.
+import base64
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+
+import job_events
+import job_tracing
+
+DB_PATH = os.environ.get('JOB_DB_PATH', 'image_jobs.db')
+
+# Milliseconds a writer waits for the write lock before failing with "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('JOB_DB_BUSY_TIMEOUT_MS', '5000'))
+# NORMAL only fsyncs at WAL checkpoints, which is safe against corruption in WAL mode
+SYNCHRONOUS = os.environ.get('JOB_DB_SYNCHRONOUS', 'NORMAL')
+
+_local = threading.local()
+
+# Columns added after the tables' first release; init_db adds them to older databases
+JOB_COLUMNS = [
+    ('cache_key', 'TEXT'),
+    ('started_at', 'TIMESTAMP'),
+    # Percent of denoising steps done, while a text-to-image job runs
+    ('progress', 'INTEGER'),
+    # JSON generation parameters of text-to-image jobs (see generation_profiles)
+    ('params', 'TEXT'),
+    # JSON {"name", "args", "kwargs"} of the Celery task that runs the job, to requeue it
+    ('task', 'TEXT'),
+    # The current attempt's Celery task id and worker; completions of older attempts are ignored
+    ('task_id', 'TEXT'),
+    ('worker', 'TEXT'),
+    # Refreshed by the running task every few seconds, see job_heartbeats.py
+    ('heartbeat_at', 'TIMESTAMP'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    # Why the job failed or was last requeued
+    ('error', 'TEXT'),
+    # The identical in-flight job computing this job's result, see single_flight.py
+    ('leader_id', 'TEXT'),
+]
+USER_COLUMNS = [
+    ('lane', "TEXT NOT NULL DEFAULT 'standard'"),
+    # Bumped whenever is_admin changes, so tokens carrying the old role can be recognized
+    ('role_version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+def _now():
+    # Same text format as sqlite3's default datetime adapter
+    return datetime.now().isoformat(' ')
+
+
+class _Connection(sqlite3.Connection):
+    """Times statements and commits as the 'db' stage of the current trace"""
+
+    def execute(self, *args):
+        with job_tracing.span('db'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with job_tracing.span('db'):
+            return super().executemany(*args)
+
+    def commit(self):
+        with job_tracing.span('db'):
+            super().commit()
+
+    def __exit__(self, *exc_info):
+        # `with conn:` commits or rolls back without going through commit()
+        with job_tracing.span('db'):
+            return super().__exit__(*exc_info)
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=256, factory=_Connection)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection():
+    """Return this thread's connection, opening a new one in forked children"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # Never reuse a connection inherited across fork (Celery prefork workers)
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """Run several statements in one transaction on this thread's connection"""
+    conn = get_connection()
+    with conn:
+        yield conn
+
+
+def _add_missing_columns(conn, table, columns):
+    existing_columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns:
+        if name not in existing_columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def init_db():
+    with transaction() as conn:
+        # Processes starting together (gunicorn workers) take turns creating the schema
+        # and the admin user
+        conn.execute("BEGIN IMMEDIATE")
+        # Create jobs table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL DEFAULT 'image',
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            completed_at TIMESTAMP,
+            image_path TEXT,
+            user_id TEXT NOT NULL
+        )
+        ''')
+
+        _add_missing_columns(conn, 'jobs', JOB_COLUMNS)
+
+        # Job listings page by (created_at, id), newest first, and the monitor scans by status
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs (user_id, created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_type_created ON jobs (user_id, type, created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        # Admission control averages the latest finished jobs of a type
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_type_status_created ON jobs (type, status, created_at)")
+        # Single-flight looks up in-flight jobs by result key and fans transitions out to followers
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_cache_key_status ON jobs (cache_key, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_leader ON jobs (leader_id) WHERE leader_id IS NOT NULL")
+
+        # Create users table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            is_admin BOOLEAN NOT NULL DEFAULT 0
+        )
+        ''')
+        _add_missing_columns(conn, 'users', USER_COLUMNS)
+
+        # Finished results by content hash, see result_cache.py
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            path TEXT NOT NULL,
+            root_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            last_hit_at TIMESTAMP NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_last_hit ON result_cache (last_hit_at)")
+
+        # Create an admin user if it doesn't exist
+        if not conn.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone():
+            admin_password_hash = generate_password_hash('admin_password')  # Change in production
+            conn.execute(
+                "INSERT INTO users (id, username, password_hash, is_admin) VALUES (?, ?, ?, ?)",
+                (str(uuid.uuid4()), 'admin', admin_password_hash, True)
+            )
+
+    # Don't carry this connection into processes forked from the importer
+    close_connection()
+
+
+# Users
+
+def get_user_by_username(username):
+    return get_connection().execute(
+        "SELECT id, username, password_hash, is_admin, role_version FROM users WHERE username = ?", (username,)
+    ).fetchone()
+
+
+def create_user(user_id, username, password_hash, is_admin=False):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO users (id, username, password_hash, is_admin) VALUES (?, ?, ?, ?)",
+            (user_id, username, password_hash, is_admin)
+        )
+
+
+def get_user(user_id):
+    return get_connection().execute(
+        "SELECT id, is_admin, role_version, lane FROM users WHERE id = ?", (user_id,)
+    ).fetchone()
+
+
+def set_user_admin(user_id, is_admin):
+    """Change the user's role and bump its role_version. Returns False if there is no such user"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE users SET is_admin = ?, role_version = role_version + 1 WHERE id = ?", (is_admin, user_id)
+        )
+    return cursor.rowcount > 0
+
+
+def is_admin(user_id):
+    row = get_connection().execute("SELECT is_admin FROM users WHERE id = ?", (user_id,)).fetchone()
+    return bool(row and row[0])
+
+
+def set_user_lane(user_id, lane):
+    """Returns False if there is no such user"""
+    with transaction() as conn:
+        cursor = conn.execute("UPDATE users SET lane = ? WHERE id = ?", (lane, user_id))
+    return cursor.rowcount > 0
+
+
+# Jobs
+
+def _insert_job(conn, job_id, job_type, prompt, user_id, image_path=None, status='queued', cache_key=None, params=None,
+                task=None, single_flight=False):
+    created_at = _now()
+    # Jobs answered from the result cache are created already completed
+    completed_at = created_at if status == 'completed' else None
+    started_at = progress = leader = None
+    # Only a job that would have to be computed can follow one; a cache hit is already done
+    if single_flight and cache_key is not None and status == 'queued':
+        leader = conn.execute(
+            "SELECT id, status, started_at, progress FROM jobs WHERE cache_key = ? AND status IN ('queued', 'processing') AND leader_id IS NULL LIMIT 1",
+            (cache_key,)
+        ).fetchone()
+        if leader:
+            status, started_at, progress = leader['status'], leader['started_at'], leader['progress']
+    conn.execute(
+        "INSERT INTO jobs (id, type, prompt, status, created_at, completed_at, image_path, user_id, cache_key, params, task, leader_id, started_at, progress) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (job_id, job_type, prompt, status, created_at, completed_at, image_path, user_id, cache_key,
+         json.dumps(params) if params is not None else None,
+         json.dumps(task) if task is not None else None,
+         leader['id'] if leader else None, started_at, progress)
+    )
+    return leader
+
+
+def create_job(job_id, job_type, prompt, user_id, image_path=None, status='queued', cache_key=None, params=None, task=None,
+               single_flight=False):
+    """task is the {"name", "args", "kwargs"} of the Celery task the job is sent to
+
+    With single_flight, a job whose cache_key matches a queued or processing job is created
+    as a follower of that job. Returns the (id, status) row of the followed job, or None
+    if the new job has to be sent to Celery itself.
+    """
+    with transaction() as conn:
+        if single_flight and cache_key is not None:
+            # Take the write lock before looking, so two identical submissions can't both lead
+            conn.execute("BEGIN IMMEDIATE")
+        return _insert_job(conn, job_id, job_type, prompt, user_id, image_path, status, cache_key, params, task,
+                           single_flight)
+
+
+def create_jobs(jobs, single_flight=False):
+    """Create several jobs in one transaction; jobs are dicts of create_job's arguments
+
+    Returns the followed job (or None) of each job, in order. A job can follow an
+    identical one earlier in the same batch.
+    """
+    with transaction() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return [_insert_job(conn, single_flight=single_flight, **job) for job in jobs]
+
+
+def find_leader_job(cache_key):
+    """The queued or processing job computing the result with this key, or None"""
+    return get_connection().execute(
+        "SELECT id, status FROM jobs WHERE cache_key = ? AND status IN ('queued', 'processing') AND leader_id IS NULL LIMIT 1",
+        (cache_key,)
+    ).fetchone()
+
+
+JOB_FIELDS = "id, type, prompt, status, created_at, completed_at, image_path, user_id, cache_key, progress, params, task, task_id, worker, started_at, heartbeat_at, attempts, error, leader_id"
+
+
+def get_job(job_id):
+    return get_connection().execute(f"SELECT {JOB_FIELDS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def get_jobs(job_ids):
+    """The rows of the given jobs that exist, in one primary key lookup per id"""
+    # The ids travel as one JSON array so the statement stays the same whatever their number
+    return get_connection().execute(
+        f"SELECT {JOB_FIELDS} FROM jobs WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(job_ids)),)
+    ).fetchall()
+
+
+# Status transitions are announced on job_events once they are committed. A job's
+# transitions are applied to its followers (jobs with leader_id pointing at it) in the
+# same transaction.
+
+def _followers(conn, job_id):
+    return [row[0] for row in conn.execute(
+        "SELECT id FROM jobs WHERE leader_id = ? AND status IN ('queued', 'processing')", (job_id,)
+    )]
+
+def start_job(job_id, task_id=None, worker=None):
+    """Mark a queued job processing and return its type, created_at and started_at
+
+    Returns None if the job isn't queued (e.g. a redelivered task of a job that finished,
+    or that was requeued and is already run by another attempt); the task should then do nothing.
+    """
+    now = _now()
+    with transaction() as conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, progress = 0, task_id = ?, worker = ?, attempts = attempts + 1 WHERE id = ? AND status = 'queued'",
+            ("processing", now, now, task_id, worker, job_id)
+        ).rowcount
+        if not claimed:
+            return None
+        job = conn.execute("SELECT type, created_at, started_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        followers = _followers(conn, job_id)
+        conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, progress = 0 WHERE leader_id = ? AND status IN ('queued', 'processing')",
+            ("processing", now, job_id)
+        )
+    for updated_id in [job_id] + followers:
+        job_events.publish(updated_id, "processing")
+    return job
+
+
+def heartbeat_jobs(job_ids):
+    """Record that the given processing jobs are still being worked on"""
+    now = _now()
+    with transaction() as conn:
+        conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'processing'",
+                         [(now, job_id) for job_id in job_ids])
+
+
+def set_job_progress(job_id, progress, preview=False):
+    """Record how far a processing job is (0-100); preview tells if a new preview image was written"""
+    with transaction() as conn:
+        conn.execute("UPDATE jobs SET progress = ? WHERE id = ? AND status = 'processing'", (progress, job_id))
+        followers = _followers(conn, job_id)
+        conn.execute("UPDATE jobs SET progress = ? WHERE leader_id = ? AND status = 'processing'", (progress, job_id))
+    for updated_id in [job_id] + followers:
+        job_events.publish(updated_id, "processing", progress=progress, preview=preview)
+
+
+# Passing the task_id of the attempt makes a transition conditional on that attempt still
+# owning the job and the job still processing, so a stalled task that wakes up after its
+# job was requeued changes nothing, and the job monitor can't requeue or fail a job that
+# completed after it was found stalled. They return whether the job was updated.
+
+def complete_job(job_id, image_path, task_id=None):
+    completed_at = _now()
+    with transaction() as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, completed_at = ?, image_path = ?, progress = 100, error = NULL WHERE id = ? AND (? IS NULL OR (task_id = ? AND status = 'processing'))",
+            ("completed", completed_at, image_path, job_id, task_id, task_id)
+        ).rowcount
+        followers = _followers(conn, job_id) if updated else []
+        if followers:
+            conn.execute(
+                "UPDATE jobs SET status = ?, completed_at = ?, image_path = ?, progress = 100, error = NULL WHERE leader_id = ? AND status IN ('queued', 'processing')",
+                ("completed", completed_at, image_path, job_id)
+            )
+    if updated:
+        for completed_id in [job_id] + followers:
+            job_events.publish(completed_id, "completed", completed_at=completed_at)
+    return bool(updated)
+
+
+def fail_job(job_id, error=None, task_id=None):
+    completed_at = _now()
+    with transaction() as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, completed_at = ?, error = ? WHERE id = ? AND (? IS NULL OR (task_id = ? AND status = 'processing'))",
+            ("failed", completed_at, error, job_id, task_id, task_id)
+        ).rowcount
+        followers = _followers(conn, job_id) if updated else []
+        if followers:
+            conn.execute(
+                "UPDATE jobs SET status = ?, completed_at = ?, error = ? WHERE leader_id = ? AND status IN ('queued', 'processing')",
+                ("failed", completed_at, error, job_id)
+            )
+    if updated:
+        for failed_id in [job_id] + followers:
+            job_events.publish(failed_id, "failed", completed_at=completed_at, error=error)
+    return bool(updated)
+
+
+def requeue_job(job_id, error=None, task_id=None):
+    """Put the job back in the queue; a retried follower is detached and runs on its own"""
+    with transaction() as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, completed_at = NULL, image_path = NULL, progress = NULL, heartbeat_at = NULL, task_id = NULL, leader_id = NULL, error = ? WHERE id = ? AND (? IS NULL OR (task_id = ? AND status = 'processing'))",
+            ("queued", error, job_id, task_id, task_id)
+        ).rowcount
+        followers = _followers(conn, job_id) if updated else []
+        if followers:
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, progress = NULL WHERE leader_id = ? AND status IN ('queued', 'processing')",
+                ("queued", job_id)
+            )
+    if updated:
+        for queued_id in [job_id] + followers:
+            job_events.publish(queued_id, "queued")
+    return bool(updated)
+
+
+def count_active_jobs():
+    """(type, status, count) of queued and processing jobs, leaving out followers (they add no work)"""
+    return get_connection().execute(
+        "SELECT type, status, COUNT(*) FROM jobs WHERE status IN ('queued', 'processing') AND leader_id IS NULL GROUP BY type, status"
+    ).fetchall()
+
+
+def average_processing_seconds(job_type, sample_size=50):
+    """Average processing time of the latest completed jobs of job_type, None if there are none"""
+    return get_connection().execute(
+        "SELECT AVG((julianday(completed_at) - julianday(started_at)) * 86400) FROM "
+        "(SELECT started_at, completed_at FROM jobs WHERE type = ? AND status = 'completed' AND started_at IS NOT NULL "
+        "ORDER BY created_at DESC LIMIT ?)",
+        (job_type, sample_size)
+    ).fetchone()[0]
+
+
+def encode_cursor(job):
+    """Opaque pagination cursor pointing just past the given job row"""
+    return base64.urlsafe_b64encode(f"{job['created_at']}|{job['id']}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, id) position of a cursor, raising ValueError if it is malformed"""
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return created_at, job_id
+
+
+def _page(rows, limit):
+    # One extra row was fetched to tell whether there is a next page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def list_user_jobs(user_id, job_type=None, limit=50, before=None):
+    """Return (jobs, next_cursor) for a user's jobs, newest first, starting after the before cursor"""
+    conn = get_connection()
+    # Position past the end of the index when no cursor is given ('~' sorts after any timestamp)
+    created_at, job_id = decode_cursor(before) if before else ('~', '')
+
+    if job_type == "pic_transform":
+        rows = conn.execute(
+            "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? AND type IN ('disney', 'sketch') AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, created_at, job_id, limit + 1)
+        ).fetchall()
+    elif job_type:
+        rows = conn.execute(
+            "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? AND type = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, job_type, created_at, job_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, type, prompt, status, created_at, completed_at FROM jobs WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, created_at, job_id, limit + 1)
+        ).fetchall()
+    return _page(rows, limit)
+
+
+def list_all_jobs(limit=50, before=None):
+    """Return (jobs, next_cursor) over every user's jobs, newest first"""
+    created_at, job_id = decode_cursor(before) if before else ('~', '')
+    rows = get_connection().execute(
+        "SELECT id, prompt, status, created_at, completed_at, user_id FROM jobs WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+        (created_at, job_id, limit + 1)
+    ).fetchall()
+    return _page(rows, limit)
+
+
+def find_stalled_jobs(heartbeat_before, started_before):
+    """Processing jobs whose last heartbeat is older than heartbeat_before, or that started before started_before
+
+    Followers don't send heartbeats; they are requeued or failed along with their leader.
+    """
+    return get_connection().execute(
+        f"SELECT {JOB_FIELDS} FROM jobs WHERE status = 'processing' AND leader_id IS NULL AND (COALESCE(heartbeat_at, started_at, created_at) < ? OR started_at < ?)",
+        (heartbeat_before.isoformat(' '), started_before.isoformat(' '))
+    ).fetchall()
+
+
+def find_processing_jobs(task_id=None, worker=None):
+    """Processing jobs run by the given Celery task or worker"""
+    return get_connection().execute(
+        f"SELECT {JOB_FIELDS} FROM jobs WHERE status = 'processing' AND (task_id = ? OR worker = ?)",
+        (task_id, worker)
+    ).fetchall()
+
+
+# Result cache
+
+def get_cached_result(key):
+    return get_connection().execute(
+        "SELECT key, type, path, root_path, size_bytes FROM result_cache WHERE key = ?", (key,)
+    ).fetchone()
+
+
+def touch_cached_result(key):
+    with transaction() as conn:
+        conn.execute("UPDATE result_cache SET last_hit_at = ?, hits = hits + 1 WHERE key = ?", (_now(), key))
+
+
+def mark_cached_result_used(key):
+    """Record that a cached result was fetched (not a cache hit); returns whether the key is cached"""
+    with transaction() as conn:
+        return conn.execute("UPDATE result_cache SET last_hit_at = ? WHERE key = ?", (_now(), key)).rowcount > 0
+
+
+def put_cached_result(key, job_type, path, root_path, size_bytes):
+    now = _now()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO result_cache (key, type, path, root_path, size_bytes, created_at, last_hit_at, hits) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (key, job_type, path, root_path, size_bytes, now, now)
+        )
+
+
+def delete_cached_result(key):
+    with transaction() as conn:
+        conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+
+
+def list_cached_results():
+    """All cache entries, least recently used first"""
+    return get_connection().execute(
+        "SELECT key, type, path, root_path, size_bytes, last_hit_at FROM result_cache ORDER BY last_hit_at"
+    ).fetchall()
@@ -0,0 +1,182 @@
+# job_tracing.py
+# Per-stage timing of job attempts and HTTP requests. A trace covers one job attempt in
+# a worker, or one request in the web server; code running inside it times its stages
+# with span() (database statements are timed by job_store's connections). When the trace
+# ends, the time it spent in each stage is observed in job_stage_seconds{type, stage} or
+# http_stage_seconds{endpoint, stage}, which shows where the time of slow jobs goes.
+#
+# With TRACE_FILE set, every span is also appended to that file as one JSON line shaped
+# like an OpenTelemetry span (trace and span ids, parent, start and end in unix
+# nanoseconds, attributes). All attempts and follow-up tasks of a job share a trace id
+# derived from the job id, so `grep <job_id-without-dashes>` gives the job's timeline.
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import Histogram
+
+TRACE_FILE = os.environ.get('TRACE_FILE')
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+JOB_STAGE_TIME = Histogram('job_stage_seconds', 'Time a job attempt spent in each stage', ['type', 'stage'],
+                           buckets=STAGE_BUCKETS)
+HTTP_STAGE_TIME = Histogram('http_stage_seconds', 'Time a request spent in each stage of its handler',
+                            ['endpoint', 'stage'], buckets=STAGE_BUCKETS)
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+_current_span = contextvars.ContextVar('span', default=None)
+
+_file = None
+_file_pid = None
+_file_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, kind, label, trace_id, attributes):
+        self.kind = kind
+        self.label = label
+        self.trace_id = trace_id
+        self.span_id = _span_id()
+        self.attributes = attributes
+        # stage -> seconds spent in it
+        self.stages = {}
+        self.start_ns = time.time_ns()
+
+
+def _span_id():
+    return uuid.uuid4().hex[:16]
+
+
+def job_trace_id(job_id):
+    """Trace id shared by everything done for a job"""
+    try:
+        return uuid.UUID(job_id).hex
+    except (TypeError, ValueError):
+        return uuid.uuid4().hex
+
+
+def _write(trace, name, span_id, parent_id, start_ns, end_ns, attributes):
+    global _file, _file_pid
+    line = json.dumps({
+        'trace_id': trace.trace_id,
+        'span_id': span_id,
+        'parent_span_id': parent_id,
+        'name': name,
+        'kind': trace.kind,
+        'start_time_unix_nano': start_ns,
+        'end_time_unix_nano': end_ns,
+        'attributes': attributes,
+    })
+    with _file_lock:
+        # Appends of single lines from several processes don't interleave
+        if _file is None or _file_pid != os.getpid():
+            _file = open(TRACE_FILE, 'a', buffering=1)
+            _file_pid = os.getpid()
+        _file.write(line + '\n')
+
+
+def _add_stage(trace, stage, name, parent_id, start_ns, end_ns, seconds, attributes):
+    trace.stages[stage] = trace.stages.get(stage, 0) + seconds
+    if TRACE_FILE:
+        try:
+            _write(trace, name, _span_id(), parent_id, start_ns, end_ns, attributes)
+        except Exception as e:
+            print(f"Failed to write trace span: {str(e)}")
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time the enclosed code as a stage of the current trace (a no-op outside of one)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent_id = _current_span.get()
+    token = _current_span.set(_span_id())
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        _add_stage(trace, stage, stage, parent_id, start_ns, start_ns + int(seconds * 1e9), seconds, attributes)
+
+
+def record(stage, seconds, **attributes):
+    """Add a stage that ended just now but wasn't timed with span(), e.g. the queue wait"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    end_ns = time.time_ns()
+    _add_stage(trace, stage, stage, _current_span.get(), end_ns - int(seconds * 1e9), end_ns, seconds, attributes)
+
+
+def add_stages(stages):
+    """Add stage times measured elsewhere (see collect) to the current trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    for stage, seconds in stages.items():
+        trace.stages[stage] = trace.stages.get(stage, 0) + seconds
+
+
+@contextmanager
+def collect(**attributes):
+    """Collect the stages of work done on behalf of several traces at once, e.g. a batch
+
+    Yields the stage -> seconds dict to hand to each of them with add_stages; nothing is
+    observed for the collection itself.
+    """
+    handle = start_trace('batch', None, **attributes)
+    trace = handle[0]
+    try:
+        yield trace.stages
+    finally:
+        _current_span.reset(handle[2])
+        _current_trace.reset(handle[1])
+        if TRACE_FILE:
+            try:
+                _write(trace, 'batch', trace.span_id, None, trace.start_ns, time.time_ns(), attributes)
+            except Exception as e:
+                print(f"Failed to write trace span: {str(e)}")
+
+
+def start_trace(kind, label, trace_id=None, **attributes):
+    """Start timing a job attempt (kind 'job', label its type) or a request (kind 'http', label its route)
+
+    Returns the handle to pass to end_trace, from the same thread.
+    """
+    trace = Trace(kind, label, trace_id or uuid.uuid4().hex, attributes)
+    return trace, _current_trace.set(trace), _current_span.set(trace.span_id)
+
+
+def end_trace(handle):
+    """Observe the stage times of a trace started with start_trace"""
+    trace, trace_token, span_token = handle
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+
+    histogram = JOB_STAGE_TIME if trace.kind == 'job' else HTTP_STAGE_TIME
+    for stage, seconds in trace.stages.items():
+        histogram.labels(trace.label, stage).observe(seconds)
+    if TRACE_FILE:
+        attributes = dict(trace.attributes, label=trace.label,
+                          stages={stage: round(seconds, 6) for stage, seconds in trace.stages.items()})
+        try:
+            _write(trace, trace.kind, trace.span_id, None, trace.start_ns, time.time_ns(), attributes)
+        except Exception as e:
+            print(f"Failed to write trace span: {str(e)}")
+
+
+@contextmanager
+def trace(kind, label, trace_id=None, **attributes):
+    handle = start_trace(kind, label, trace_id, **attributes)
+    try:
+        yield
+    finally:
+        end_trace(handle)
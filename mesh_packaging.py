@@ -0,0 +1,78 @@
+# mesh_packaging.py
+# Turns a finished TripoSR reconstruction ({output_dir}/0/mesh.obj) into the formats
+# clients download: a binary GLB, which is several times smaller than the OBJ text and
+# loads directly in three.js / model-viewer, and a zip bundle with the meshes and the
+# input image. Runs once per job in the background after reconstruction; a format
+# that is missing (e.g. for jobs from before packaging existed) is built on first request.
+import os
+import zipfile
+
+import atomic_files
+
+# Mime type and file name of each downloadable format
+MESH_FORMATS = {
+    'obj': ('application/octet-stream', 'mesh.obj'),
+    'glb': ('model/gltf-binary', 'mesh.glb'),
+    'zip': ('application/zip', 'bundle.zip'),
+}
+DEFAULT_MESH_FORMAT = os.environ.get('DEFAULT_MESH_FORMAT', 'obj')
+# Simplify GLB meshes to at most this many faces (0 = keep every face). Needs open3d,
+# and the simplified mesh loses its vertex colors
+MESH_SIMPLIFY_FACES = int(os.environ.get('MESH_SIMPLIFY_FACES', '0'))
+
+
+def artifact_path(mesh_path, mesh_format):
+    """Where the given format of the mesh at mesh_path is stored"""
+    return os.path.join(os.path.dirname(mesh_path), MESH_FORMATS[mesh_format][1])
+
+
+def build_glb(mesh_path, simplify_faces=MESH_SIMPLIFY_FACES):
+    import trimesh
+
+    path = artifact_path(mesh_path, 'glb')
+    mesh = trimesh.load(mesh_path, force='mesh', process=False)
+    # The marching cubes output repeats vertices shared by neighbouring faces
+    mesh.merge_vertices()
+    if simplify_faces and len(mesh.faces) > simplify_faces:
+        try:
+            mesh = mesh.simplify_quadric_decimation(simplify_faces)
+        except ImportError:
+            print("open3d is not installed, GLB is not simplified")
+
+    with atomic_files.atomic_path(path) as tmp_path:
+        mesh.export(tmp_path, file_type='glb')
+    return path
+
+
+def build_zip(mesh_path):
+    path = artifact_path(mesh_path, 'zip')
+    glb_path = artifact_path(mesh_path, 'glb')
+    if not os.path.exists(glb_path):
+        build_glb(mesh_path)
+    input_path = os.path.join(os.path.dirname(mesh_path), 'input.png')
+
+    with atomic_files.atomic_path(path) as tmp_path, \
+            zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        bundle.write(mesh_path, 'mesh.obj')
+        # GLB is already binary, deflating it gains little
+        bundle.write(glb_path, 'mesh.glb', compress_type=zipfile.ZIP_STORED)
+        if os.path.exists(input_path):
+            bundle.write(input_path, 'input.png', compress_type=zipfile.ZIP_STORED)
+    return path
+
+
+def package(mesh_path):
+    """Precompute every downloadable format of the mesh at mesh_path"""
+    build_glb(mesh_path)
+    build_zip(mesh_path)
+
+
+def get_artifact(mesh_path, mesh_format):
+    """Path of the mesh in mesh_format, building it if it hasn't been packaged yet"""
+    path = artifact_path(mesh_path, mesh_format)
+    if not os.path.exists(path):
+        if mesh_format == 'glb':
+            build_glb(mesh_path)
+        elif mesh_format == 'zip':
+            build_zip(mesh_path)
+    return path
@@ -0,0 +1,155 @@
+# model_registry.py
+# Keeps diffusion pipelines resident in the worker process so that a warm
+# worker serves a job without any model setup.
+import os
+import platform
+import threading
+import time
+
+import psutil
+from prometheus_client import Counter, Gauge, Histogram
+
+DEFAULT_MODEL_ID = os.environ.get('IMAGE_MODEL_ID', 'stabilityai/stable-diffusion-xl-base-1.0')
+
+# 'auto' picks cuda, then mps (Apple Silicon), then cpu
+MODEL_DEVICE = os.environ.get('MODEL_DEVICE', 'auto')
+
+# Comma separated model ids to load when a worker process starts (empty = load lazily on first use)
+PRELOAD_MODELS = [m.strip() for m in os.environ.get('PRELOAD_MODELS', '').split(',') if m.strip()]
+
+MODEL_LOAD_TIME = Histogram('model_load_seconds', 'Time spent loading a model into a worker', ['model', 'device'],
+                            buckets=(1, 2.5, 5, 10, 20, 40, 80, 160, 320))
+MODEL_LOOKUPS = Counter('model_registry_lookups_total', 'Model registry lookups by warm/cold result', ['model', 'result'])
+MODEL_RESIDENT_BYTES = Gauge('model_resident_bytes', 'Process resident memory after the model was loaded', ['model', 'device'],
+                             multiprocess_mode='liveall')
+
+_pipelines = {}
+_stats = {}
+# (pipeline id, scheduler class, options) -> pipeline sharing the weights of a resident one
+_scheduler_variants = {}
+_lock = threading.Lock()
+
+
+def resolve_device(device=None):
+    device = device or MODEL_DEVICE
+    if device != 'auto':
+        return device
+
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if platform.system() == 'Darwin' and torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def _resident_bytes(device):
+    if device.startswith('cuda'):
+        import torch
+        return torch.cuda.memory_allocated(device)
+    return psutil.Process().memory_info().rss
+
+
+def _optimize(pipe, device, optimizations):
+    import torch
+
+    if 'attention_slicing' in optimizations:
+        # Computes attention in slices: lower peak memory, which matters more than speed on CPU
+        pipe.enable_attention_slicing()
+    if 'channels_last' in optimizations:
+        pipe.unet.to(memory_format=torch.channels_last)
+    if 'compile' in optimizations:
+        if device == 'mps' or not hasattr(torch, 'compile'):
+            print(f"torch.compile is not supported on {device}, skipping it")
+        else:
+            try:
+                pipe.unet = torch.compile(pipe.unet, mode='reduce-overhead')
+            except Exception as e:
+                print(f"torch.compile failed, running the eager model: {str(e)}")
+
+
+def _load_pipeline(model_id, device, optimizations=()):
+    from diffusers import DiffusionPipeline
+    import torch
+
+    # Half precision is not supported for most CPU kernels
+    dtype = torch.float32 if device == 'cpu' else torch.float16
+    pipe = DiffusionPipeline.from_pretrained(
+        model_id,
+        torch_dtype=dtype,
+        use_safetensors=True,
+        variant="fp16"
+    )
+    pipe.to(device)
+    _optimize(pipe, device, optimizations)
+    return pipe
+
+
+def get_pipeline(model_id=DEFAULT_MODEL_ID, device=None, optimizations=()):
+    """Return the resident pipeline for model_id, loading it on first use
+
+    optimizations are applied once at load time, see _optimize.
+    """
+    device = resolve_device(device)
+    key = (model_id, device, tuple(optimizations))
+
+    pipe = _pipelines.get(key)
+    if pipe is not None:
+        _stats[key]['warm_hits'] += 1
+        MODEL_LOOKUPS.labels(model_id, 'warm').inc()
+        return pipe
+
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        pipe = _pipelines.get(key)
+        if pipe is not None:
+            _stats[key]['warm_hits'] += 1
+            MODEL_LOOKUPS.labels(model_id, 'warm').inc()
+            return pipe
+
+        print(f"Loading {model_id} on {device}")
+        start_time = time.time()
+        pipe = _load_pipeline(model_id, device, optimizations)
+        load_time = time.time() - start_time
+        resident = _resident_bytes(device)
+
+        _pipelines[key] = pipe
+        _stats[key] = {
+            'model': model_id,
+            'device': device,
+            'optimizations': list(optimizations),
+            'load_seconds': load_time,
+            'resident_bytes': resident,
+            'cold_hits': 1,
+            'warm_hits': 0,
+        }
+        MODEL_LOOKUPS.labels(model_id, 'cold').inc()
+        MODEL_LOAD_TIME.labels(model_id, device).observe(load_time)
+        MODEL_RESIDENT_BYTES.labels(model_id, device).set(resident)
+        print(f"Loaded {model_id} on {device} in {load_time:.1f}s")
+
+        return pipe
+
+
+def with_scheduler(pipe, class_name, options=None):
+    """A pipeline sharing pipe's weights that samples with another diffusers scheduler"""
+    options = options or {}
+    key = (id(pipe), class_name, tuple(sorted(options.items())))
+    variant = _scheduler_variants.get(key)
+    if variant is None:
+        import diffusers
+        scheduler = getattr(diffusers, class_name).from_config(pipe.scheduler.config, **options)
+        variant = type(pipe)(**{**pipe.components, 'scheduler': scheduler})
+        _scheduler_variants[key] = variant
+    return variant
+
+
+def preload(model_ids=None, device=None):
+    """Load the given (or configured) models up front, e.g. from worker_process_init"""
+    for model_id in (model_ids if model_ids is not None else PRELOAD_MODELS):
+        get_pipeline(model_id, device)
+
+
+def stats():
+    """Load time, warm/cold hit counts and resident memory of every loaded pipeline"""
+    return [dict(s) for s in _stats.values()]
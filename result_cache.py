@@ -0,0 +1,165 @@
+# result_cache.py
+# Content-addressed cache of finished results. A job's key hashes its type, model,
+# normalized prompt or uploaded file bytes, generation parameters and seed; a new job
+# with the key of a finished one is completed right away by pointing at that output.
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+from prometheus_client import Counter, Gauge
+
+import job_store
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+# Eviction keeps the cached results under this many bytes...
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(50 * 1024 ** 3)))
+# ...and drops results that were not used for this many days
+RESULT_CACHE_MAX_AGE_DAYS = float(os.environ.get('RESULT_CACHE_MAX_AGE_DAYS', '30'))
+# Fetching a result counts as using it at most once per this many seconds, so a gallery
+# that keeps downloading the same results doesn't write to the database every time
+RESULT_CACHE_USE_INTERVAL = float(os.environ.get('RESULT_CACHE_USE_INTERVAL', '3600'))
+
+CACHE_LOOKUPS = Counter('result_cache_lookups_total', 'Result cache lookups by job type and hit/miss', ['type', 'result'])
+CACHE_EVICTIONS = Counter('result_cache_evictions_total', 'Results evicted from the cache', ['reason'])
+CACHE_BYTES = Gauge('result_cache_bytes', 'Bytes of results held by the cache after the last eviction run',
+                    multiprocess_mode='mostrecent')
+
+# output path -> when this process last marked it used (time.monotonic())
+_used = {}
+_used_lock = threading.Lock()
+
+
+def normalize_prompt(prompt):
+    # The CLIP tokenizer lowercases and ignores extra whitespace, so these prompts render the same
+    return ' '.join(prompt.lower().split())
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(job_type, model_id, content, params=None, seed=None):
+    """content is the normalized prompt or the sha256 of the uploaded file"""
+    payload = json.dumps([job_type, model_id, content, params or {}, seed], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(key, job_type):
+    """Return the output path of a finished job with this key, or None"""
+    if not RESULT_CACHE_ENABLED or key is None:
+        return None
+
+    entry = job_store.get_cached_result(key)
+    if entry and os.path.exists(entry['path']):
+        job_store.touch_cached_result(key)
+        CACHE_LOOKUPS.labels(job_type, 'hit').inc()
+        return entry['path']
+
+    if entry:
+        # The file was removed behind our back
+        job_store.delete_cached_result(key)
+    CACHE_LOOKUPS.labels(job_type, 'miss').inc()
+    return None
+
+
+def mark_used(key, path, root_path=None):
+    """Record that the output at path, of a job with this key, was fetched
+
+    Age eviction then keeps results that are still opened, not only ones that are still
+    resubmitted. Outputs the cache doesn't know about get a new modification time, which
+    the sweep of untracked outputs goes by. root_path is what eviction deletes (default: path).
+    """
+    now = time.monotonic()
+    with _used_lock:
+        if now - _used.get(path, -RESULT_CACHE_USE_INTERVAL) < RESULT_CACHE_USE_INTERVAL:
+            return
+        if len(_used) > 100000:
+            _used.clear()
+        _used[path] = now
+    try:
+        if not (RESULT_CACHE_ENABLED and key is not None and job_store.mark_cached_result_used(key)):
+            os.utime(root_path or path)
+    except Exception as e:
+        # Serving the result matters more than keeping it longer
+        print(f"Failed to mark result {path} used: {str(e)}")
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(dirpath, name))
+                   for dirpath, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def store(key, job_type, path, root_path=None):
+    """Remember a finished result. root_path is what eviction deletes (default: path itself)"""
+    if not RESULT_CACHE_ENABLED or key is None:
+        return
+    root_path = root_path or path
+    try:
+        job_store.put_cached_result(key, job_type, path, root_path, _size(root_path))
+    except Exception as e:
+        # A result that isn't cached is still a result
+        print(f"Failed to cache result {path}: {str(e)}")
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def evict(output_dirs=(), max_bytes=RESULT_CACHE_MAX_BYTES, max_age_days=RESULT_CACHE_MAX_AGE_DAYS):
+    """Delete results unused for max_age_days, then least recently used ones until under max_bytes.
+
+    Files in output_dirs older than max_age_days that the cache doesn't know about
+    (e.g. from before the cache existed) are removed as well. Returns the number of
+    removed entries and files.
+    """
+    cutoff = datetime.now() - timedelta(days=max_age_days)
+    entries = job_store.list_cached_results()
+    total_bytes = sum(entry['size_bytes'] for entry in entries)
+    removed = 0
+
+    for entry in entries:
+        if entry['last_hit_at'] < cutoff.isoformat(' '):
+            reason = 'age'
+        elif total_bytes > max_bytes:
+            reason = 'size'
+        else:
+            continue
+        _remove(entry['root_path'])
+        job_store.delete_cached_result(entry['key'])
+        total_bytes -= entry['size_bytes']
+        CACHE_EVICTIONS.labels(reason).inc()
+        removed += 1
+
+    # Sweep untracked old outputs
+    known = {os.path.abspath(entry['root_path']) for entry in job_store.list_cached_results()}
+    # An output dir inside another one (e.g. output/thumbs) is swept file by file on its own
+    nested = {os.path.abspath(output_dir) for output_dir in output_dirs}
+    cutoff_timestamp = cutoff.timestamp()
+    for output_dir in output_dirs:
+        if not os.path.isdir(output_dir):
+            continue
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            if os.path.abspath(path) in known or os.path.abspath(path) in nested:
+                continue
+            if os.path.getmtime(path) >= cutoff_timestamp:
+                continue
+            _remove(path)
+            CACHE_EVICTIONS.labels('untracked').inc()
+            removed += 1
+
+    CACHE_BYTES.set(total_bytes)
+    return removed
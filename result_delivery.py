@@ -0,0 +1,94 @@
+# result_delivery.py
+# Sends finished results (images, meshes) to clients. A job's output never changes
+# once it is completed, so responses carry a strong ETag and a long Cache-Control
+# lifetime: repeat fetches are answered with 304 and partial fetches (Range) with 206
+# without the app reading the whole file. The file bytes themselves can be handed off
+# to the web server in front of the app (nginx X-Accel-Redirect, Apache/lighttpd X-Sendfile).
+import hashlib
+import os
+
+from flask import current_app, request, send_file
+from werkzeug.utils import send_file as werkzeug_send_file
+
+import job_tracing
+
+# How long clients may cache a result (default one year, results are immutable)
+RESULT_HTTP_MAX_AGE = int(os.environ.get('RESULT_HTTP_MAX_AGE', str(365 * 24 * 3600)))
+# Comma separated "directory=internal location" pairs. A result below one of these
+# directories is served by nginx from the internal location via X-Accel-Redirect, e.g.
+# "/srv/AI-Studio-Backend/output=/protected/output"
+RESULT_ACCEL_LOCATIONS = [
+    (os.path.abspath(directory.strip()), location.strip().rstrip('/'))
+    for directory, _, location in (pair.partition('=') for pair in os.environ.get('RESULT_ACCEL_LOCATIONS', '').split(','))
+    if directory.strip() and location.strip()
+]
+
+
+def result_etag(job_id, path, stat):
+    """Strong ETag of a job's result file, from the job id and the file's name, size and mtime"""
+    data = f"{job_id}:{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+def _accel_location(path):
+    path = os.path.abspath(path)
+    for directory, location in RESULT_ACCEL_LOCATIONS:
+        if path.startswith(directory + os.sep):
+            return location + '/' + os.path.relpath(path, directory).replace(os.sep, '/')
+    return None
+
+
+def _set_cache_headers(response, etag, public):
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = RESULT_HTTP_MAX_AGE
+    response.cache_control.immutable = True
+    # Results behind a login must not be stored by shared caches
+    if public:
+        response.cache_control.public = True
+        response.cache_control.private = None
+    else:
+        response.cache_control.public = None
+        response.cache_control.private = True
+        response.vary.add('Authorization')
+    return response
+
+
+def send_result(job_id, path, mimetype, as_attachment=False, download_name=None, public=False):
+    """Send a result file with conditional GET, Range and offload support
+
+    public marks responses that shared caches (CDNs, proxies) may store, like /api/share.
+    """
+    # Times building the response; the body is streamed after the view has returned
+    with job_tracing.span('file_send'):
+        return _send_result(job_id, path, mimetype, as_attachment, download_name, public)
+
+
+def _send_result(job_id, path, mimetype, as_attachment, download_name, public):
+    # Outputs are written relative to the working directory, but Flask resolves relative
+    # paths against the app's root, which differs when the server isn't started from it
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    etag = result_etag(job_id, path, stat)
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        return _set_cache_headers(response, etag, public)
+
+    accel_location = _accel_location(path)
+    if accel_location:
+        # nginx reads the file and handles Range itself; the app only supplies the headers
+        response = werkzeug_send_file(path, request.environ, mimetype=mimetype, as_attachment=as_attachment,
+                                      download_name=download_name, conditional=False, etag=False,
+                                      use_x_sendfile=True, response_class=current_app.response_class)
+        del response.headers['X-Sendfile']
+        del response.headers['Content-Length']
+        response.headers['X-Accel-Redirect'] = accel_location
+        return _set_cache_headers(response, etag, public)
+
+    # Flask's send_file answers Range and If-Range requests with 206, sets X-Sendfile when
+    # USE_X_SENDFILE is configured and otherwise streams through wsgi.file_wrapper, which
+    # WSGI servers such as gunicorn implement with sendfile()
+    response = send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                         conditional=True, etag=etag, last_modified=stat.st_mtime)
+    return _set_cache_headers(response, etag, public)
@@ -0,0 +1,46 @@
+# single_flight.py
+# Identical jobs submitted while the first one is still queued or running share its
+# computation. Identity is the job's result cache key (type, model, normalized prompt or
+# digest of the uploaded file, generation parameters and seed). The new job row follows
+# the in-flight one (its leader_id) instead of getting a Celery task, and job_store
+# applies the leader's start, progress, completion and failure to every follower, so
+# a burst of the same prompt or image costs one inference.
+import os
+
+from prometheus_client import Counter
+
+import job_store
+
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1'
+
+JOINS = Counter('single_flight_joins_total', 'Jobs that joined an identical in-flight job instead of running', ['type'])
+
+
+def find_leader(cache_key):
+    """The queued or processing job that would compute the result with this key, or None"""
+    if not SINGLE_FLIGHT_ENABLED or cache_key is None:
+        return None
+    return job_store.find_leader_job(cache_key)
+
+
+def create_job(job_id, job_type, prompt, user_id, cache_key, **kwargs):
+    """Create a queued job, following an identical in-flight job if there is one
+
+    Returns the (id, status) row of the followed job, or None if the caller has to send
+    the job's task.
+    """
+    leader = job_store.create_job(job_id, job_type, prompt, user_id, cache_key=cache_key,
+                                  single_flight=SINGLE_FLIGHT_ENABLED, **kwargs)
+    if leader:
+        JOINS.labels(job_type).inc()
+        print(f"Job {job_id} follows identical job {leader['id']}")
+    return leader
+
+
+def create_jobs(jobs):
+    """create_job for several jobs in one transaction; returns the followed job (or None) of each"""
+    leaders = job_store.create_jobs(jobs, single_flight=SINGLE_FLIGHT_ENABLED)
+    for job, leader in zip(jobs, leaders):
+        if leader:
+            JOINS.labels(job['job_type']).inc()
+    return leaders
@@ -0,0 +1,271 @@
+# tasks.py
+# The Celery tasks that run jobs, with the model code behind them. Only workers import
+# this module (celery_app includes it); the API server and the job monitor send tasks
+# by name, so they start without it.
+import os
+import time
+
+from celery import concurrency
+from celery.concurrency import prefork, solo
+from celery.signals import worker_init, worker_shutdown, worker_process_init, worker_process_shutdown, task_revoked
+
+import comfyui_client
+import config
+import generation_profiles
+import image_previews
+import job_heartbeats
+import job_metrics
+import job_store
+import job_tracing
+import mesh_packaging
+import model_registry
+import result_cache
+import thumbnails
+import triposr_client
+from celery_app import celery
+from image_batcher import ImageBatcher
+
+# Start the TripoSR server when a worker process starts instead of on its first 3D job
+PRELOAD_TRIPOSR = os.environ.get('PRELOAD_TRIPOSR', '0') == '1'
+
+# Whether the worker runs tasks in its own process (threads, gevent or eventlet pool)
+_tasks_in_worker_process = False
+
+def runs_tasks_in_worker_process(worker):
+    """Whether the worker's pool runs tasks in the worker's own process
+
+    Only the prefork and solo pools send worker_process_init / worker_process_shutdown;
+    with the others the worker handles them itself.
+    """
+    pool_cls = concurrency.get_implementation(worker.pool_cls)
+    return not issubclass(pool_cls, (prefork.TaskPool, solo.TaskPool))
+
+@worker_init.connect
+def worker_init_handler(sender=None, **kwargs):
+    global _tasks_in_worker_process
+    # Once per worker, before pool processes are forked. The API server creates these
+    # too, but a worker may be the first process to start
+    os.makedirs('output', exist_ok=True)
+    job_store.init_db()
+    if sender is not None and config.QUEUE_COMFYUI in sender.app.amqp.queues.consume_from:
+        try:
+            comfyui_client.get_client(config.COMFY_UI_DIR).check_setup()
+        except comfyui_client.ComfyUIError as e:
+            # Celery logs and ignores exceptions of signal handlers; exit so a bad deploy fails now
+            raise SystemExit(f"Can't run ComfyUI jobs: {str(e)}")
+    if sender is not None and runs_tasks_in_worker_process(sender):
+        _tasks_in_worker_process = True
+        worker_process_init_handler()
+
+@worker_process_init.connect
+def worker_process_init_handler(**kwargs):
+    # Load the configured models once per worker process instead of once per job
+    model_registry.preload()
+    generation_profiles.preload()
+    if PRELOAD_TRIPOSR:
+        triposr_client.get_client().ensure_running()
+
+@worker_process_shutdown.connect
+def worker_process_shutdown_handler(pid=None, **kwargs):
+    job_metrics.mark_process_dead(pid or os.getpid())
+
+@worker_shutdown.connect
+def worker_shutdown_handler(**kwargs):
+    print("Worker shutting down...")
+    if _tasks_in_worker_process:
+        worker_process_shutdown_handler()
+    
+@task_revoked.connect
+def task_revoked_handler(request=None, terminated=False, signum=None, **kwargs):
+    if terminated and request:
+        job_id = request.args[0] if request.args else None
+        if job_id:
+            try:
+                # Update the job status in the database, unless the job monitor already
+                # requeued it under a new task
+                job_store.fail_job(job_id, "Task was terminated", task_id=request.id)
+                print(f"Updated job {job_id} as failed due to task termination")
+            except Exception as e:
+                print(f"Failed to update database for job {job_id}: {str(e)}")
+
+# Runs one pipeline call for a batch of compatible prompts (same model and resolution)
+def run_image_batch(key, items):
+    profile, model_id, width, height, steps, guidance, scheduler = key
+    job_ids = [job_id for job_id, _, _ in items]
+    prompts = [prompt for _, prompt, _ in items]
+    seeds = [seed for _, _, seed in items]
+    with job_tracing.span('model_load'):
+        pipe = generation_profiles.pipeline_for({'profile': profile, 'scheduler': scheduler})
+    
+    # Leave out what the request and profile don't set, so the pipeline's defaults apply
+    options = {name: value for name, value in (('width', width), ('height', height), ('num_inference_steps', steps),
+                                               ('guidance_scale', guidance)) if value is not None}
+    if any(seed is not None for seed in seeds):
+        import torch
+        # One generator per image so each seeded job is reproducible whatever it was batched with
+        options['generator'] = [torch.Generator('cpu').manual_seed(seed if seed is not None else torch.seed())
+                                for seed in seeds]
+    if image_previews.PREVIEW_EVERY_STEPS > 0:
+        # Report progress and write previews of the running jobs while the pipeline denoises
+        options['callback_on_step_end'] = image_previews.StepPreviewer(job_ids)
+    with job_tracing.span('inference', batch_size=len(items)):
+        return pipe(prompt=prompts, **options).images
+
+# Jobs running concurrently in this worker (threads pool) share pipeline calls
+image_batcher = ImageBatcher(run_image_batch)
+
+# Celery task for prompt-to-image generation
+@celery.task(bind=True, max_retries=3, soft_time_limit=600, name=config.TASK_IMAGE)
+def generate_image_task(self, job_id, prompt, user_id, cache_key=None, params=None):
+    job = None
+    trace = job_tracing.start_trace('job', 'image', job_tracing.job_trace_id(job_id),
+                                    job_id=job_id, task_id=self.request.id)
+    try:
+        # Update job status to processing
+        job = job_store.start_job(job_id, self.request.id, self.request.hostname)
+        if job is None:
+            print(f"Job {job_id} is no longer queued, skipping task {self.request.id}")
+            return {"status": "skipped"}
+        job_heartbeats.start(job_id)
+        job_metrics.observe_job_started(job)
+        
+        # Generate image. The batcher coalesces this prompt with other queued
+        # prompts with the same settings into one pipeline call; the registry keeps
+        # the pipeline resident so only a cold worker pays for loading it
+        params = params or generation_profiles.parse_params({})
+        start_time = time.time()
+        future = image_batcher.submit(generation_profiles.batch_key(params), (job_id, prompt, params['seed']))
+        image = future.result()
+        job_metrics.observe_profile_latency(params['profile'], time.time() - start_time)
+        # The batch ran in the batcher's thread; count its stages (wait, model load, inference) for this job
+        job_tracing.add_stages(future.stages)
+        
+        # Save image
+        image_path = f"output/{job_id}.png"
+        with job_tracing.span('image_save'):
+            image.save(image_path)
+        with job_tracing.span('postprocess'):
+            thumbnails.generate(image_path, image)
+        image_previews.discard(job_id)
+        
+        # Update job as completed
+        job_store.complete_job(job_id, image_path, task_id=self.request.id)
+        job_metrics.observe_job_finished(job, "completed")
+        result_cache.store(cache_key, "image", image_path)
+        
+        return {"status": "completed", "image_path": image_path}
+    
+    except Exception as e:
+        # Update job as failed
+        job_store.fail_job(job_id, str(e), task_id=self.request.id)
+        if job:
+            job_metrics.observe_job_finished(job, "failed")
+        image_previews.discard(job_id)
+        
+        return {"status": "failed", "error": str(e)}
+    
+    finally:
+        if job:
+            job_heartbeats.stop(job_id)
+        job_tracing.end_trace(trace)
+        
+# Celery task for 2D-to-3D model generation
+@celery.task(bind=True, max_retries=3, soft_time_limit=600, name=config.TASK_3D_MODEL)
+def generate_3d_model_task(self, job_id, file_path, user_id, cache_key=None):
+    job = None
+    trace = job_tracing.start_trace('job', '3d_model', job_tracing.job_trace_id(job_id),
+                                    job_id=job_id, task_id=self.request.id)
+    try:
+        # Update job status to processing
+        job = job_store.start_job(job_id, self.request.id, self.request.hostname)
+        if job is None:
+            print(f"Job {job_id} is no longer queued, skipping task {self.request.id}")
+            return {"status": "skipped"}
+        job_heartbeats.start(job_id)
+        job_metrics.observe_job_started(job)
+        
+        # Hand the image to this worker's TripoSR server, which keeps the model loaded
+        print("Running 2D-to-3D reconstruction")
+        output_dir = f"{config.OUTPUT_DIR_3D}/{job_id}"
+        triposr_client.get_client().run(file_path, output_dir)
+        print("2D-to-3D Process completed")
+        
+        # Update job as completed
+        job_store.complete_job(job_id, output_dir + "/0/mesh.obj", task_id=self.request.id)
+        job_metrics.observe_job_finished(job, "completed")
+        result_cache.store(cache_key, "3d_model", output_dir + "/0/mesh.obj", root_path=output_dir)
+        
+        # Build the GLB and zip downloads off the TripoSR queue
+        package_3d_model_task.delay(job_id, output_dir + "/0/mesh.obj")
+        
+        return {"status": "completed", "output_dir": output_dir}
+    
+    except Exception as e:
+        # Update job as failed
+        job_store.fail_job(job_id, str(e), task_id=self.request.id)
+        if job:
+            job_metrics.observe_job_finished(job, "failed")
+        
+        return {"status": "failed", "error": str(e)}
+    
+    finally:
+        if job:
+            job_heartbeats.stop(job_id)
+        job_tracing.end_trace(trace)
+        
+# Celery task for packaging a finished 3D model into its download formats
+@celery.task(soft_time_limit=300, name=config.TASK_PACKAGE_3D_MODEL)
+def package_3d_model_task(job_id, mesh_path):
+    try:
+        start_time = time.time()
+        with job_tracing.trace('job', '3d_model', job_tracing.job_trace_id(job_id), job_id=job_id), \
+                job_tracing.span('postprocess'):
+            mesh_packaging.package(mesh_path)
+        print(f"Packaged 3D model {job_id} in {time.time() - start_time:.1f}s")
+        return {"status": "completed", "mesh_path": mesh_path}
+    except Exception as e:
+        # The job stays completed: a missing format is built when it is first requested
+        print(f"Failed to package 3D model {job_id}: {str(e)}")
+        return {"status": "failed", "error": str(e)}
+
+# Celery task for ComfyUI
+@celery.task(bind=True, max_retries=3, soft_time_limit=600, name=config.TASK_COMFYUI)
+def runComfyUI(self, job_id, file_name, user_id, type, cache_key=None):
+    job = None
+    trace = job_tracing.start_trace('job', type, job_tracing.job_trace_id(job_id),
+                                    job_id=job_id, task_id=self.request.id)
+    try:
+        # Update job status to processing
+        job = job_store.start_job(job_id, self.request.id, self.request.hostname)
+        if job is None:
+            print(f"Job {job_id} is no longer queued, skipping task {self.request.id}")
+            return {"status": "skipped"}
+        job_heartbeats.start(job_id)
+        job_metrics.observe_job_started(job)
+        
+        # Queue the workflow on the running ComfyUI instance and wait for its output image
+        print(f"Running {type} workflow on ComfyUI")
+        with job_tracing.span('inference'):
+            image_path = comfyui_client.get_client(config.COMFY_UI_DIR).run(type, file_name, f"{type}_{job_id}")
+        with job_tracing.span('postprocess'):
+            thumbnails.generate(image_path)
+        
+        # Update job as completed
+        job_store.complete_job(job_id, image_path, task_id=self.request.id)
+        job_metrics.observe_job_finished(job, "completed")
+        result_cache.store(cache_key, type, image_path)
+        
+        return {"status": "completed", "image_path": image_path}
+    
+    except Exception as e:
+        # Update job as failed
+        job_store.fail_job(job_id, str(e), task_id=self.request.id)
+        if job:
+            job_metrics.observe_job_finished(job, "failed")
+        
+        return {"status": "failed", "error": str(e)}
+    
+    finally:
+        if job:
+            job_heartbeats.stop(job_id)
+        job_tracing.end_trace(trace)
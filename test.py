@@ -1,11 +1,15 @@
 import requests
+import json
 
-# Register a new user
-# register_response = requests.post('http://127.0.0.1:5000/register', 
+BASE_URL = 'http://127.0.0.1:5001/api'
+
+# Register a new user (uncomment if needed)
+# register_response = requests.post(f'{BASE_URL}/register',
 #                                  json={'username': 'user1', 'password': 'password123'})
+# print(register_response.json())
 
 # Login to get token
-login_response = requests.post('http://127.0.0.1:5000/login', 
+login_response = requests.post(f'{BASE_URL}/login',
                               json={'username': 'user1', 'password': 'password123'})
 if login_response.status_code == 200:
     try:
@@ -19,11 +23,30 @@ else:
 
 # Use token for authenticated requests
 headers = {'Authorization': f'Bearer {token}'}
-generate_response = requests.post('http://127.0.0.1:5000/generate',
+generate_response = requests.post(f'{BASE_URL}/generate',
                                  json={'prompt': 'An astronaut riding a green horse'},
                                  headers=headers)
+generate_response.raise_for_status()
 job_id = generate_response.json()['job_id']
+print(generate_response.json())
+
+# Wait for the job to finish: the server pushes every status change over Server-Sent Events
+status_data = None
+with requests.get(f'{BASE_URL}/status/{job_id}/stream', headers=headers, stream=True) as stream:
+    for line in stream.iter_lines(decode_unicode=True):
+        if line.startswith('data: '):
+            status_data = json.loads(line[len('data: '):])
+            print(status_data)
 
-# # Check status of your job
-status_response = requests.get(f'http://127.0.0.1:5000/status/{job_id}', headers=headers)
-print(status_response.json())
\ No newline at end of file
+if status_data and status_data['status'] == 'completed':
+    # Retrieve the image
+    result_response = requests.get(f'{BASE_URL}/result/{job_id}', headers=headers)
+    if result_response.status_code == 200:
+        with open(f'result_{job_id}.png', 'wb') as result_file:
+            result_file.write(result_response.content)
+        print(f"Result saved as result_{job_id}.png")
+    else:
+        print(f"Failed to retrieve result with status code {result_response.status_code}")
+        result_response.raise_for_status()
+else:
+    print(f"Job did not complete: {status_data}")
@@ -1,13 +1,15 @@
 import requests
-import time
+import json
+
+BASE_URL = 'http://127.0.0.1:5001/api'
 
 # Register a new user (uncomment if needed)
-# register_response = requests.post('http://127.0.0.1:5000/register', 
+# register_response = requests.post(f'{BASE_URL}/register', 
 #                                  json={'username': 'user1', 'password': 'password123'})
 # print(register_response.json())
 
 # Login to get token
-login_response = requests.post('http://127.0.0.1:5000/login', 
+login_response = requests.post(f'{BASE_URL}/login', 
                               json={'username': 'user1', 'password': 'password123'})
 if login_response.status_code == 200:
     try:
@@ -26,7 +28,7 @@ headers = {'Authorization': f'Bearer {token}'}
 # Upload an image
 with open('../TripoSR/examples/chair.png', 'rb') as image_file:
     files = {'file': image_file}
-    upload_response = requests.post('http://127.0.0.1:5000/upload', files=files, headers=headers)
+    upload_response = requests.post(f'{BASE_URL}/upload', files=files, data={'job_type': '3d_model'}, headers=headers)
     if upload_response.status_code == 200:
         upload_data = upload_response.json()
         print(upload_data)
@@ -35,22 +37,23 @@ with open('../TripoSR/examples/chair.png', 'rb') as image_file:
         print(f"Upload failed with status code {upload_response.status_code}")
         upload_response.raise_for_status()
 
-# Check status of your job
-while True:
-    status_response = requests.get(f'http://127.0.0.1:5000/status/{job_id}', headers=headers)
-    status_data = status_response.json()
-    print(status_data)
-    if status_data['status'] == 'completed':
-        # Retrieve the result
-        result_response = requests.get(f'http://127.0.0.1:5000/result/{job_id}', headers=headers)
-        if result_response.status_code == 200:
-            with open(f'result_{job_id}.zip', 'wb') as result_file:
-                result_file.write(result_response.content)
-            print(f"Result saved as result_{job_id}.zip")
-        else:
-            print(f"Failed to retrieve result with status code {result_response.status_code}")
-            result_response.raise_for_status()
-    elif status_data['status'] == 'failed':
-        print(f"Job failed with error: {status_data['error']}")
-        break
-    time.sleep(5)  # Wait for 5 seconds before checking again
\ No newline at end of file
+# Wait for the job to finish: the server pushes every status change over Server-Sent Events
+status_data = None
+with requests.get(f'{BASE_URL}/status/{job_id}/stream', headers=headers, stream=True) as stream:
+    for line in stream.iter_lines(decode_unicode=True):
+        if line.startswith('data: '):
+            status_data = json.loads(line[len('data: '):])
+            print(status_data)
+
+if status_data and status_data['status'] == 'completed':
+    # Retrieve the result
+    result_response = requests.get(f'{BASE_URL}/result/{job_id}', params={'format': 'zip'}, headers=headers)
+    if result_response.status_code == 200:
+        with open(f'result_{job_id}.zip', 'wb') as result_file:
+            result_file.write(result_response.content)
+        print(f"Result saved as result_{job_id}.zip")
+    else:
+        print(f"Failed to retrieve result with status code {result_response.status_code}")
+        result_response.raise_for_status()
+else:
+    print(f"Job did not complete: {status_data}")
\ No newline at end of file
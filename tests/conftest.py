@@ -0,0 +1,25 @@
+# Tests run against a scratch job database, with Celery, status events and rate limits
+# kept in process, so they need neither Redis nor the models.
+import os
+import sys
+import tempfile
+
+# Modules that open the job database when imported (app) get a scratch one as well
+os.environ.update(CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://',
+                  JOB_EVENTS_URL='memory://', RATE_LIMIT_URL='memory://',
+                  JOB_DB_PATH=os.path.join(tempfile.mkdtemp(prefix='ai-studio-tests-'), 'image_jobs.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import job_store
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh job database for the test"""
+    monkeypatch.setattr(job_store, 'DB_PATH', str(tmp_path / 'image_jobs.db'))
+    job_store.close_connection()
+    job_store.init_db()
+    yield job_store
+    job_store.close_connection()
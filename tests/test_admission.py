@@ -0,0 +1,35 @@
+import pytest
+
+import admission
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    monkeypatch.setattr(admission, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(admission, 'RATE_LIMITS', {'image': (20, 10)})
+    monkeypatch.setattr(admission, '_buckets', {})
+
+
+def test_batch_larger_than_the_burst_is_paid_for_over_time(buckets):
+    # 50 jobs at 20 per minute with a burst of 10: admitted at once, then 40 jobs of debt
+    admission.check_rate_limit('u1', 'image', cost=50)
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.check_rate_limit('u1', 'image')
+    assert 120 <= rejected.value.retry_after <= 124
+
+
+def test_batch_larger_than_the_burst_needs_a_full_bucket(buckets):
+    admission.check_rate_limit('u1', 'image', cost=5)
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.check_rate_limit('u1', 'image', cost=50)
+    assert 15 <= rejected.value.retry_after <= 16
+    # Other users have their own buckets
+    admission.check_rate_limit('u2', 'image', cost=50)
+
+
+def test_checking_without_taking_leaves_the_tokens(buckets):
+    for _ in range(3):
+        admission.check_rate_limit('u1', 'image', cost=10, take=False)
+    admission.check_rate_limit('u1', 'image', cost=10)
+    with pytest.raises(admission.Rejected):
+        admission.check_rate_limit('u1', 'image', take=False)
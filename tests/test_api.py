@@ -0,0 +1,81 @@
+import io
+
+import pytest
+from PIL import Image
+
+import admission
+import app as app_module
+import celery_app
+import config
+import result_cache
+
+
+@pytest.fixture
+def client(db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'COMFY_UI_DIR', str(tmp_path / 'ComfyUI'))
+    (tmp_path / 'ComfyUI' / 'input').mkdir(parents=True)
+    monkeypatch.setattr(admission, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(admission, 'RATE_LIMITS', dict(admission.RATE_LIMITS, image=(20, 2), sketch=(10, 2)))
+    monkeypatch.setattr(admission, '_buckets', {})
+    sent = []
+    monkeypatch.setattr(app_module, 'send_job_task', lambda spec, user_id: sent.append(spec) or type('Task', (), {'id': 't'}))
+    monkeypatch.setattr(celery_app, 'send_job_tasks', lambda specs, user_id: sent.extend(specs))
+    client = app_module.app.test_client()
+    client.post('/api/register', json={'username': 'user1', 'password': 'password1'})
+    token = client.post('/api/login', json={'username': 'user1', 'password': 'password1'}).json['access_token']
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {token}"
+    return client
+
+
+def png():
+    image = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 10, 10)).save(image, 'PNG')
+    image.seek(0)
+    return image
+
+
+def test_rejected_and_cached_image_jobs_take_no_tokens(client, monkeypatch):
+    for _ in range(3):
+        assert client.post('/api/generate', json={'prompt': 'x', 'steps': 10 ** 6}).status_code == 400
+    lookup = result_cache.lookup
+    monkeypatch.setattr(result_cache, 'lookup', lambda cache_key, job_type: 'output/cached.png')
+    for _ in range(3):
+        assert client.post('/api/generate', json={'prompt': 'cached'}).json['status'] == 'completed'
+    monkeypatch.setattr(result_cache, 'lookup', lookup)
+    # The whole burst of 2 is still there
+    assert client.post('/api/generate', json={'prompt': 'a'}).json['status'] == 'queued'
+    assert client.post('/api/generate', json={'prompt': 'b'}).json['status'] == 'queued'
+    assert client.post('/api/generate', json={'prompt': 'c'}).status_code == 429
+
+
+def test_only_queued_jobs_take_tokens(client):
+    # A burst of 2: the identical third prompt follows the first job and is free
+    assert client.post('/api/generate', json={'prompt': 'a'}).json['status'] == 'queued'
+    assert client.post('/api/generate', json={'prompt': 'a'}).status_code == 200
+    assert client.post('/api/generate', json={'prompt': 'b'}).json['status'] == 'queued'
+    assert client.post('/api/generate', json={'prompt': 'c'}).status_code == 429
+
+
+def test_rejected_uploads_take_no_tokens(client):
+    for _ in range(3):
+        response = client.post('/api/upload', data={'job_type': 'sketch', 'file': (io.BytesIO(b'not an image'), 'x.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 415
+    response = client.post('/api/upload', data={'job_type': 'sketch', 'file': (png(), 'x.png')},
+                           content_type='multipart/form-data')
+    assert response.json['status'] == 'queued'
+
+
+def test_fetching_a_result_marks_it_used(client, db, tmp_path):
+    image_path = tmp_path / 'output' / 'j1.png'
+    image_path.parent.mkdir()
+    Image.new('RGB', (64, 64)).save(image_path)
+    user_id = db.get_user_by_username('user1')['id']
+    db.create_job('j1', 'image', 'prompt', user_id, image_path=str(image_path), status='completed', cache_key='k1')
+    result_cache.store('k1', 'image', str(image_path))
+    with db.transaction() as conn:
+        conn.execute("UPDATE result_cache SET last_hit_at = '2000-01-01 00:00:00' WHERE key = 'k1'")
+
+    assert client.get('/api/result/j1?size=256').status_code == 200
+    assert db.list_cached_results()[0]['last_hit_at'] > '2001'
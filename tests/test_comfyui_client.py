@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+from celery.contrib.testing.worker import start_worker
+
+import comfyui_client
+import config
+from celery_app import celery
+
+# Stands in for a ComfyUI script: copies input/{image} to output/{type}_{job_id}_00001_.png
+SCRIPT = """import os, shutil, sys
+image_name, job_id = sys.argv[1:]
+job_type = os.path.splitext(os.path.basename(__file__))[0]
+shutil.copyfile(os.path.join('input', image_name), os.path.join('output', f"{job_type}_{job_id}_00001_.png"))
+"""
+
+
+@pytest.fixture
+def comfyui_dir(tmp_path):
+    root = tmp_path / 'ComfyUI'
+    for name in ('input', 'output', '.venv/bin'):
+        (root / name).mkdir(parents=True)
+    os.symlink(sys.executable, root / '.venv/bin/python')
+    return root
+
+
+def test_check_setup_needs_a_workflow_or_script_per_type(comfyui_dir, tmp_path):
+    client = comfyui_client.ComfyUIClient(comfyui_dir=str(comfyui_dir), workflow_dir=str(tmp_path / 'workflows'))
+    with pytest.raises(comfyui_client.ComfyUIError, match='disney.json'):
+        client.check_setup()
+
+    (comfyui_dir / 'disney.py').write_text(SCRIPT)
+    (tmp_path / 'workflows').mkdir()
+    (tmp_path / 'workflows' / 'sketch.json').write_text('{}')
+    client.check_setup()
+
+
+def test_job_type_without_workflow_runs_its_script(comfyui_dir, tmp_path):
+    (comfyui_dir / 'disney.py').write_text(SCRIPT)
+    (comfyui_dir / 'input' / 'j1.png').write_bytes(b'image')
+    client = comfyui_client.ComfyUIClient(comfyui_dir=str(comfyui_dir), workflow_dir=str(tmp_path / 'workflows'))
+
+    image_path = client.run('disney', 'j1.png', 'disney_j1')
+    assert image_path == os.path.join(str(comfyui_dir), 'output', 'disney_j1_00001_.png')
+    with open(image_path, 'rb') as f:
+        assert f.read() == b'image'
+
+
+def test_comfyui_worker_without_workflows_does_not_start(db, comfyui_dir, tmp_path, monkeypatch):
+    client = comfyui_client.ComfyUIClient(comfyui_dir=str(comfyui_dir), workflow_dir=str(tmp_path / 'workflows'))
+    monkeypatch.setattr(comfyui_client, 'get_client', lambda comfyui_dir=None: client)
+    with pytest.raises(SystemExit, match="Can't run ComfyUI jobs"):
+        with start_worker(celery, pool='threads', queues=[config.QUEUE_COMFYUI], perform_ping_check=False):
+            pass
@@ -0,0 +1,49 @@
+import pytest
+
+import job_monitor
+
+
+def test_stalled_job_that_completed_meanwhile_is_left_alone(db, monkeypatch):
+    revoked = []
+    monkeypatch.setattr(job_monitor.celery.control, 'revoke', lambda task_id, **kwargs: revoked.append(task_id))
+    monkeypatch.setattr(job_monitor, 'send_job_task', lambda *args: pytest.fail('stalled job was requeued'))
+    db.create_job('j1', 'image', 'prompt', 'u1', task={'name': 'app.generate_image_task', 'args': [], 'kwargs': {}})
+    db.start_job('j1', 't1', 'worker1')
+    # The monitor found the job stalled, then its task completed before the handler ran
+    stalled = db.get_job('j1')
+    assert db.complete_job('j1', 'output/j1.png', task_id='t1')
+
+    assert job_monitor.handle_stalled_job(stalled, job_monitor.HEARTBEAT_LOST) is None
+    job = db.get_job('j1')
+    assert job['status'] == 'completed'
+    assert job['image_path'] == 'output/j1.png'
+    assert job['task_id'] == 't1'
+
+
+def test_transitions_of_an_attempt_need_the_job_processing(db):
+    db.create_job('j1', 'image', 'prompt', 'u1')
+    db.start_job('j1', 't1')
+    assert db.complete_job('j1', 'output/j1.png', task_id='t1')
+
+    assert not db.requeue_job('j1', 'Stalled', 't1')
+    assert not db.fail_job('j1', 'Stalled', 't1')
+    assert not db.complete_job('j1', 'output/other.png', task_id='t1')
+    assert db.get_job('j1')['status'] == 'completed'
+    assert db.get_job('j1')['image_path'] == 'output/j1.png'
+
+
+def test_job_answered_from_the_cache_does_not_follow_an_inflight_job(db):
+    assert db.create_job('leader', 'image', 'prompt', 'u1', cache_key='k', single_flight=True) is None
+    followed = db.create_jobs([
+        {'job_id': 'cached', 'job_type': 'image', 'prompt': 'prompt', 'user_id': 'u2', 'cache_key': 'k',
+         'status': 'completed', 'image_path': 'output/cached.png'},
+        {'job_id': 'follower', 'job_type': 'image', 'prompt': 'prompt', 'user_id': 'u2', 'cache_key': 'k'},
+    ], single_flight=True)
+
+    assert followed[0] is None
+    assert followed[1]['id'] == 'leader'
+    cached = db.get_job('cached')
+    assert cached['status'] == 'completed'
+    assert cached['image_path'] == 'output/cached.png'
+    assert cached['leader_id'] is None
+    assert cached['completed_at'] is not None
@@ -0,0 +1,48 @@
+import os
+import time
+
+import pytest
+
+import result_cache
+
+
+@pytest.fixture(autouse=True)
+def used(monkeypatch):
+    monkeypatch.setattr(result_cache, '_used', {})
+
+
+def backdate(db, key, path, days):
+    old = time.time() - days * 86400
+    os.utime(path, (old, old))
+    with db.transaction() as conn:
+        conn.execute("UPDATE result_cache SET last_hit_at = datetime('now', 'localtime', ?) WHERE key = ?", (f'-{days} days', key))
+
+
+def test_fetched_result_is_not_evicted_for_age(db, tmp_path):
+    fetched, unused = tmp_path / 'fetched.png', tmp_path / 'unused.png'
+    for path in (fetched, unused):
+        path.write_bytes(b'png')
+    result_cache.store('k1', 'image', str(fetched))
+    result_cache.store('k2', 'image', str(unused))
+    backdate(db, 'k1', fetched, 40)
+    backdate(db, 'k2', unused, 40)
+
+    result_cache.mark_used('k1', str(fetched))
+    assert result_cache.evict(max_age_days=30) == 1
+    assert fetched.exists()
+    assert not unused.exists()
+
+
+def test_fetched_untracked_output_is_not_swept(db, tmp_path):
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+    fetched, unused = output_dir / 'fetched.png', output_dir / 'unused.png'
+    for path in (fetched, unused):
+        path.write_bytes(b'png')
+        old = time.time() - 40 * 86400
+        os.utime(path, (old, old))
+
+    result_cache.mark_used(None, str(fetched))
+    assert result_cache.evict([str(output_dir)], max_age_days=30) == 1
+    assert fetched.exists()
+    assert not unused.exists()
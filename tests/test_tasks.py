@@ -0,0 +1,32 @@
+from celery.contrib.testing.worker import start_worker
+
+import config
+import generation_profiles
+import job_metrics
+import model_registry
+import tasks
+from celery_app import celery
+
+
+def record_worker_lifecycle(monkeypatch):
+    calls = []
+    monkeypatch.setattr(model_registry, 'preload', lambda: calls.append('model_registry.preload'))
+    monkeypatch.setattr(generation_profiles, 'preload', lambda: calls.append('generation_profiles.preload'))
+    monkeypatch.setattr(job_metrics, 'mark_process_dead', lambda pid: calls.append('mark_process_dead'))
+    monkeypatch.setattr(tasks, '_tasks_in_worker_process', False)
+    return calls
+
+
+def test_threads_pool_worker_preloads_models_and_cleans_up(db, monkeypatch):
+    calls = record_worker_lifecycle(monkeypatch)
+    with start_worker(celery, pool='threads', concurrency=2, queues=[config.QUEUE_IMAGE], perform_ping_check=False, shutdown_timeout=10) as worker:
+        assert calls == ['model_registry.preload', 'generation_profiles.preload']
+        # What a warm shutdown (SIGTERM) of the worker runs
+        worker.stop()
+    assert calls == ['model_registry.preload', 'generation_profiles.preload', 'mark_process_dead']
+
+
+def test_solo_pool_worker_preloads_models_once(db, monkeypatch):
+    calls = record_worker_lifecycle(monkeypatch)
+    with start_worker(celery, pool='solo', queues=[config.QUEUE_IMAGE], perform_ping_check=False, shutdown_timeout=10):
+        assert calls == ['model_registry.preload', 'generation_profiles.preload']
@@ -0,0 +1,27 @@
+import subprocess
+
+import pytest
+from celery.exceptions import SoftTimeLimitExceeded
+
+import triposr_client
+
+
+def test_sidecar_is_stopped_when_the_task_is_interrupted(tmp_path, monkeypatch):
+    client = triposr_client.TripoSRClient(str(tmp_path / 'triposr.sock'))
+    # Stands in for a sidecar busy with the job
+    client.process = subprocess.Popen(['sleep', '60'])
+    sidecar = client.process
+    monkeypatch.setattr(client, 'ensure_running', lambda: None)
+
+    def interrupted(payload, timeout):
+        raise SoftTimeLimitExceeded()
+    monkeypatch.setattr(client, '_request', interrupted)
+
+    try:
+        with pytest.raises(SoftTimeLimitExceeded):
+            client.run(str(tmp_path / 'input.png'), str(tmp_path / 'output'))
+        assert sidecar.poll() is not None
+        assert client.process is None
+    finally:
+        sidecar.kill()
+        sidecar.wait()
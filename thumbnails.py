@@ -0,0 +1,73 @@
+# thumbnails.py
+# Small WebP/JPEG copies of finished images for galleries, so a page of jobs loads
+# kilobytes instead of full size 1024x1024 PNGs. Thumbnails are written when a job
+# completes; a missing one (e.g. for jobs from before thumbnails existed) is made on
+# first request.
+#
+# Thumbnails live in THUMBNAIL_DIR, named after a hash of the source image path, so
+# jobs that share a cached result also share its thumbnails.
+import hashlib
+import os
+
+from PIL import Image
+
+import atomic_files
+
+THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', 'output/thumbs')
+# Longest side, in pixels, of each thumbnail size
+THUMBNAIL_SIZES = [int(size) for size in os.environ.get('THUMBNAIL_SIZES', '256,512').split(',') if size.strip()]
+# 'webp' or 'jpeg'
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'webp')
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '80'))
+
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def thumbnail_path(image_path, size):
+    digest = hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:20]
+    return os.path.join(THUMBNAIL_DIR, f"{digest}_{size}.{EXTENSIONS[THUMBNAIL_FORMAT]}")
+
+
+def mimetype():
+    return MIMETYPES[THUMBNAIL_FORMAT]
+
+
+def _write(image, size, path):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    if THUMBNAIL_FORMAT == 'jpeg' and thumbnail.mode != 'RGB':
+        thumbnail = thumbnail.convert('RGB')
+
+    with atomic_files.atomic_path(path) as tmp_path:
+        thumbnail.save(tmp_path, format=THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY)
+
+
+def generate(image_path, image=None):
+    """Write every thumbnail size of image_path; never raises
+
+    image is the already decoded image, if at hand.
+    """
+    # A missing thumbnail is made on request, so failing here must not fail the job
+    try:
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        if image is None:
+            with Image.open(image_path) as image:
+                for size in THUMBNAIL_SIZES:
+                    _write(image, size, thumbnail_path(image_path, size))
+        else:
+            for size in THUMBNAIL_SIZES:
+                _write(image, size, thumbnail_path(image_path, size))
+    except Exception as e:
+        print(f"Failed to make thumbnails of {image_path}: {str(e)}")
+
+
+def get_thumbnail(image_path, size):
+    """Path of the size thumbnail of image_path, making it if it doesn't exist yet"""
+    path = thumbnail_path(image_path, size)
+    if not os.path.exists(path):
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        with Image.open(image_path) as image:
+            _write(image, size, path)
+    return path
+
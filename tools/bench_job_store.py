@@ -0,0 +1,136 @@
+# Benchmark for the job store: status-poll and insert throughput with several
+# writer and poller processes hitting the same SQLite file, comparing the old
+# connect-per-query pattern with job_store's pooled WAL connections.
+#
+# Usage (from the repository root):
+#   python -m tools.bench_job_store --writers 4 --pollers 4 --seconds 5
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+# Status changes are published to the status streams' Redis channel by default; keep
+# them in process so the benchmark needs no Redis and measures only the database
+os.environ['JOB_EVENTS_URL'] = 'memory://'
+
+import job_store
+
+
+def naive_insert(db_path, job_id):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO jobs (id, prompt, status, created_at, user_id) VALUES (?, ?, ?, ?, ?)",
+        (job_id, "bench prompt", "queued", datetime.now().isoformat(' '), "bench-user")
+    )
+    conn.commit()
+    conn.close()
+
+
+def naive_update(db_path, job_id, status):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+    conn.commit()
+    conn.close()
+
+
+def naive_poll(db_path, job_id):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT type, status, created_at, completed_at, user_id FROM jobs WHERE id = ?", (job_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+
+def writer(mode, db_path, seconds, job_ids, counts):
+    job_store.DB_PATH = db_path
+    inserts = errors = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        job_id = str(uuid.uuid4())
+        try:
+            # One job lifecycle: submitted by the API, picked up and finished by a worker
+            if mode == 'naive':
+                naive_insert(db_path, job_id)
+                naive_update(db_path, job_id, "processing")
+                naive_update(db_path, job_id, "completed")
+            else:
+                job_store.create_job(job_id, "image", "bench prompt", "bench-user")
+                job_store.start_job(job_id)
+                job_store.complete_job(job_id, f"output/{job_id}.png")
+            inserts += 1
+            if len(job_ids) < 1000:
+                job_ids.append(job_id)
+        except sqlite3.OperationalError:
+            errors += 1
+    counts.put(('insert', inserts, errors))
+
+
+def poller(mode, db_path, seconds, job_ids, counts):
+    job_store.DB_PATH = db_path
+    polls = errors = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        job_id = random.choice(job_ids) if len(job_ids) else "missing"
+        try:
+            if mode == 'naive':
+                naive_poll(db_path, job_id)
+            else:
+                job_store.get_job(job_id)
+            polls += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    counts.put(('poll', polls, errors))
+
+
+def run(mode, writers, pollers, seconds):
+    db_dir = tempfile.mkdtemp(prefix='bench_job_store_')
+    db_path = os.path.join(db_dir, 'image_jobs.db')
+    job_store.DB_PATH = db_path
+    job_store.init_db()
+    if mode == 'naive':
+        # The old code never enabled WAL, so run it on a rollback journal
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+    with multiprocessing.Manager() as manager:
+        job_ids = manager.list()
+        counts = manager.Queue()
+        processes = [multiprocessing.Process(target=writer, args=(mode, db_path, seconds, job_ids, counts))
+                     for _ in range(writers)]
+        processes += [multiprocessing.Process(target=poller, args=(mode, db_path, seconds, job_ids, counts))
+                      for _ in range(pollers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        totals = {'insert': [0, 0], 'poll': [0, 0]}
+        while not counts.empty():
+            kind, ops, errors = counts.get()
+            totals[kind][0] += ops
+            totals[kind][1] += errors
+
+    print(f"{mode:>7}: {totals['insert'][0] / seconds:9.1f} job inserts/s "
+          f"({totals['insert'][1]} locked), "
+          f"{totals['poll'][0] / seconds:9.1f} status polls/s ({totals['poll'][1]} locked)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Job store throughput benchmark')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--pollers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writer and {args.pollers} poller processes for {args.seconds}s")
+    for mode in ('naive', 'pooled'):
+        run(mode, args.writers, args.pollers, args.seconds)
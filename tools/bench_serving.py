@@ -0,0 +1,202 @@
+# Benchmark of request throughput of the serving modes: Werkzeug's development server
+# (`python app.py`) against gunicorn with gunicorn.conf.py. Each server is started in turn
+# on a scratch job database seeded with completed jobs, and client processes hammer
+# the read endpoints the web client polls (job status, job listing, result thumbnails).
+# No jobs are submitted, so neither Redis nor a Celery worker is needed.
+#
+# Usage (from the repository root):
+#   python -m tools.bench_serving --users 32 --seconds 15
+#   python -m tools.bench_serving --servers gunicorn --workers 4 --threads 8 --json serving.json
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+from tools.loadtest import Client, Stats, percentile, print_report
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_env(work_dir):
+    env = dict(os.environ,
+               JOB_DB_PATH=os.path.join(work_dir, 'image_jobs.db'),
+               CELERY_BROKER_URL='memory://',
+               CELERY_RESULT_BACKEND='cache+memory://',
+               JOB_EVENTS_URL='memory://',
+               RATE_LIMIT_URL='memory://',
+               RATE_LIMIT_ENABLED='0',
+               PYTHONPATH=REPO_DIR)
+    env.pop('TRACE_FILE', None)
+    return env
+
+
+def seed(work_dir, jobs):
+    """Create the bench user and completed image jobs with outputs and thumbnails; returns the job ids"""
+    os.environ.update(server_env(work_dir))
+    sys.path.insert(0, REPO_DIR)
+    from PIL import Image
+    from werkzeug.security import generate_password_hash
+    import job_store
+    import thumbnails
+
+    job_store.init_db()
+    user_id = str(uuid.uuid4())
+    job_store.create_user(user_id, USERNAME, generate_password_hash(PASSWORD))
+    os.makedirs(os.path.join(work_dir, 'output'), exist_ok=True)
+    job_ids = []
+    for index in range(jobs):
+        job_id = str(uuid.uuid4())
+        # Outputs are relative to the server's working directory, work_dir
+        image_path = f"output/{job_id}.png"
+        image = Image.new('RGB', (1024, 1024), (index % 256, 128, 64))
+        image.save(os.path.join(work_dir, image_path))
+        thumbnails.generate(os.path.join(work_dir, image_path), image)
+        job_store.create_job(job_id, 'image', f"bench prompt {index}", user_id)
+        job_store.start_job(job_id)
+        job_store.complete_job(job_id, image_path)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def start_server(kind, args, work_dir, port):
+    if kind == 'dev':
+        # What `python app.py` runs, without its metrics side server
+        command = [sys.executable, '-c', f"from app import app; app.run(debug=False, port={port})"]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), '--threads', str(args.threads),
+                   'app:app']
+    env = server_env(work_dir)
+    env.update(METRICS_PORT='0', PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(dir=work_dir))
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/api/status', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError(f"{kind} server exited with {process.returncode}")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server didn't start")
+
+
+def user_loop(client, job_ids, deadline, rng):
+    while time.time() < deadline:
+        job_id = rng.choice(job_ids)
+        choice = rng.random()
+        if choice < 0.6:
+            client.call('GET /api/status/<id>', 'GET', f'/api/status/{job_id}')
+        elif choice < 0.8:
+            client.call('GET /api/jobs', 'GET', '/api/jobs', params={'limit': 20})
+        else:
+            client.call('GET /api/result/<id>?size=256', 'GET', f'/api/result/{job_id}', params={'size': 256})
+
+
+def client_process(base_url, job_ids, users, seconds, seed_value):
+    """Run users threads against base_url; returns the raw samples and errors"""
+    stats = Stats()
+    clients = [Client(base_url, stats) for _ in range(users)]
+    response = clients[0].call('POST /api/login', 'POST', '/api/login', json={'username': USERNAME, 'password': PASSWORD})
+    token = response.json()['access_token']
+    for client in clients:
+        client.session.headers['Authorization'] = f"Bearer {token}"
+    stats.samples.clear()
+
+    deadline = time.time() + seconds
+    threads = [threading.Thread(target=user_loop, args=(client, job_ids, deadline, random.Random(seed_value * 1000 + index)))
+               for index, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.samples, stats.errors
+
+
+def run(kind, args, work_dir, job_ids):
+    process, base_url = start_server(kind, args, work_dir, free_port())
+    try:
+        # Client threads in one process would be limited by its GIL before the server is
+        users = [args.users // args.client_processes + (i < args.users % args.client_processes)
+                 for i in range(args.client_processes)]
+        with multiprocessing.Pool(args.client_processes) as pool:
+            start = time.time()
+            results = pool.starmap(client_process, [(base_url, job_ids, n, args.seconds, i)
+                                                    for i, n in enumerate(users) if n])
+            elapsed = time.time() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    stats = Stats()
+    for samples, errors in results:
+        for name, values in samples.items():
+            stats.samples.setdefault(name, []).extend(values)
+        for name, count in errors.items():
+            stats.errors[name] = stats.errors.get(name, 0) + count
+    rows = stats.summary(elapsed)
+    everything = sorted(value for values in stats.samples.values() for value in values)
+    rows['all'] = {
+        'count': len(everything),
+        'errors': sum(stats.errors.values()),
+        'per_second': len(everything) / elapsed,
+        'p50_ms': percentile(everything, 0.50) * 1000,
+        'p95_ms': percentile(everything, 0.95) * 1000,
+        'p99_ms': percentile(everything, 0.99) * 1000,
+    }
+    return rows, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Request throughput of the development server and gunicorn')
+    parser.add_argument('--servers', default='dev,gunicorn', help='Comma separated serving modes to compare')
+    parser.add_argument('--users', type=int, default=32, help='Concurrent client connections')
+    parser.add_argument('--client-processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--jobs', type=int, default=200, help='Completed jobs seeded into the database')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--json', help='Also write the results to this file, for comparing runs')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_serving_')
+    try:
+        job_ids = seed(work_dir, args.jobs)
+        results = {}
+        for kind in args.servers.split(','):
+            print(f"\n{kind}: {args.users} connections for {args.seconds}s")
+            rows, elapsed = run(kind, args, work_dir, job_ids)
+            print_report(rows, elapsed)
+            results[kind] = rows
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{'server':<10} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6}")
+    for kind, rows in results.items():
+        row = rows['all']
+        print(f"{kind:<10} {row['per_second']:>8.1f} {row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['errors']:>6}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'servers': results}, f, indent=2)
@@ -0,0 +1,69 @@
+# Benchmark of cold start per process type: how long a fresh interpreter takes to import
+# what the API server, a Celery worker and the job monitor load before they can serve,
+# and how many modules that pulls in. Autoscaled workers pay this on every start.
+#
+# Each import runs in a new process against an existing scratch job database (creating
+# it, with the admin user's password hash, is a one-off cost). Models are loaded later,
+# when a worker process starts (model_registry.preload), and are not included.
+#
+# Usage (from the repository root):
+#   python -m tools.bench_startup --runs 9
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROCESSES = {
+    'interpreter': 'pass',
+    'api': 'import app',
+    # celery_worker.py, plus the task modules the worker includes when it starts
+    'worker': 'import celery_worker, tasks',
+    'monitor': 'import job_monitor',
+}
+
+
+def measure(statement, env, work_dir):
+    """Wall time of a fresh interpreter running statement, and the modules it loaded"""
+    code = f"{statement}\nimport sys\nprint(len(sys.modules))"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=work_dir, env=env, check=True,
+                            capture_output=True, text=True)
+    return time.perf_counter() - start, int(result.stdout.split()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold start time of the API server, workers and job monitor')
+    parser.add_argument('--runs', type=int, default=7, help='Fresh processes per process type')
+    parser.add_argument('--json', help='Also write the results to this file, for comparing runs')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    env = dict(os.environ, JOB_DB_PATH=os.path.join(work_dir, 'image_jobs.db'), PYTHONPATH=REPO_DIR,
+               CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://')
+    try:
+        measure('import job_store; job_store.init_db()', env, work_dir)
+        results = {}
+        for name, statement in PROCESSES.items():
+            samples = [measure(statement, env, work_dir) for _ in range(args.runs)]
+            times = sorted(seconds for seconds, _ in samples)
+            results[name] = {
+                'median_ms': statistics.median(times) * 1000,
+                'min_ms': times[0] * 1000,
+                'modules': samples[-1][1],
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'process':<12} {'median ms':>10} {'min ms':>8} {'modules':>8}")
+    for name, row in results.items():
+        print(f"{name:<12} {row['median_ms']:>10.0f} {row['min_ms']:>8.0f} {row['modules']:>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'processes': results}, f, indent=2)
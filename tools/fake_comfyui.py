@@ -0,0 +1,91 @@
+# Minimal stand-in for a ComfyUI server, for exercising comfyui_client.py without a GPU.
+# It implements POST /prompt and GET /history/<prompt_id>; after --latency seconds each
+# prompt "renders" by copying the LoadImage input to {root}/output/{prefix}_00001_.png.
+# There is no /ws endpoint, so clients fall back to polling /history.
+#
+# Usage (from the repository root):
+#   python -m tools.fake_comfyui --port 8188 --root ../ComfyUI --latency 2
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+history = {}
+history_lock = threading.Lock()
+
+
+def render(prompt_id, workflow, root, latency):
+    time.sleep(latency)
+    image_name = prefix = None
+    for node in workflow.values():
+        if node.get('class_type') == 'LoadImage':
+            image_name = node['inputs']['image']
+        elif node.get('class_type') == 'SaveImage':
+            prefix = node['inputs']['filename_prefix']
+
+    filename = f"{prefix or 'ComfyUI'}_00001_.png"
+    os.makedirs(os.path.join(root, 'output'), exist_ok=True)
+    input_path = os.path.join(root, 'input', image_name or '')
+    if image_name and os.path.exists(input_path):
+        shutil.copyfile(input_path, os.path.join(root, 'output', filename))
+        entry = {
+            'outputs': {'9': {'images': [{'filename': filename, 'subfolder': '', 'type': 'output'}]}},
+            'status': {'status_str': 'success', 'completed': True, 'messages': []}
+        }
+    else:
+        entry = {'outputs': {}, 'status': {'status_str': 'error', 'completed': False, 'messages': []}}
+
+    with history_lock:
+        history[prompt_id] = entry
+
+
+class Handler(BaseHTTPRequestHandler):
+    root = '../ComfyUI'
+    latency = 1.0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/prompt':
+            return self._send_json(404, {'error': 'not found'})
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        workflow = payload.get('prompt')
+        if not isinstance(workflow, dict):
+            return self._send_json(400, {'error': 'prompt must be a workflow object'})
+        prompt_id = str(uuid.uuid4())
+        threading.Thread(target=render, args=(prompt_id, workflow, self.root, self.latency), daemon=True).start()
+        self._send_json(200, {'prompt_id': prompt_id, 'number': 0, 'node_errors': {}})
+
+    def do_GET(self):
+        if not self.path.startswith('/history/'):
+            return self._send_json(404, {'error': 'not found'})
+        prompt_id = self.path[len('/history/'):]
+        with history_lock:
+            entry = history.get(prompt_id)
+        self._send_json(200, {prompt_id: entry} if entry else {})
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake ComfyUI server')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--root', default='../ComfyUI', help='Directory holding input/ and output/')
+    parser.add_argument('--latency', type=float, default=1.0, help='Seconds each prompt takes')
+    args = parser.parse_args()
+
+    Handler.root = args.root
+    Handler.latency = args.latency
+    print(f"Fake ComfyUI listening on http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(('127.0.0.1', args.port), Handler).serve_forever()
@@ -0,0 +1,331 @@
+# End-to-end load test of the API without GPUs or model servers. The app is served over
+# HTTP from this process, with an in-memory Celery broker, a threads-pool Celery worker
+# and a scratch job database. The SDXL pipeline, the TripoSR server and ComfyUI are
+# replaced by stubs that sleep for a configurable latency and write small outputs, so
+# what is measured is the Flask, SQLite, Celery and result delivery layers.
+#
+# Virtual users log in, then repeatedly submit a job (prompt, ComfyUI transformation or
+# 3D upload), poll its status until it finishes and download the result, like the web
+# client does. Throughput and p50/p95/p99 latency are reported per endpoint, plus the
+# end-to-end time of the jobs.
+#
+# Usage (from the repository root):
+#   python -m tools.loadtest --users 20 --seconds 30 --image-latency 0.5
+#   python -m tools.loadtest --users 20 --seconds 30 --json loadtest.json
+#   python -m tools.loadtest --url http://127.0.0.1:5001 --users 5   (a running server, real backends)
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import requests
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A tetrahedron, as the stub TripoSR's reconstruction
+STUB_MESH = """v 0 0 0
+v 1 0 0
+v 0 1 0
+v 0 0 1
+f 1 3 2
+f 1 2 4
+f 1 4 3
+f 2 3 4
+"""
+
+
+# Stub backends
+
+class StubPipeline:
+    """Stands in for a diffusers text-to-image pipeline: sleeps, then returns flat images"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, prompt, width=None, height=None, **options):
+        time.sleep(self.latency)
+        size = (width or 1024, height or 1024)
+        return SimpleNamespace(images=[Image.new('RGB', size, (random.randrange(256), 80, 160)) for _ in prompt])
+
+
+class StubTripoSR:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def ensure_running(self):
+        pass
+
+    def run(self, image_path, output_dir, timeout=None):
+        time.sleep(self.latency)
+        image_dir = os.path.join(output_dir, '0')
+        os.makedirs(image_dir, exist_ok=True)
+        shutil.copyfile(image_path, os.path.join(image_dir, 'input.png'))
+        mesh_path = os.path.join(image_dir, 'mesh.obj')
+        with open(mesh_path, 'w') as f:
+            f.write(STUB_MESH)
+        return mesh_path
+
+
+class StubComfyUI:
+    def __init__(self, root, latency):
+        self.root = root
+        self.latency = latency
+
+    def check_setup(self):
+        pass
+
+    def run(self, job_type, image_name, output_prefix, timeout=None):
+        time.sleep(self.latency)
+        output_path = os.path.join(self.root, 'output', f"{output_prefix}_00001_.png")
+        shutil.copyfile(os.path.join(self.root, 'input', image_name), output_path)
+        return output_path
+
+
+def start_stub_server(args, work_dir):
+    """Import the app configured for the load test, swap in the stubs and serve it
+
+    Returns the base URL and the running worker's context manager, which must be kept
+    referenced: garbage collecting it stops the worker.
+    """
+    os.environ.update({
+        'JOB_DB_PATH': os.path.join(work_dir, 'image_jobs.db'),
+        'CELERY_BROKER_URL': 'memory://',
+        'CELERY_RESULT_BACKEND': 'cache+memory://',
+        'JOB_EVENTS_URL': 'memory://',
+        'RATE_LIMIT_URL': 'memory://',
+        # Step previews need real latents
+        'PREVIEW_EVERY_STEPS': '0',
+    })
+    if not args.limits:
+        os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+        os.environ.setdefault('ADMISSION_MAX_QUEUE_WAIT', '0')
+    # Outputs land in output/ relative to the working directory
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+
+    import app as app_module
+    import comfyui_client
+    import config
+    import generation_profiles
+    import tasks
+    import triposr_client
+    from celery.contrib.testing.worker import start_worker
+    from werkzeug.serving import make_server
+
+    config.OUTPUT_DIR_3D = os.path.join(work_dir, 'TripoSR', 'uploads')
+    config.COMFY_UI_DIR = os.path.join(work_dir, 'ComfyUI')
+    for path in (config.OUTPUT_DIR_3D, os.path.join(config.COMFY_UI_DIR, 'input'),
+                 os.path.join(config.COMFY_UI_DIR, 'output')):
+        os.makedirs(path, exist_ok=True)
+
+    pipeline = StubPipeline(args.image_latency)
+    generation_profiles.pipeline_for = lambda params: pipeline
+    tripo = StubTripoSR(args.mesh_latency)
+    triposr_client.get_client = lambda: tripo
+    comfy = StubComfyUI(config.COMFY_UI_DIR, args.comfy_latency)
+    comfyui_client.get_client = lambda comfyui_dir=None: comfy
+
+    queues = [config.QUEUE_IMAGE, config.QUEUE_3D_MODEL, config.QUEUE_COMFYUI, config.QUEUE_POSTPROCESS]
+    worker = start_worker(tasks.celery, concurrency=args.worker_concurrency, pool='threads',
+                          perform_ping_check=False, queues=queues, loglevel='WARNING')
+    worker.__enter__()
+
+    # Per-request access logs would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", worker
+
+
+# Measurements
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+
+class Stats:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            rows[name] = {
+                'count': len(values),
+                'errors': self.errors.get(name, 0),
+                'per_second': len(values) / elapsed,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+            }
+        return rows
+
+
+class Client:
+    """One virtual user's HTTP session; every call is timed under its endpoint name"""
+
+    def __init__(self, base_url, stats):
+        self.base_url = base_url
+        self.stats = stats
+        self.session = requests.Session()
+
+    def call(self, name, method, path, expected=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=60, **kwargs)
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - start, False)
+            return None
+        self.stats.record(name, time.perf_counter() - start, response.status_code in expected)
+        return response
+
+    def login(self, username, password):
+        self.call('POST /api/register', 'POST', '/api/register', expected=(201, 409),
+                  json={'username': username, 'password': password})
+        response = self.call('POST /api/login', 'POST', '/api/login', json={'username': username, 'password': password})
+        self.session.headers['Authorization'] = f"Bearer {response.json()['access_token']}"
+
+
+def random_png(rng, size=256):
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256))).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def submit(client, kind, rng, repeat):
+    """Submit one job of the given kind; returns its id or None"""
+    # A share of repeated inputs exercises the result cache and single-flight. Prompts
+    # differ by text rather than seed: seeded generation needs torch for its generators
+    variant = 0 if rng.random() < repeat else rng.randrange(2 ** 32)
+    if kind == 'image':
+        response = client.call('POST /api/generate', 'POST', '/api/generate',
+                               json={'prompt': f"load test {variant}", 'profile': 'fast'})
+    else:
+        image = random_png(random.Random(variant))
+        response = client.call(f'POST /api/upload ({kind})', 'POST', '/api/upload', data={'job_type': kind},
+                               files={'file': ('input.png', image, 'image/png')})
+    return response.json()['job_id'] if response is not None and response.status_code == 200 else None
+
+
+def user_loop(client, args, deadline, stats, rng, mix):
+    kinds, weights = zip(*mix.items())
+    while time.time() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        submitted_at = time.perf_counter()
+        job_id = submit(client, kind, rng, args.repeat)
+        if job_id is None:
+            time.sleep(args.poll_interval)
+            continue
+
+        status = None
+        while time.time() < deadline + args.drain:
+            response = client.call('GET /api/status/<id>', 'GET', f'/api/status/{job_id}')
+            status = response.json().get('status') if response is not None and response.status_code == 200 else None
+            if status in ('completed', 'failed'):
+                break
+            time.sleep(args.poll_interval)
+        if status != 'completed':
+            stats.record(f'job {kind}', time.perf_counter() - submitted_at, False)
+            continue
+        stats.record(f'job {kind}', time.perf_counter() - submitted_at, True)
+
+        params = {'format': 'glb'} if kind == '3d_model' else {}
+        response = client.call('GET /api/result/<id>', 'GET', f'/api/result/{job_id}', params=params)
+        if kind != '3d_model' and response is not None and response.status_code == 200:
+            client.call('GET /api/result/<id>?size=256', 'GET', f'/api/result/{job_id}', params={'size': 256})
+        client.call('GET /api/jobs', 'GET', '/api/jobs', params={'limit': 20})
+
+
+def print_report(rows, elapsed):
+    print(f"\n{'endpoint':<34} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in rows.items():
+        print(f"{name:<34} {row['count']:>7} {row['errors']:>6} {row['per_second']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    print(f"({elapsed:.1f}s)")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end API load test with stub model backends')
+    parser.add_argument('--url', help='Load test a running server instead of an in-process one with stubs')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+    parser.add_argument('--seconds', type=float, default=20, help='How long users keep submitting jobs')
+    parser.add_argument('--drain', type=float, default=30, help='Seconds to wait for jobs still running at the end')
+    parser.add_argument('--mix', default='image=6,sketch=2,3d_model=2', help='Relative weights of the job types users submit')
+    parser.add_argument('--repeat', type=float, default=0.1, help='Share of submissions that repeat an earlier input')
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--image-latency', type=float, default=0.5, help='Seconds per stub SDXL pipeline call')
+    parser.add_argument('--mesh-latency', type=float, default=2.0, help='Seconds per stub TripoSR reconstruction')
+    parser.add_argument('--comfy-latency', type=float, default=1.0, help='Seconds per stub ComfyUI workflow')
+    parser.add_argument('--worker-concurrency', type=int, default=4, help='Threads of the in-process Celery worker')
+    parser.add_argument('--limits', action='store_true', help='Keep rate limits and admission control on')
+    parser.add_argument('--json', help='Also write the results to this file, for comparing runs')
+    args = parser.parse_args()
+    # The in-process server changes the working directory
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    work_dir = worker = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        work_dir = tempfile.mkdtemp(prefix='loadtest_')
+        base_url, worker = start_stub_server(args, work_dir)
+    print(f"Load testing {base_url} with {args.users} users for {args.seconds}s")
+
+    stats = Stats()
+    mix = parse_mix(args.mix)
+    run_id = uuid.uuid4().hex[:8]
+    clients = [Client(base_url, stats) for _ in range(args.users)]
+    for index, client in enumerate(clients):
+        client.login(f"loadtest-{run_id}-{index}", 'loadtest-password')
+
+    start = time.time()
+    deadline = start + args.seconds
+    threads = [threading.Thread(target=user_loop, args=(client, args, deadline, stats, random.Random(index), mix))
+               for index, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    rows = stats.summary(elapsed)
+    print_report(rows, elapsed)
+    print("'job <type>' rows are submit-to-completed times as seen by polling clients")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'args': vars(args), 'elapsed': elapsed, 'endpoints': rows}, f, indent=2)
+    if work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    # Don't wait for the in-process worker and server threads
+    sys.stdout.flush()
+    os._exit(0)
@@ -0,0 +1,134 @@
+# triposr_client.py
+# Starts, health-checks and talks to the TripoSR sidecar (triposr_server.py), so each
+# 3D job only sends a request over a Unix socket instead of launching TripoSR's
+# run.py and reloading the model.
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import job_tracing
+
+TRIPOSR_DIR = os.environ.get('TRIPOSR_DIR', '../TripoSR')
+TRIPOSR_PYTHON = os.environ.get('TRIPOSR_PYTHON', f'{TRIPOSR_DIR}/.venv/bin/python')
+# One sidecar per worker process by default; {pid} is replaced with the worker's pid
+TRIPOSR_SOCKET = os.environ.get('TRIPOSR_SOCKET', '/tmp/triposr-{pid}.sock')
+# Seconds to wait for the sidecar to load the model and start listening
+TRIPOSR_STARTUP_TIMEOUT = float(os.environ.get('TRIPOSR_STARTUP_TIMEOUT', '300'))
+# Seconds one reconstruction may take before the sidecar is killed and restarted
+TRIPOSR_JOB_TIMEOUT = float(os.environ.get('TRIPOSR_JOB_TIMEOUT', '540'))
+TRIPOSR_DEVICE = os.environ.get('TRIPOSR_DEVICE', 'cuda:0')
+TRIPOSR_MODEL_ID = os.environ.get('TRIPOSR_MODEL_ID', 'stabilityai/TripoSR')
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'triposr_server.py')
+
+
+class TripoSRError(Exception):
+    pass
+
+
+class TripoSRClient:
+    def __init__(self, socket_path=None):
+        self.owner_pid = os.getpid()
+        self.socket_path = (socket_path or TRIPOSR_SOCKET).format(pid=self.owner_pid)
+        self.process = None
+        self._lock = threading.Lock()
+
+    def _request(self, payload, timeout):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(self.socket_path)
+            conn.sendall(json.dumps(payload).encode() + b"\n")
+            with conn.makefile('rb') as stream:
+                line = stream.readline()
+        if not line:
+            raise TripoSRError("TripoSR server closed the connection")
+        return json.loads(line)
+
+    def ping(self, timeout=2):
+        try:
+            return self._request({"cmd": "ping"}, timeout).get("status") == "ok"
+        except (OSError, ValueError, TripoSRError):
+            return False
+
+    def start(self):
+        """Start a new sidecar and wait until it has loaded the model"""
+        self.stop()
+        print(f"Starting TripoSR server on {self.socket_path}")
+        self.process = subprocess.Popen(
+            [TRIPOSR_PYTHON, SERVER_SCRIPT,
+             "--socket", self.socket_path,
+             "--device", TRIPOSR_DEVICE,
+             "--pretrained-model-name-or-path", TRIPOSR_MODEL_ID,
+             "--parent-pid", str(os.getpid())],
+            cwd=TRIPOSR_DIR
+        )
+
+        deadline = time.time() + TRIPOSR_STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise TripoSRError(f"TripoSR server exited during start-up with code {self.process.returncode}")
+            if self.ping():
+                return
+            time.sleep(0.5)
+
+        self.stop()
+        raise TripoSRError(f"TripoSR server did not start within {TRIPOSR_STARTUP_TIMEOUT}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def ensure_running(self):
+        """Health check; (re)start the sidecar if it crashed or stopped answering"""
+        # A sidecar we didn't start (shared TRIPOSR_SOCKET) is used as long as it answers
+        if (self.process is None or self.process.poll() is None) and self.ping():
+            return
+        if self.process is not None:
+            print("TripoSR server is not healthy, restarting it")
+        with job_tracing.span('subprocess_startup'):
+            self.start()
+
+    def run(self, image_path, output_dir, timeout=TRIPOSR_JOB_TIMEOUT):
+        """Reconstruct image_path into output_dir and return the mesh path"""
+        with self._lock:
+            self.ensure_running()
+            try:
+                with job_tracing.span('inference'):
+                    response = self._request({
+                        "cmd": "run",
+                        "image_path": os.path.abspath(image_path),
+                        "output_dir": os.path.abspath(output_dir)
+                    }, timeout)
+            except socket.timeout:
+                # The sidecar is stuck on this job; kill it so the next job gets a fresh one
+                self.stop()
+                raise TripoSRError(f"TripoSR job timed out after {timeout}s")
+            except (OSError, TripoSRError) as e:
+                # Crashed mid-job (e.g. out of memory); it is restarted on the next job
+                self.stop()
+                raise TripoSRError(f"TripoSR server failed: {str(e)}")
+            except BaseException:
+                # Interrupted while waiting (e.g. the task's soft time limit): the sidecar would
+                # go on with the abandoned job and hold up the next one, so it is restarted too
+                self.stop()
+                raise
+
+        if response.get("status") != "ok":
+            raise TripoSRError(response.get("error", "Unknown TripoSR error"))
+        return response["mesh_path"]
+
+
+_client = None
+
+
+def get_client():
+    """The sidecar client of this worker process (a forked child gets its own)"""
+    global _client
+    if _client is None or _client.owner_pid != os.getpid():
+        _client = TripoSRClient()
+    return _client
@@ -0,0 +1,135 @@
+# triposr_server.py
+# Long-lived TripoSR sidecar. It runs inside TripoSR's own environment, loads the model
+# once and then serves reconstruction jobs over a Unix socket, one at a time.
+# It is started and supervised by triposr_client.py, e.g.
+#   cd ../TripoSR && .venv/bin/python ../AI-Studio-Backend/triposr_server.py --socket /tmp/triposr.sock
+#
+# Protocol: one JSON object per line in each direction.
+#   {"cmd": "ping"}                                        -> {"status": "ok"}
+#   {"cmd": "run", "image_path": ..., "output_dir": ...}   -> {"status": "ok", "mesh_path": ...}
+#                                                          or {"status": "error", "error": ...}
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+def parse_args():
+    # Defaults follow TripoSR's run.py
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", required=True, help="Unix socket path to listen on")
+    parser.add_argument("--device", default="cuda:0")
+    parser.add_argument("--pretrained-model-name-or-path", default="stabilityai/TripoSR")
+    parser.add_argument("--chunk-size", default=8192, type=int)
+    parser.add_argument("--mc-resolution", default=256, type=int)
+    parser.add_argument("--foreground-ratio", default=0.85, type=float)
+    parser.add_argument("--no-remove-bg", action="store_true")
+    parser.add_argument("--model-save-format", default="obj", choices=["obj", "glb"])
+    parser.add_argument("--parent-pid", type=int, default=None, help="Exit when this process goes away")
+    return parser.parse_args()
+
+
+class Reconstructor:
+    def __init__(self, args):
+        import torch
+        import rembg
+        from tsr.system import TSR
+
+        self.args = args
+        self.device = args.device
+        if not torch.cuda.is_available():
+            self.device = "cpu"
+
+        start_time = time.time()
+        self.model = TSR.from_pretrained(
+            args.pretrained_model_name_or_path,
+            config_name="config.yaml",
+            weight_name="model.ckpt",
+        )
+        self.model.renderer.set_chunk_size(args.chunk_size)
+        self.model.to(self.device)
+        self.rembg_session = None if args.no_remove_bg else rembg.new_session()
+        print(f"TripoSR loaded on {self.device} in {time.time() - start_time:.1f}s", flush=True)
+
+    def run(self, image_path, output_dir):
+        import numpy as np
+        import torch
+        from PIL import Image
+        from tsr.utils import remove_background, resize_foreground
+
+        image_dir = os.path.join(output_dir, "0")
+        os.makedirs(image_dir, exist_ok=True)
+
+        if self.rembg_session is None:
+            image = Image.open(image_path).convert("RGB")
+        else:
+            image = remove_background(Image.open(image_path), self.rembg_session)
+            image = resize_foreground(image, self.args.foreground_ratio)
+            image = np.array(image).astype(np.float32) / 255.0
+            image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+            image = Image.fromarray((image * 255.0).astype(np.uint8))
+        image.save(os.path.join(image_dir, "input.png"))
+
+        with torch.no_grad():
+            scene_codes = self.model([image], device=self.device)
+        meshes = self.model.extract_mesh(scene_codes, True, resolution=self.args.mc_resolution)
+
+        mesh_path = os.path.join(image_dir, f"mesh.{self.args.model_save_format}")
+        meshes[0].export(mesh_path)
+        return mesh_path
+
+
+def handle(reconstructor, request):
+    if request.get("cmd") == "ping":
+        return {"status": "ok"}
+    if request.get("cmd") == "run":
+        start_time = time.time()
+        mesh_path = reconstructor.run(request["image_path"], request["output_dir"])
+        return {"status": "ok", "mesh_path": mesh_path, "seconds": time.time() - start_time}
+    return {"status": "error", "error": f"Unknown command: {request.get('cmd')}"}
+
+
+def watch_parent(parent_pid):
+    # Don't outlive the worker that owns us
+    while True:
+        try:
+            os.kill(parent_pid, 0)
+        except OSError:
+            os._exit(0)
+        time.sleep(2)
+
+
+def main():
+    args = parse_args()
+    if args.parent_pid:
+        threading.Thread(target=watch_parent, args=(args.parent_pid,), daemon=True).start()
+
+    # Only start listening once the model is loaded, so a successful ping means ready
+    reconstructor = Reconstructor(args)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(args.socket)
+    server.listen(8)
+    print(f"TripoSR server listening on {args.socket}", flush=True)
+
+    while True:
+        conn, _ = server.accept()
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                try:
+                    response = handle(reconstructor, json.loads(line))
+                except Exception as e:
+                    traceback.print_exc()
+                    response = {"status": "error", "error": str(e)}
+                stream.write(json.dumps(response).encode() + b"\n")
+                stream.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
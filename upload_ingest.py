@@ -0,0 +1,118 @@
+# upload_ingest.py
+# Turns an uploaded image into a job input in one streaming pass. The file is copied to
+# disk in chunks, which enforces UPLOAD_MAX_BYTES, hashes the bytes for the result cache
+# and sniffs the real image type from the first bytes, never holding the whole file in
+# memory. The image is then decoded once, rotated per its EXIF orientation, downscaled
+# to the job type's input size and written as the PNG the model reads.
+import hashlib
+import os
+import uuid
+
+from PIL import Image, ImageOps
+from prometheus_client import Counter
+
+import atomic_files
+import job_tracing
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+# Images with more pixels are rejected before they are decoded (decompression bombs)
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', str(40_000_000)))
+CHUNK_SIZE = 64 * 1024
+# Longest side, in pixels, inputs are downscaled to per job type. TripoSR conditions on
+# 512x512 crops of the foreground; overridable as UPLOAD_INPUT_SIZES="3d_model=1024,sketch=768"
+INPUT_SIZES = {
+    '3d_model': 1024,
+    'disney': 1024,
+    'sketch': 1024,
+}
+for _size in os.environ.get('UPLOAD_INPUT_SIZES', '').split(','):
+    if _size.strip():
+        _job_type, _, _value = _size.partition('=')
+        INPUT_SIZES[_job_type.strip()] = int(_value)
+
+# Leading bytes of the accepted image formats
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpeg',
+}
+
+REJECTIONS = Counter('upload_rejections_total', 'Uploads rejected by ingestion, by reason', ['reason'])
+
+
+class UploadRejected(Exception):
+    """An upload that is answered with status_code (413 or 415) and the message"""
+
+    def __init__(self, message, status_code, reason):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+
+
+def sniff(head):
+    """The image format of a file starting with head, or None"""
+    for signature, image_format in SIGNATURES.items():
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def _copy(stream, path, max_bytes):
+    """Copy stream to path in chunks; return (sha256 hex digest, detected format)"""
+    digest = hashlib.sha256()
+    size = 0
+    image_format = None
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            if size == 0:
+                image_format = sniff(chunk)
+                if image_format is None:
+                    raise UploadRejected('File is not a PNG or JPEG image', 415, 'type')
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(f'File is larger than {max_bytes} bytes', 413, 'size')
+            digest.update(chunk)
+            f.write(chunk)
+    if size == 0:
+        raise UploadRejected('File is empty', 415, 'type')
+    return digest.hexdigest(), image_format
+
+
+def normalize(raw_path, path, max_side):
+    """Decode the raw upload once and write it as an upright PNG no larger than max_side"""
+    try:
+        with Image.open(raw_path) as image:
+            # The header gives the size without decoding the pixels
+            if image.width * image.height > UPLOAD_MAX_PIXELS:
+                raise UploadRejected(f'Image is larger than {UPLOAD_MAX_PIXELS} pixels', 413, 'pixels')
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    except UploadRejected:
+        raise
+    except Exception as e:
+        # Right signature, but Pillow can't decode it (truncated or corrupt)
+        raise UploadRejected(f'Image could not be decoded: {str(e)}', 415, 'decode')
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    with atomic_files.atomic_path(path) as tmp_path:
+        image.save(tmp_path, format='PNG')
+
+
+def ingest(file, path, job_type, max_bytes=UPLOAD_MAX_BYTES):
+    """Store the uploaded FileStorage at path as the job's input PNG
+
+    Returns the sha256 of the uploaded bytes. Raises UploadRejected for oversized,
+    non-image or undecodable uploads, leaving nothing behind.
+    """
+    raw_path = f"{path}.{uuid.uuid4().hex}.upload"
+    try:
+        with job_tracing.span('upload_ingest', job_type=job_type):
+            digest, _ = _copy(file.stream, raw_path, max_bytes)
+            normalize(raw_path, path, INPUT_SIZES.get(job_type, 1024))
+    except UploadRejected as e:
+        REJECTIONS.labels(e.reason).inc()
+        raise
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return digest
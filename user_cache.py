@@ -0,0 +1,41 @@
+# user_cache.py
+# Small in-process cache of user roles, so authorization checks on hot endpoints don't
+# query the database. Entries expire after USER_CACHE_TTL seconds; a role change made
+# through this process invalidates its entry at once, other processes pick it up when
+# their entry expires.
+import os
+import threading
+import time
+
+import job_store
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+
+# user_id -> (expires_at, user row or None)
+_entries = {}
+_lock = threading.Lock()
+
+
+def get_user(user_id):
+    """The user's id, is_admin, role_version and lane, or None if there is no such user"""
+    now = time.monotonic()
+    entry = _entries.get(user_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    user = job_store.get_user(user_id)
+    with _lock:
+        if len(_entries) >= USER_CACHE_MAX_ENTRIES:
+            # Drop expired entries first, everything if that isn't enough
+            for key in [key for key, (expires_at, _) in _entries.items() if expires_at <= now]:
+                del _entries[key]
+            if len(_entries) >= USER_CACHE_MAX_ENTRIES:
+                _entries.clear()
+        _entries[user_id] = (now + USER_CACHE_TTL, user)
+    return user
+
+
+def invalidate(user_id):
+    with _lock:
+        _entries.pop(user_id, None)